@@ -0,0 +1,271 @@
+# batch.py
+"""
+Wsadowa (bez okna) analiza wielu plików wideo.
+
+Przykład:
+    python batch.py "D:/DVR/2025-05-15/*.dav" -o wyniki --procesy 8 --prog 15
+    python batch.py nagrania/*.mp4 -o wyniki --config parametry.json
+
+Pliki są rozdzielane na pulę procesów roboczych, po każdym pliku wypisywane
+jest podsumowanie, a na końcu zapisywany jest manifest wyników w formacie JSON.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from instrumentation import AnalysisMonitor, format_progress
+
+# Domyślne wartości takie same jak w interfejsie (ui.py)
+DEFAULT_PARAMS = {
+    "roi_top": 10.0,
+    "roi_bottom": 90.0,
+    "seconds_before": 5.0,
+    "seconds_after": 5.0,
+    "motion_threshold": 20.0,
+    "flicker_filter_intensity": 2.0,
+    "merge_gap_threshold": 5.0,
+    "show_motion": False,
+    "merge_fragments": False,
+    "save_fragments": True,
+    "peak_thumbnails": False,
+    "motion_display_time": 2.0,
+    "motion_display_scale": 0.5
+}
+
+# (flaga, klucz w params, typ, opis)
+PARAM_FLAGS = [
+    ("--roi-top", "roi_top", float, "ROI - górna krawędź (%%)"),
+    ("--roi-bottom", "roi_bottom", float, "ROI - dolna krawędź (%%)"),
+    ("--przed", "seconds_before", float, "sekundy przed ruchem"),
+    ("--po", "seconds_after", float, "sekundy po ruchu"),
+    ("--prog", "motion_threshold", float, "próg wykrywania ruchu"),
+    ("--migotanie", "flicker_filter_intensity", float, "intensywność filtru migotania"),
+    ("--przerwa", "merge_gap_threshold", float, "łącz fragmenty, gdy przerwa < sekundy"),
+    ("--zakresy", "parallel_chunks", int, "dziel każde nagranie na tyle równoległych zakresów czasu"),
+    ("--dekoder", "decoder", str, "źródło klatek: opencv (domyślnie) lub ffmpeg"),
+    ("--szerokosc", "decode_width", int, "dekoder ffmpeg: zmniejsz klatki do tej szerokości"),
+    ("--fps-analizy", "decode_fps", float, "dekoder ffmpeg: analizuj tyle klatek na sekundę"),
+    ("--watki-wynikow", "postprocess_workers", int, "ile wyników (wykresy, ffmpeg) zapisywać równocześnie po analizie"),
+    ("--indeks", "peak_index", str, "dopisz szczyty do indeksu SQLite (wyszukiwanie: peak_index.py)"),
+]
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".dav", ".mkv")
+
+
+def expand_inputs(patterns):
+    """Rozwija ścieżki, maski (glob) i katalogi do listy plików wideo bez duplikatów."""
+    files = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                os.path.join(pattern, name) for name in os.listdir(pattern)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for path in matches:
+            if not os.path.isfile(path):
+                print(f"Pominięto (brak pliku): {path}", file=sys.stderr)
+                continue
+            key = os.path.normcase(os.path.abspath(path))
+            if key not in seen:
+                seen.add(key)
+                files.append(path)
+    return files
+
+
+def load_params(config_path=None, overrides=None):
+    """Składa słownik params: wartości domyślne < plik konfiguracyjny JSON < flagi."""
+    params = dict(DEFAULT_PARAMS)
+    if config_path:
+        with open(config_path, "r", encoding="utf-8") as f:
+            params.update(json.load(f))
+    if overrides:
+        params.update({k: v for k, v in overrides.items() if v is not None})
+    # Tryb wsadowy działa bez ekranu
+    params["show_motion"] = False
+    return params
+
+
+def drop_shared_recording_start(params, file_count=None):
+    """
+    Napis params["recording_start"] opisuje początek jednego nagrania - przy wielu
+    plikach (file_count != 1, None - nieznana liczba) jest pomijany, żeby wszystkie
+    nagrania nie dostały tego samego czasu zegarowego. Słownik {plik: początek}
+    zostaje bez zmian.
+    """
+    value = params.get("recording_start")
+    if not value or isinstance(value, dict) or file_count == 1:
+        return params
+    print("Pominięto recording_start z konfiguracji - przy wielu plikach podaj słownik "
+          "{nazwa pliku: początek nagrania}", file=sys.stderr)
+    return {key: v for key, v in params.items() if key != "recording_start"}
+
+
+def _init_worker():
+    # Każdy proces roboczy dostaje jeden rdzeń - bez tego OpenCV uruchamia
+    # własne wątki w każdym procesie i rdzenie są przeciążone.
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def _print_progress(event):
+    if event["event"] == "progress":
+        print(format_progress(event), file=sys.stderr, flush=True)
+    elif event["event"] == "resume":
+        print(event["message"], file=sys.stderr, flush=True)
+
+
+def _analyze_one(video_file, output_dir, params, show_progress=False):
+    from video_processing import analyze_video
+    start = time.perf_counter()
+    monitor = AnalysisMonitor(callback=_print_progress if show_progress else None, progress_interval=5.0)
+    try:
+        result = analyze_video(video_file, output_dir, params, monitor=monitor)
+        return {
+            "file": video_file,
+            "status": "ok",
+            "seconds": round(time.perf_counter() - start, 3),
+            "peaks_count": len(result.get("peaks", [])),
+            "result": result
+        }
+    except Exception as e:
+        return {
+            "file": video_file,
+            "status": "error",
+            "seconds": round(time.perf_counter() - start, 3),
+            "error": str(e)
+        }
+
+
+def format_summary(entry):
+    name = os.path.basename(entry["file"])
+    if entry["status"] == "ok":
+        text = f"[OK]    {name}: {entry['peaks_count']} fragmentów ruchu, {entry['seconds']:.1f} s"
+        for notice in entry["result"].get("timings", {}).get("notices", []):
+            text += f"\n        uwaga: {notice}"
+        return text
+    return f"[BŁĄD]  {name}: {entry['error']} ({entry['seconds']:.1f} s)"
+
+
+def run_batch(video_files, output_dir, params, workers=None, show_progress=False):
+    """
+    Analizuje pliki w puli procesów; zwraca listę wyników w kolejności wejściowej.
+    show_progress - każdy proces co kilka sekund wypisuje postęp swojego pliku (stderr).
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(video_files)))
+    results = {}
+    if workers == 1:
+        for video in video_files:
+            entry = _analyze_one(video, output_dir, params, show_progress)
+            print(format_summary(entry), flush=True)
+            results[video] = entry
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(_analyze_one, video, output_dir, params, show_progress): video
+                       for video in video_files}
+            for future in as_completed(futures):
+                entry = future.result()
+                print(format_summary(entry), flush=True)
+                results[futures[future]] = entry
+    return [results[video] for video in video_files]
+
+
+def write_manifest(entries, params, manifest_path, wall_seconds, workers):
+    manifest = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "workers": workers,
+        "wall_seconds": round(wall_seconds, 3),
+        "params": params,
+        "files": entries
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=str)
+    return manifest_path
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analizator ruchu 2025 - tryb wsadowy (bez okna).")
+    parser.add_argument("inputs", nargs="+", help="pliki wideo, maski (np. *.dav) lub katalogi")
+    parser.add_argument("-o", "--output", required=True, help="katalog wyjściowy")
+    parser.add_argument("-c", "--config", help="plik JSON z parametrami analizy (klucze jak w params)")
+    parser.add_argument("-j", "--procesy", type=int, default=None,
+                        help="liczba procesów roboczych (domyślnie liczba rdzeni)")
+    parser.add_argument("--manifest", help="ścieżka manifestu JSON (domyślnie w katalogu wyjściowym)")
+    for flag, key, typ, help_text in PARAM_FLAGS:
+        parser.add_argument(flag, dest=key, type=typ, default=None, help=help_text)
+    parser.add_argument("--polacz", dest="merge_fragments", action="store_true", default=None,
+                        help="połącz fragmenty w jeden plik")
+    parser.add_argument("--bez-fragmentow", dest="save_fragments", action="store_false", default=None,
+                        help="nie zapisuj osobnych plików fragmentów (np. razem z --polacz)")
+    parser.add_argument("--miniatury", dest="peak_thumbnails", action="store_true", default=None,
+                        help="zapisz miniaturę każdego szczytu (katalog Szczyty)")
+    parser.add_argument("--mapa-komorek", dest="spatial_cell_accum", action="store_true", default=None,
+                        help="akumuluj mapę ruchu od razu w rozdzielczości komórek (mniej pamięci)")
+    parser.add_argument("--cache", dest="score_cache", action="store_true", default=None,
+                        help="zapamiętaj wyniki klatek; ponowna analiza z innym progiem nie dekoduje nagrania")
+    parser.add_argument("--zgrubnie", dest="coarse_scan", action="store_true", default=None,
+                        help="dwustopniowe wyszukiwanie: zgrubny przebieg, dokładna analiza tylko okien z ruchem")
+    parser.add_argument("--migotanie-w-szarosci", dest="flicker_filter_gray", action="store_true", default=None,
+                        help="filtr migotania po zamianie na szarość (szybciej, ale inna skala wyników - dobierz próg od nowa)")
+    parser.add_argument("--tylko-roi", dest="decode_crop_roi", action="store_true", default=None,
+                        help="dekoder ffmpeg: dekoduj tylko pas ROI")
+    parser.add_argument("--prog-adaptacyjny", dest="adaptive_threshold", action="store_true", default=None,
+                        help="podnoś próg, gdy rośnie poziom szumu w spoczynku (np. tryb IR)")
+    parser.add_argument("--tlumienie-swiatla", dest="suppress_illumination", action="store_true", default=None,
+                        help="pomijaj zmiany oświetlenia całego kadru (włączenie światła, przełączenie dzień/IR)")
+    parser.add_argument("--czasy", dest="timing_log", action="store_true", default=None,
+                        help="zapisz czasy etapów analizy każdego pliku (czasy_*.json)")
+    parser.add_argument("--postep", action="store_true", help="wypisuj postęp analizy każdego pliku")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    overrides = {key: getattr(args, key) for _, key, _, _ in PARAM_FLAGS}
+    overrides["merge_fragments"] = args.merge_fragments
+    overrides["decode_crop_roi"] = args.decode_crop_roi
+    overrides["flicker_filter_gray"] = args.flicker_filter_gray
+    overrides["save_fragments"] = args.save_fragments
+    overrides["peak_thumbnails"] = args.peak_thumbnails
+    overrides["spatial_cell_accum"] = args.spatial_cell_accum
+    overrides["score_cache"] = args.score_cache
+    overrides["coarse_scan"] = args.coarse_scan
+    overrides["timing_log"] = args.timing_log
+    overrides["adaptive_threshold"] = args.adaptive_threshold
+    overrides["suppress_illumination"] = args.suppress_illumination
+    params = load_params(args.config, overrides)
+
+    video_files = expand_inputs(args.inputs)
+    if not video_files:
+        print("Nie znaleziono plików do analizy.", file=sys.stderr)
+        return 1
+    params = drop_shared_recording_start(params, len(video_files))
+    os.makedirs(args.output, exist_ok=True)
+
+    workers = max(1, min(args.procesy or os.cpu_count() or 1, len(video_files)))
+    print(f"Analiza {len(video_files)} plików, procesy: {workers}", flush=True)
+    start = time.perf_counter()
+    entries = run_batch(video_files, args.output, params, workers, show_progress=args.postep)
+    wall_seconds = time.perf_counter() - start
+
+    manifest_path = args.manifest or os.path.join(
+        args.output, f"manifest_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    write_manifest(entries, params, manifest_path, wall_seconds, workers)
+
+    failed = sum(1 for e in entries if e["status"] != "ok")
+    print(f"\nZakończono w {wall_seconds:.1f} s: {len(entries) - failed} OK, {failed} błędów.")
+    print(f"Manifest: {manifest_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
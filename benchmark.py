@@ -0,0 +1,273 @@
+# benchmark.py
+"""
+Testy wydajności na syntetycznych nagraniach "schodów".
+
+Generowane są deterministyczne filmy (stałe tło, migotanie oświetlenia i szum,
+poruszające się obiekty w znanych momentach) w kilku rozdzielczościach.
+Dla każdego mierzone są:
+  - czas poszczególnych etapów (apply_flicker_filter, process_frame,
+    FrameKernel.process, merge_motion_peaks, generate_spatial_analysis_image),
+  - pełne analyze_video: klatki/s, czas i szczytowe zużycie pamięci (RSS)
+    w osobnym procesie,
+  - zgodność wykrytych szczytów z podłożonymi zdarzeniami,
+  - opcjonalnie (--zgrubnie) analiza dwustopniowa (coarse_scan): czas, udział
+    zdekodowanych klatek i zgodność szczytów z pełną analizą.
+Wyniki zapisywane są jako JSON, który można porównać z poprzednim przebiegiem:
+
+    python benchmark.py -o benchmark_wyniki
+    python benchmark.py -o benchmark_wyniki --zgrubnie
+    python benchmark.py -o benchmark_wyniki --porownaj benchmark_wyniki/benchmark_20250601_120000.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from evaluation import match_events
+
+RESOLUTIONS = {
+    "360p": (640, 360),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+}
+
+BENCH_PARAMS = {
+    "roi_top": 10.0,
+    "roi_bottom": 90.0,
+    "seconds_before": 1.0,
+    "seconds_after": 1.0,
+    "motion_threshold": 8.0,
+    "flicker_filter_intensity": 2.0,
+    "merge_gap_threshold": 1.0,
+    "show_motion": False,
+    "merge_fragments": False,
+    "save_fragments": False,
+}
+
+# Dopuszczalna różnica start/max/end_frame szczytów analizy dwustopniowej względem pełnej
+COARSE_TOLERANCE_FRAMES = 0
+
+
+def planted_events(seconds, seed=0):
+    """Deterministyczne zdarzenia (start_s, koniec_s) - mniej więcej jedno na 20 s nagrania."""
+    rng = np.random.default_rng(seed)
+    events = []
+    t = 5.0
+    while t < seconds - 8:
+        duration = float(rng.uniform(2.0, 4.0))
+        events.append((round(t, 2), round(t + duration, 2)))
+        t += duration + float(rng.uniform(10.0, 25.0))
+    return events
+
+
+def generate_synthetic_video(path, size, seconds, fps=25, seed=0):
+    """Zapisuje film i zwraca listę podłożonych zdarzeń."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    # Tło: gradient + tekstura "stopni"
+    yy, xx = np.mgrid[0:height, 0:width]
+    background = (60 + 80 * yy / height + 20 * ((yy // max(1, height // 12)) % 2)).astype(np.float32)
+    background += cv2.GaussianBlur(rng.normal(0, 12, (height, width)).astype(np.float32), (0, 0), 3)
+    background = np.dstack([background, background * 0.95, background * 0.9])
+    events = planted_events(seconds, seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    # Obiekt ma własną teksturę (jak sylwetka), więc różnica obejmuje całą jego powierzchnię
+    blob_w, blob_h = width // 6, int(height * 0.6)
+    blob = np.dstack([rng.integers(40, 230, (blob_h, blob_w)).astype(np.float32)] * 3)
+    for idx in range(int(seconds * fps)):
+        t = idx / fps
+        # Migotanie: wolna sinusoida jasności + słaby szum
+        flicker = 3.0 * np.sin(2 * np.pi * 0.7 * t)
+        frame = background + flicker + rng.normal(0, 1.5, (1, 1, 3))
+        for start, end in events:
+            if start <= t < end:
+                progress = (t - start) / (end - start)
+                x = int(progress * (width - blob_w))
+                y = int(height * 0.2)
+                frame[y:y + blob_h, x:x + blob_w] = blob
+        writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    writer.release()
+    return events
+
+
+def _time_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def stage_timings(size, repeat=20, seed=0):
+    """Czas pojedynczego wywołania każdego etapu (sekundy)."""
+    from video_processing import (FrameKernel, apply_flicker_filter, generate_spatial_analysis_image,
+                                  merge_motion_peaks, process_frame)
+    width, height = size
+    rng = np.random.default_rng(seed)
+    frame_a = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frame_b = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    gray_a = cv2.cvtColor(frame_a, cv2.COLOR_BGR2GRAY)
+    gray_b = cv2.cvtColor(frame_b, cv2.COLOR_BGR2GRAY)
+    kernel = FrameKernel(2.0, 0.1, 0.9)
+    kernel.reset(frame_a)
+    accum = np.zeros((height, width), dtype=np.float32)
+    frames = [frame_a, frame_b]
+    counter = iter(range(10 ** 9))
+
+    peaks = []
+    for i in range(2000):
+        start = i * 50.0
+        peaks.append({"start_frame": i * 1250, "start_time": start, "start_time_str": "",
+                      "max_score": float(i % 7), "max_frame": i * 1250 + 10, "max_time": start + 0.4,
+                      "max_time_str": "", "end_frame": i * 1250 + 60, "end_time": start + 2.4 + (i % 3) * 30,
+                      "end_time_str": ""})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        return {
+            "apply_flicker_filter": _time_call(lambda: apply_flicker_filter(frame_a, 2.0), repeat),
+            "process_frame": _time_call(lambda: process_frame(gray_a, gray_b), repeat),
+            "frame_kernel": _time_call(lambda: kernel.process(frames[next(counter) % 2], accum), repeat),
+            "merge_motion_peaks_2000": _time_call(lambda: merge_motion_peaks([dict(p) for p in peaks]), 5),
+            "spatial_analysis_image": _time_call(
+                lambda: generate_spatial_analysis_image(accum, tmp, "bench", "t", size), 3),
+        }
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 ** 2
+        except (ImportError, AttributeError):
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux podaje KB, macOS bajty
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+def _run_analysis(video_path, output_dir, params):
+    """Wywoływane w osobnym procesie, żeby RSS dotyczył tylko tej analizy."""
+    from video_processing import analyze_video
+    start = time.perf_counter()
+    result = analyze_video(video_path, output_dir, params)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "peak_rss_mb": _peak_rss_mb(), "peaks": result["peaks"],
+            "decoded_fraction": result.get("coarse_decoded_fraction")}
+
+
+def coarse_case(video_path, work_dir, params, full_run):
+    """Analiza dwustopniowa tego samego nagrania porównana z pełną."""
+    from coarse_scan import peaks_match
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        run = pool.submit(_run_analysis, video_path, os.path.join(work_dir, "wyniki_zgrubne"),
+                          dict(params, coarse_scan=True)).result()
+    return {
+        "analysis_seconds": round(run["seconds"], 3),
+        "speedup": round(full_run["seconds"] / run["seconds"], 2),
+        "decoded_fraction": run["decoded_fraction"],
+        "peaks_match": peaks_match(run["peaks"], full_run["peaks"], COARSE_TOLERANCE_FRAMES),
+    }
+
+
+def run_case(name, size, seconds, work_dir, params, fps=25, coarse=False):
+    video_path = os.path.join(work_dir, f"syntetyczny_{name}_{seconds}s.avi")
+    events = generate_synthetic_video(video_path, size, seconds, fps=fps)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        run = pool.submit(_run_analysis, video_path, os.path.join(work_dir, "wyniki"), params).result()
+    frames = int(seconds * fps)
+    case = {
+        "case": f"{name}_{seconds}s",
+        "resolution": list(size),
+        "seconds": seconds,
+        "frames": frames,
+        "analysis_seconds": round(run["seconds"], 3),
+        "fps": round(frames / run["seconds"], 1),
+        "peak_rss_mb": round(run["peak_rss_mb"], 1) if run["peak_rss_mb"] else None,
+        "ground_truth": match_events(run["peaks"], events),
+        "stages_ms": {k: round(v * 1000, 3) for k, v in stage_timings(size).items()},
+    }
+    if coarse:
+        case["coarse"] = coarse_case(video_path, work_dir, params, run)
+    return case
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def compare(current, previous):
+    """Wypisuje zmianę klatek/s i czasów etapów względem poprzedniego pliku wyników."""
+    old_cases = {c["case"]: c for c in previous["cases"]}
+    for case in current["cases"]:
+        old = old_cases.get(case["case"])
+        if old is None:
+            continue
+        print(f"{case['case']}: {old['fps']} -> {case['fps']} klatek/s ({case['fps'] / old['fps']:.2f}x)")
+        for stage, ms in case["stages_ms"].items():
+            if stage in old["stages_ms"] and old["stages_ms"][stage]:
+                print(f"    {stage}: {old['stages_ms'][stage]} -> {ms} ms ({old['stages_ms'][stage] / ms:.2f}x)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Testy wydajności na syntetycznych nagraniach.")
+    parser.add_argument("-o", "--output", default="benchmark_wyniki", help="katalog na wyniki JSON")
+    parser.add_argument("--rozdzielczosci", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--sekundy", nargs="+", type=int, default=[60], help="długości nagrań (s)")
+    parser.add_argument("--porownaj", help="poprzedni plik JSON do porównania")
+    parser.add_argument("--params", help="plik JSON nadpisujący parametry analizy")
+    parser.add_argument("--zgrubnie", action="store_true",
+                        help="porównaj też analizę dwustopniową (czas, zdekodowane klatki, zgodność szczytów)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = dict(BENCH_PARAMS)
+    if args.params:
+        with open(args.params, "r", encoding="utf-8") as f:
+            params.update(json.load(f))
+    os.makedirs(args.output, exist_ok=True)
+    cases = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.rozdzielczosci:
+            for seconds in args.sekundy:
+                case = run_case(name, RESOLUTIONS[name], seconds, work_dir, params, coarse=args.zgrubnie)
+                gt = case["ground_truth"]
+                print(f"{name} {seconds}s: {case['fps']} klatek/s, RSS {case['peak_rss_mb']} MB, "
+                      f"recall {gt['recall']:.2f}, precision {gt['precision']:.2f}", flush=True)
+                if "coarse" in case:
+                    coarse = case["coarse"]
+                    print(f"    dwustopniowo: {coarse['speedup']:.2f}x, zdekodowano {coarse['decoded_fraction']:.0%} "
+                          f"klatek, szczyty {'zgodne' if coarse['peaks_match'] else 'NIEZGODNE'}", flush=True)
+                cases.append(case)
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "environment": environment(),
+              "params": params, "cases": cases}
+    path = os.path.join(args.output, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Wyniki: {path}")
+    if args.porownaj:
+        with open(args.porownaj, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+    failed = [c for c in cases if c["ground_truth"]["recall"] < 1.0 or not c.get("coarse", {}).get("peaks_match", True)]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
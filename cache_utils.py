@@ -0,0 +1,73 @@
+# cache_utils.py
+"""
+Pomocnicze funkcje dla pamięci podręcznych na dysku: odcisk zawartości pliku
+i usuwanie najdawniej używanych wpisów po przekroczeniu limitu rozmiaru.
+"""
+
+import hashlib
+import os
+import tempfile
+
+# Rozmiar każdej z trzech próbek pliku (początek, środek, koniec) branych do odcisku
+FINGERPRINT_SAMPLE_BYTES = 4 * 1024 * 1024
+
+
+def default_cache_dir(name):
+    base = os.environ.get("ANALIZATOR_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "analizator_ruchu_cache")
+    path = os.path.join(base, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_fingerprint(path, sample_bytes=FINGERPRINT_SAMPLE_BYTES):
+    """
+    Odcisk zawartości pliku: rozmiar + BLAKE2 z trzech próbek (początek, środek,
+    koniec). Nie zależy od nazwy ani daty pliku, a dla wielogigabajtowych
+    nagrań czyta tylko kilkanaście MB.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= 3 * sample_bytes:
+            digest.update(f.read())
+        else:
+            for offset in (0, size // 2 - sample_bytes // 2, size - sample_bytes):
+                f.seek(offset)
+                digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def touch(path):
+    """Oznacza wpis jako właśnie użyty (czas modyfikacji służy jako znacznik LRU)."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def evict_lru(cache_dir, max_bytes, keep=()):
+    """Usuwa najdawniej używane pliki z cache_dir, aż łączny rozmiar spadnie do max_bytes."""
+    if max_bytes is None:
+        return
+    keep = {os.path.abspath(p) for p in keep}
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isfile(path) or name.endswith(".part"):
+            continue
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
@@ -0,0 +1,364 @@
+# calibration.py
+"""
+Kalibracja parametrów dla nowej kamery w jednym przebiegu.
+
+Nagranie jest dekodowane raz. Dla każdej klatki liczone są od razu wszystkie
+warianty filtru migotania (flicker_filter_intensity) - różnice wszystkich
+wariantów trafiają do jednego bufora i są sumowane wierszami jednym
+wywołaniem cv2.reduce, a wynik każdego pasa ROI to różnica sum
+skumulowanych (dwa odczyty na pas). Wyniki są identyczne z FrameKernel.
+
+Potem, już bez dekodowania, dla każdej serii przeszukiwane są progi
+(motion_threshold) i przerwy łączenia (merge_gap_threshold). Jeśli podano
+listę zdarzeń (plik tekstowy, jedna linia na zdarzenie: "75", "1:15" albo
+zakres "1:15-1:22"; # rozpoczyna komentarz), konfiguracje są szeregowane
+według F1 (precyzja/czułość) i wskazywana jest najlepsza.
+
+Przykład:
+    python calibration.py nagranie.mp4 -o wyniki --zdarzenia zdarzenia.txt
+    python calibration.py nagranie.mp4 -o wyniki --migotanie 0 1 2 3 --pasy 10-90 30-80 \\
+        --zdarzenia zdarzenia.txt --zapisz-parametry kamera_schody.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from batch import _print_progress, load_params
+from evaluation import match_events
+from instrumentation import AnalysisMonitor
+from video_processing import PeakDetector, merge_motion_peaks, open_frame_source
+
+DEFAULT_INTENSITIES = (0.0, 1.0, 2.0, 3.0, 4.0)
+DEFAULT_BANDS = ((10.0, 90.0), (0.0, 100.0), (20.0, 80.0), (30.0, 70.0))
+DEFAULT_GAPS = (0.0, 2.0, 5.0, 10.0)
+# Liczba progów sprawdzanych, gdy nie podano ich jawnie (rozkład geometryczny)
+AUTO_THRESHOLD_STEPS = 24
+# Tolerancja dopasowania szczytu do zdarzenia (sekundy)
+EVENT_TOLERANCE = 2.0
+# Liczba wierszy bloku wyników (bloki są sklejane po dekodowaniu)
+CALIBRATION_BLOCK_ROWS = 8192
+
+
+def parse_time(text):
+    """"75", "1:15", "0:01:15.5" -> sekundy."""
+    seconds = 0.0
+    for part in text.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def load_events(path):
+    """Wczytuje zdarzenia wzorcowe jako listę (początek_s, koniec_s)."""
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if "-" in line:
+                start, end = line.split("-", 1)
+                events.append((parse_time(start), parse_time(end)))
+            else:
+                moment = parse_time(line)
+                events.append((moment, moment))
+    return events
+
+
+def parse_band(text):
+    """"10-90" -> (10.0, 90.0)."""
+    top, bottom = (float(value) for value in text.split("-", 1))
+    if not 0 <= top < bottom <= 100:
+        raise argparse.ArgumentTypeError(f"niepoprawny pas ROI: {text}")
+    return top, bottom
+
+
+class VariantScorer:
+    """
+    Wyniki ruchu wszystkich wariantów (intensywność filtru x pas ROI) dla jednej
+    klatki. Bufory są alokowane przy pierwszej klatce, tak jak w FrameKernel.
+    """
+
+    def __init__(self, intensities, bands, gray_filter=False):
+        self.intensities = list(intensities)
+        self.bands = list(bands)
+        self.gray_filter = gray_filter
+        self.scores = np.zeros((len(self.intensities), len(self.bands)), dtype=np.float64)
+        self.prev = None
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        count = len(self.intensities)
+        self.prev = np.empty((count, height, width), dtype=np.uint8)
+        self.current = np.empty_like(self.prev)
+        # Różnice wszystkich wariantów jedna pod drugą - jedno cv2.reduce na klatkę
+        self.diffs = np.empty((count * height, width), dtype=np.uint8)
+        self._gray = np.empty((height, width), dtype=np.uint8)
+        self._blurred = np.empty((height, width), dtype=np.uint8)
+        self._color = np.empty(shape, dtype=np.uint8) if len(shape) == 3 else None
+        self._color_blurred = np.empty_like(self._color) if self._color is not None else None
+        self._cumulative = np.zeros((count, height + 1), dtype=np.int64)
+        tops = np.array([int(top / 100 * height) for top, _ in self.bands])
+        bottoms = np.array([int(bottom / 100 * height) for _, bottom in self.bands])
+        self._tops, self._bottoms = tops, bottoms
+        self._areas = np.maximum((bottoms - tops) * width, 1).astype(np.float64)
+
+    def _filter_all(self, frame, out):
+        if frame.ndim == 3 and not self.gray_filter:
+            # Filtr w BGR, potem szarość - jak w FrameKernel
+            for i, intensity in enumerate(self.intensities):
+                if intensity <= 0:
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out[i])
+                else:
+                    cv2.GaussianBlur(frame, (0, 0), intensity, dst=self._color_blurred)
+                    cv2.addWeighted(frame, 1.5, self._color_blurred, -0.5, 0, dst=self._color)
+                    cv2.cvtColor(self._color, cv2.COLOR_BGR2GRAY, dst=out[i])
+            return
+        if frame.ndim == 3:
+            src = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        else:
+            src = frame
+        for i, intensity in enumerate(self.intensities):
+            if intensity <= 0:
+                np.copyto(out[i], src)
+            else:
+                cv2.GaussianBlur(src, (0, 0), intensity, dst=self._blurred)
+                cv2.addWeighted(src, 1.5, self._blurred, -0.5, 0, dst=out[i])
+
+    def reset(self, frame):
+        if self.prev is None or self.prev.shape[1:] != frame.shape[:2]:
+            self._allocate(frame.shape)
+        self._filter_all(frame, self.prev)
+
+    def process(self, frame):
+        """Zwraca tablicę wyników [intensywność, pas] (ta sama tablica przy każdym wywołaniu)."""
+        self._filter_all(frame, self.current)
+        count, height, width = self.current.shape
+        for i in range(count):
+            cv2.absdiff(self.prev[i], self.current[i], dst=self.diffs[i * height:(i + 1) * height])
+        row_sums = cv2.reduce(self.diffs, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S)
+        np.cumsum(row_sums.reshape(count, height), axis=1, out=self._cumulative[:, 1:])
+        cumulative = self._cumulative
+        self.scores[:] = (cumulative[:, self._bottoms] - cumulative[:, self._tops]) / self._areas
+        self.prev, self.current = self.current, self.prev
+        return self.scores
+
+
+def score_variants(video_file, params, intensities, bands, monitor=None):
+    """
+    Dekoduje nagranie raz; zwraca (klatki, wyniki[klatka, intensywność, pas], fps, czas nagrania).
+    """
+    monitor = monitor or AnalysisMonitor()
+    # Pasy ROI są wycinane z pełnej klatki
+    params = dict(params, decode_crop_roi=False)
+    with monitor.stage("open_source"):
+        source = open_frame_source(video_file, params, monitor)
+    if source is None:
+        raise Exception(f"Nie udało się otworzyć pliku: {video_file}")
+    fps = source.fps
+    video_duration = source.frame_count / fps
+    monitor.start(video_file, source.frame_count)
+    scorer = VariantScorer(intensities, bands, params.get("flicker_filter_gray", False))
+    shape = (CALIBRATION_BLOCK_ROWS, len(scorer.intensities), len(scorer.bands))
+    blocks = []
+    block = np.empty(shape, dtype=np.float32)
+    row = 0
+    frames = []
+    stages = monitor.stages
+    clock = time.perf_counter
+    try:
+        ret, frame = source.read()
+        if not ret or frame is None:
+            raise Exception(f"Nie udało się odczytać pierwszej klatki z {video_file}")
+        scorer.reset(frame)
+        while True:
+            t0 = clock()
+            ret, frame = source.read()
+            t1 = clock()
+            stages["decode"] += t1 - t0
+            if not ret:
+                break
+            # Numer klatki nagrania (przy decode_fps kolejne klatki nie mają kolejnych numerów)
+            frame_idx = source.frame_index
+            frames.append(frame_idx)
+            block[row] = scorer.process(frame)
+            stages["variants"] += clock() - t1
+            row += 1
+            if row == CALIBRATION_BLOCK_ROWS:
+                blocks.append(block)
+                block = np.empty(shape, dtype=np.float32)
+                row = 0
+            monitor.frames_done(frame_idx)
+    finally:
+        source.release()
+    scores = np.concatenate(blocks + [block[:row]])
+    return np.asarray(frames, dtype=np.int64), scores, fps, video_duration
+
+
+def auto_thresholds(scores, steps=AUTO_THRESHOLD_STEPS):
+    """Progi rozłożone geometrycznie między poziomem szumu (mediana) a maksimum serii."""
+    if len(scores) == 0:
+        return []
+    low = max(float(np.median(scores)) * 1.1, 0.01)
+    high = float(scores.max()) * 0.95
+    if high <= low:
+        return [round(low, 2)]
+    return sorted({round(float(value), 2) for value in np.geomspace(low, high, steps)})
+
+
+def sweep(frames, scores, fps, video_duration, params, thresholds, gaps, events=None,
+          tolerance=EVENT_TOLERANCE):
+    """Szczyty dla każdej pary (próg, przerwa) jednej serii wyników; bez dekodowania."""
+    expanded = [(start - tolerance, end + tolerance) for start, end in events] if events is not None else None
+    results = []
+    for threshold in thresholds:
+        detector = PeakDetector(threshold, params["seconds_before"], params["seconds_after"], fps, video_duration)
+        detector.feed_series(frames, scores)
+        peaks = detector.finish()
+        for gap in gaps:
+            # merge_motion_peaks zmienia słowniki szczytów - każda przerwa dostaje kopię
+            merged = merge_motion_peaks([dict(peak) for peak in peaks], frame_tolerance=5, gap_threshold=gap)
+            result = {"motion_threshold": threshold, "merge_gap_threshold": gap, "peaks": len(merged)}
+            if expanded is not None:
+                match = match_events(merged, expanded)
+                precision, recall = match["precision"], match["recall"]
+                result.update(precision=round(precision, 4), recall=round(recall, 4),
+                              f1=round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0)
+            results.append(result)
+    return results
+
+
+def calibrate(video_file, params, intensities=DEFAULT_INTENSITIES, bands=DEFAULT_BANDS, thresholds=None,
+              gaps=DEFAULT_GAPS, events=None, tolerance=EVENT_TOLERANCE, monitor=None):
+    """
+    Jeden przebieg dekodowania + przeszukanie progów i przerw dla każdego wariantu.
+    Zwraca raport (słownik JSON) z wynikami posortowanymi od najlepszego
+    (z events) albo według odstępu maksimum od szumu (bez events).
+    """
+    monitor = monitor or AnalysisMonitor()
+    frames, scores, fps, video_duration = score_variants(video_file, params, intensities, bands, monitor)
+    variants = []
+    results = []
+    with monitor.stage("sweep"):
+        for i, intensity in enumerate(intensities):
+            for j, (top, bottom) in enumerate(bands):
+                series = scores[:, i, j]
+                noise = float(np.percentile(series, 99)) if len(series) else 0.0
+                peak = float(series.max()) if len(series) else 0.0
+                variant = {"flicker_filter_intensity": intensity, "roi_top": top, "roi_bottom": bottom,
+                           "median": round(float(np.median(series)), 4) if len(series) else 0.0,
+                           "p99": round(noise, 4), "max": round(peak, 4),
+                           "separation": round(peak / noise, 3) if noise else None}
+                variants.append(variant)
+                variant_thresholds = thresholds or auto_thresholds(series)
+                for result in sweep(frames, series, fps, video_duration, params, variant_thresholds, gaps,
+                                    events, tolerance):
+                    results.append(dict(flicker_filter_intensity=intensity, roi_top=top, roi_bottom=bottom,
+                                        **result))
+    if events is not None:
+        # Przy równym F1 wyższy próg - większy zapas na szum
+        results.sort(key=lambda r: (-r["f1"], -r["recall"], -r["motion_threshold"]))
+        best = results[0] if results else None
+    else:
+        variants.sort(key=lambda v: -(v["separation"] or 0))
+        best = None
+    return {
+        "file": video_file,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "frames": len(frames),
+        "fps": fps,
+        "events": events,
+        "tolerance": tolerance,
+        "variants": variants,
+        "results": results,
+        "best": best,
+        "timings": monitor.summary(),
+    }
+
+
+def best_params(params, report):
+    """params uzupełnione najlepszą konfiguracją (do użycia przez -c w batch.py/ingest.py)."""
+    best = report["best"]
+    if best is None:
+        return None
+    updated = dict(params)
+    for name in ("flicker_filter_intensity", "roi_top", "roi_bottom", "motion_threshold", "merge_gap_threshold"):
+        updated[name] = best[name]
+    return updated
+
+
+def format_result(result):
+    text = (f"migotanie {result['flicker_filter_intensity']:g}, ROI {result['roi_top']:g}-{result['roi_bottom']:g}%, "
+            f"próg {result['motion_threshold']:g}, przerwa {result['merge_gap_threshold']:g} s: "
+            f"{result['peaks']} fragmentów")
+    if "f1" in result:
+        text += f", precyzja {result['precision']:.2f}, czułość {result['recall']:.2f}, F1 {result['f1']:.2f}"
+    return text
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analizator ruchu 2025 - kalibracja parametrów w jednym przebiegu.")
+    parser.add_argument("video", help="nagranie z kamery do kalibracji")
+    parser.add_argument("-o", "--output", required=True, help="katalog na raport kalibracji")
+    parser.add_argument("-c", "--config", help="plik JSON z parametrami bazowymi (czasy przed/po, dekoder...)")
+    parser.add_argument("--zdarzenia", help="plik z momentami lub zakresami prawdziwych zdarzeń")
+    parser.add_argument("--tolerancja", type=float, default=EVENT_TOLERANCE,
+                        help="tolerancja dopasowania zdarzeń w sekundach (domyślnie %(default)s)")
+    parser.add_argument("--migotanie", type=float, nargs="+", default=list(DEFAULT_INTENSITIES),
+                        help="sprawdzane intensywności filtru migotania")
+    parser.add_argument("--pasy", type=parse_band, nargs="+", default=list(DEFAULT_BANDS),
+                        help="sprawdzane pasy ROI w %%, np. 10-90 30-80")
+    parser.add_argument("--progi", type=float, nargs="+", default=None,
+                        help="sprawdzane progi (domyślnie dobierane z rozkładu wyników)")
+    parser.add_argument("--przerwy", type=float, nargs="+", default=list(DEFAULT_GAPS),
+                        help="sprawdzane przerwy łączenia fragmentów (s)")
+    parser.add_argument("--najlepsze", type=int, default=10, help="ile najlepszych konfiguracji wypisać")
+    parser.add_argument("--zapisz-parametry", help="zapisz parametry najlepszej konfiguracji do pliku JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = load_params(args.config)
+    events = load_events(args.zdarzenia) if args.zdarzenia else None
+    monitor = AnalysisMonitor(callback=_print_progress, progress_interval=5.0)
+    report = calibrate(args.video, params, args.migotanie, args.pasy, args.progi, args.przerwy, events,
+                       args.tolerancja, monitor)
+
+    os.makedirs(args.output, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(args.video))[0]
+    report_path = os.path.join(args.output,
+                               f"kalibracja_{base_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"{report['frames']} klatek, {len(report['variants'])} wariantów, "
+          f"{len(report['results'])} konfiguracji w {report['timings']['elapsed']:.1f} s")
+    if events is None:
+        print("Bez listy zdarzeń (--zdarzenia) nie można wskazać najlepszej konfiguracji. "
+              "Warianty według odstępu maksimum od szumu (max / p99):")
+        for variant in report["variants"][:args.najlepsze]:
+            print(f"  migotanie {variant['flicker_filter_intensity']:g}, "
+                  f"ROI {variant['roi_top']:g}-{variant['roi_bottom']:g}%: szum (p99) {variant['p99']:.2f}, "
+                  f"maksimum {variant['max']:.2f}")
+    else:
+        for result in report["results"][:args.najlepsze]:
+            print("  " + format_result(result))
+        if report["best"] is not None:
+            print(f"Najlepsza: {format_result(report['best'])}")
+            if args.zapisz_parametry:
+                with open(args.zapisz_parametry, "w", encoding="utf-8") as f:
+                    json.dump(best_params(params, report), f, ensure_ascii=False, indent=2)
+                print(f"Parametry: {args.zapisz_parametry}")
+    print(f"Raport: {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
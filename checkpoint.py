@@ -0,0 +1,70 @@
+# checkpoint.py
+"""
+Punkty kontrolne analizy sekwencyjnej.
+
+Co params["checkpoint_seconds"] sekund (domyślnie 60) pętla analizy zapisuje
+do params["checkpoint_path"] swój stan: numer klatki, poprzednią klatkę po
+filtrze, stan maszyny szczytów (bieżący szczyt i zamknięte szczyty), akumulator
+przestrzenny, pozycję zapisu serii wyników i ścieżki plików wyników. Po awarii
+lub ponownym uruchomieniu analiza tego samego pliku z tymi samymi parametrami
+wznawia pracę od zapisanej klatki, dopisując do tych samych plików.
+
+Punkt kontrolny jest ważny tylko dla tej samej zawartości pliku i tych samych
+parametrów wpływających na wyniki klatek i szczyty. Zapis jest atomowy
+(plik .part i zamiana nazwy), więc przerwanie w trakcie zapisu nie psuje
+poprzedniego punktu.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cache_utils import file_fingerprint
+from noise_floor import NOISE_FLOOR_PARAMS
+from score_cache import SCORING_PARAMS
+
+CHECKPOINT_SECONDS = 60
+
+# Oprócz parametrów wyniku klatki stan zależy od parametrów maszyny szczytów
+_STATE_PARAMS = ("motion_threshold", "seconds_before", "seconds_after", "peak_thumbnails") + NOISE_FLOOR_PARAMS
+
+
+def checkpoint_key(video_file, params):
+    relevant = {name: params.get(name, default) for name, default in SCORING_PARAMS.items()}
+    relevant.update({name: params.get(name) for name in _STATE_PARAMS})
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(file_fingerprint(video_file).encode())
+    digest.update(json.dumps(relevant, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def save_checkpoint(path, key, state, arrays):
+    """state - słownik JSON, arrays - tablice NumPy (nazwa -> tablica, None jest pomijane)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    part_file = f"{path}.{os.getpid()}.part"
+    arrays = {name: array for name, array in arrays.items() if array is not None}
+    with open(part_file, "wb") as f:
+        np.savez(f, state=np.array(json.dumps(dict(state, key=key))), **arrays)
+    os.replace(part_file, path)
+
+
+def load_checkpoint(path, key):
+    """Zwraca (state, arrays) albo None, jeśli punktu nie ma lub dotyczy innego pliku/parametrów."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            state = json.loads(str(data["state"]))
+            arrays = {name: data[name] for name in data.files if name != "state"}
+    except (OSError, ValueError, KeyError):
+        return None
+    if state.get("key") != key:
+        return None
+    return state, arrays
+
+
+def remove_checkpoint(path):
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,204 @@
+# chunked_analysis.py
+"""
+Równoległa analiza jednego długiego nagrania.
+
+Nagranie dzielone jest na zakresy klatek, każdy zakres liczony jest w osobnym
+procesie (proces otwiera to samo źródło klatek co analiza sekwencyjna -
+params["decoder"] i opcje decode_* - i sam przewija do swojej pierwszej
+klatki), a wyniki klatek i akumulatory przestrzenne są sklejane w kolejności.
+Przed sklejeniem sprawdzane jest, czy każdy zakres zwrócił dokładnie swoje
+klatki - zakres krótszy niż zamówiony (błąd dekodowania, niedokładne
+przewijanie) przerywa analizę zamiast przesunąć numery klatek kolejnych
+zakresów. Przewijanie dekodera ffmpeg (-ss przed wejściem, z dekodowaniem od
+poprzedniej klatki kluczowej) jest dokładne także dla długich GOP H.264;
+cv2.VideoCapture przewija według znaczników czasu kontenera. Maszyna stanów szczytów
+(PeakDetector) przechodzi potem po całej sklejonej serii w procesie głównym,
+więc szczyty przechodzące przez granicę zakresów wychodzą tak samo jak
+w analizie sekwencyjnej.
+
+Użycie: params["parallel_chunks"] = liczba procesów (> 1).
+"""
+
+import math
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from instrumentation import AnalysisCancelled, AnalysisMonitor
+from motion_series import MotionSeriesWriter, load_motion_series
+from video_processing import (FrameKernel, ScreenshotCollector, cache_scores, detect_motion_peaks,
+                              finish_analysis, kernel_roi, open_frame_source, prepare_output,
+                              spatial_accum_shape, timing_log_path)
+
+# Krótsze zakresy nie opłacają się - koszt startu procesu i przewijania
+MIN_CHUNK_FRAMES = 500
+# Co ile klatek proces roboczy sprawdza, czy analiza nie została przerwana
+CANCEL_CHECK_FRAMES = 256
+# Co ile sekund proces główny sprawdza przerwanie i raportuje postęp
+CANCEL_POLL_SECONDS = 0.2
+
+# Zdarzenie przerwania przekazane procesom roboczym przy starcie puli
+_cancel_event = None
+
+
+def _init_range_worker(cancel_event):
+    global _cancel_event
+    _cancel_event = cancel_event
+
+
+def split_frame_ranges(frame_count, chunks):
+    """Dzieli klatki 1..frame_count-1 (te, dla których liczona jest różnica) na zakresy [start, end)."""
+    chunks = max(1, min(chunks, (frame_count - 1) // MIN_CHUNK_FRAMES or 1))
+    bounds = np.linspace(1, frame_count, chunks + 1).astype(int)
+    ranges = [(int(bounds[i]), int(bounds[i + 1])) for i in range(chunks)]
+    # Ostatni zakres czyta do końca pliku - liczba klatek z kontenera bywa zaniżona
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def _score_range(video_source, params, start_frame, end_frame, accum_shape, screenshot_args=None):
+    """
+    Liczy wyniki klatek start_frame..end_frame-1. Klatka start_frame-1 jest
+    czytana tylko jako poprzednia klatka do różnicy. Zrzuty krawędzi ROI
+    wypadające w tym zakresie zapisywane są po drodze.
+    Zwraca (start_frame, numery klatek, wyniki, spatial_accum).
+    """
+    cv2.setNumThreads(1)
+    source = open_frame_source(video_source, params)
+    if source is None:
+        raise Exception(f"Nie udało się otworzyć pliku: {video_source}")
+    try:
+        spatial_accum = np.zeros(accum_shape, dtype=np.float32)
+        if start_frame > 1:
+            source.seek(start_frame - 1)
+        ret, frame = source.read()
+        if not ret:
+            return start_frame, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), spatial_accum
+        screenshots = None
+        if screenshot_args is not None:
+            screenshots = ScreenshotCollector(*screenshot_args, frame_range=(start_frame - 1, end_frame))
+            screenshots.offer(start_frame - 1, frame)
+        roi_top, roi_bottom = kernel_roi(params)
+        kernel = FrameKernel(params["flicker_filter_intensity"], roi_top=roi_top, roi_bottom=roi_bottom,
+                             gray_filter=params.get("flicker_filter_gray", False))
+        kernel.reset(frame)
+        frames, scores = [], []
+        while True:
+            if len(scores) % CANCEL_CHECK_FRAMES == 0 and _cancel_event is not None and _cancel_event.is_set():
+                break
+            ret, frame = source.read()
+            if not ret:
+                break
+            # Numery klatek nagrania (przy decode_fps co frame_step klatek)
+            frame_idx = source.frame_index
+            if screenshots is not None:
+                screenshots.offer(frame_idx, frame)
+            if end_frame is not None and frame_idx >= end_frame:
+                break
+            scores.append(kernel.process(frame, spatial_accum))
+            frames.append(frame_idx)
+        if screenshots is not None and end_frame is None:
+            screenshots.finish()
+        return start_frame, np.asarray(frames, dtype=np.int64), np.asarray(scores, dtype=np.float64), spatial_accum
+    finally:
+        source.release()
+
+
+def _check_ranges(ranges, parts, frame_step=1.0):
+    """
+    Każdy zakres poza ostatnim musi zwrócić dokładnie swoje klatki - inaczej seria
+    miałaby dziury lub przesunięcia. Przy frame_step > 1 (decode_fps) zakres
+    obejmuje klatki siatki dekodera od start do end - 1.
+    """
+    max_gap = math.ceil(frame_step)
+    for (start, end), (part_start, frames, scores, _) in zip(ranges, parts):
+        if part_start != start or len(frames) != len(scores) or \
+                (len(frames) and (frames[0] < start or frames[0] - start >= frame_step or
+                                  np.any(np.diff(frames) > max_gap))):
+            raise Exception(f"Zakres klatek od {start}: niezgodne numery klatek")
+        if end is not None and (not len(frames) or end - frames[-1] > frame_step):
+            expected = round((end - start) / frame_step)
+            raise Exception(f"Zakres klatek {start}-{end} zwrócił {len(frames)} klatek zamiast {expected} "
+                            f"(błąd dekodowania albo niedokładne przewijanie nagrania) - użyj --dekoder ffmpeg "
+                            f"albo analizy bez --zakresy")
+
+
+def score_video_parallel(video_source, frame_count, frame_size, params, workers, screenshot_args=None,
+                         monitor=None, frame_step=1.0):
+    """
+    Zwraca (numery klatek, wyniki klatek, spatial_accum) policzone w puli procesów.
+    Postęp (monitor.frames_done) raportowany jest po zakończeniu każdego zakresu.
+    """
+    ranges = split_frame_ranges(frame_count, workers)
+    accum_shape = spatial_accum_shape(frame_size, params)
+    cancel_event = multiprocessing.Event()
+    with ProcessPoolExecutor(max_workers=len(ranges), initializer=_init_range_worker,
+                             initargs=(cancel_event,)) as pool:
+        pending = {pool.submit(_score_range, video_source, params, start, end, accum_shape, screenshot_args)
+                   for start, end in ranges}
+        parts = []
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                parts.extend(future.result() for future in done)
+                if monitor is not None:
+                    monitor.frames_done(int(sum(len(part[2]) for part in parts) * frame_step))
+        except BaseException:
+            # Przerwanie albo błąd jednego zakresu (np. dekodowania) kończy wszystkie - bez tego
+            # wyjście z puli czekałoby, aż pozostałe zakresy zdekodują się do końca. Procesy
+            # robocze przerywają zakresy przy najbliższym sprawdzeniu - czekamy na nie,
+            # żeby nie zapisały zrzutów po sprzątaniu wyników
+            cancel_event.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+    parts.sort(key=lambda part: part[0])
+    _check_ranges(ranges, parts, frame_step)
+    frames = np.concatenate([part[1] for part in parts])
+    scores = np.concatenate([part[2] for part in parts])
+    spatial_accum = parts[0][3]
+    for part in parts[1:]:
+        spatial_accum += part[3]
+    return frames, scores, spatial_accum
+
+
+def analyze_video_chunked(video_file, output_dir, params, monitor=None):
+    """Odpowiednik analyze_video liczący wyniki klatek równolegle w zakresach czasu."""
+    monitor = monitor or AnalysisMonitor()
+    with monitor.stage("open_source"):
+        source = open_frame_source(video_file, params, monitor)
+    if source is None:
+        raise Exception(f"Nie udało się otworzyć pliku: {video_file}")
+    frame_count, fps, frame_size, frame_step = source.frame_count, source.fps, source.frame_size, source.frame_step
+    # Pliki DAV (dekoder OpenCV) są już skonwertowane - procesy czytają plik z pamięci podręcznej
+    video_source = source.temp_file or video_file
+    source.release()
+    video_duration = frame_count / fps
+    out = prepare_output(video_file, output_dir)
+    monitor.start(video_file, frame_count, timing_log_path(params, out), output=out)
+
+    if params.get("peak_thumbnails"):
+        monitor.notice("Miniatury szczytów nie są zapisywane w analizie równoległej (parallel_chunks) - "
+                       "szczyty są wyznaczane dopiero po połączeniu fragmentów.")
+    workers = min(int(params["parallel_chunks"]), os.cpu_count() or 1)
+    roi_top, roi_bottom = kernel_roi(params)
+    screenshot_args = (frame_count, out["out_dir"], out["base_name"], out["timestamp"],
+                       roi_top * 100, roi_bottom * 100)
+    with monitor.stage("parallel_scoring"):
+        frames, scores, spatial_accum = score_video_parallel(video_source, frame_count, frame_size, params,
+                                                             workers, screenshot_args, monitor, frame_step)
+
+    series_writer = MotionSeriesWriter(out["output_csv"], out["series_npy"])
+    series_writer.extend(frames, frames / fps, scores)
+    series_writer.close()
+    series = load_motion_series(out["series_npy"])
+    with monitor.stage("score_cache"):
+        cache_scores(video_file, params, series, spatial_accum, fps, frame_count, frame_size, video_duration, out)
+    with monitor.stage("detect_peaks"):
+        motion_peaks = detect_motion_peaks(series, params, fps, video_duration)
+
+    return finish_analysis(video_file, params, out, motion_peaks, series,
+                           spatial_accum, fps, frame_size, video_duration, screenshots_done=True,
+                           monitor=monitor, video_source=source.temp_file)
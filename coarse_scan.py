@@ -0,0 +1,317 @@
+# coarse_scan.py
+"""
+Dwustopniowe wykrywanie ruchu dla długich, w większości pustych nagrań.
+
+1. Przebieg zgrubny: mocno zmniejszone klatki, domyślnie same klatki kluczowe
+   (dekoder ffmpeg z -skip_frame nokey - pozostałe klatki nie są dekodowane;
+   coarse_keyframes_only=False: co n-ta klatka, ale dekodowane są wszystkie).
+   Wynik klatki zgrubnej dotyczy całego odcinka od poprzedniej klatki zgrubnej;
+   odcinki z wynikiem powyżej motion_threshold * coarse_ratio wyznaczają okna
+   kandydatów (z marginesem).
+2. Przebieg dokładny: okna są scalane i czytane w jednym przebiegu po nagraniu
+   (przewijanie tylko między oknami) przez to samo źródło klatek co pełna
+   analiza (open_frame_source - params["decoder"], pas ROI, decode_width,
+   decode_fps), a wyniki trafiają do tej samej maszyny stanów (PeakDetector),
+   więc start_frame/max_frame/end_frame są wyznaczane dokładnie.
+
+Zgodność z pełnym przebiegiem reguluje margines okna (coarse_margin_seconds):
+szczyt jest odtwarzany dokładnie, jeżeli jego początek leży nie dalej niż
+margines od odcinka zgrubnego, który go wykrył. Ruch krótszy niż odstęp klatek
+kluczowych, po którym kadr wraca do stanu sprzed ruchu, nie jest widoczny
+w przebiegu zgrubnym. Zysk zależy od kodeka: w nagraniach z samych klatek
+kluczowych (np. MJPEG) przebieg zgrubny dekoduje wszystkie klatki.
+
+Użycie: params["coarse_scan"] = True (parametry coarse_* są opcjonalne).
+"""
+
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from frame_sources import FfmpegFrameSource
+from instrumentation import AnalysisMonitor
+from motion_series import MotionSeriesWriter, load_motion_series
+from video_processing import (FrameKernel, ScreenshotCollector, detect_motion_peaks, finish_analysis, kernel_roi,
+                              open_frame_source, prepare_output, spatial_accum_shape, timing_log_path)
+
+COARSE_DEFAULTS = {
+    "coarse_width": 320,           # szerokość klatek w przebiegu zgrubnym
+    "coarse_fps": 5.0,             # klatek na sekundę w przebiegu zgrubnym (bez coarse_keyframes_only)
+    "coarse_ratio": 0.5,           # próg kandydata = motion_threshold * coarse_ratio
+    "coarse_margin_seconds": 0.5,  # margines okna wokół odcinka z ruchem
+    "coarse_join_seconds": 2.0,    # okna odległe o mniej niż tyle sekund są czytane jednym ciągiem
+    "coarse_keyframes_only": True  # przebieg zgrubny dekoduje tylko klatki kluczowe (ffmpeg -skip_frame nokey)
+}
+
+
+def _coarse_params(params):
+    return {name: params.get(name, default) for name, default in COARSE_DEFAULTS.items()}
+
+
+def _read_frame_times(crc_path):
+    """Czasy klatek (s) z pliku framecrc, w kolejności zwracania klatek przez dekoder."""
+    time_base = None
+    times = []
+    with open(crc_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#tb 0:"):
+                num, den = line.split(":", 1)[1].strip().split("/")
+                time_base = int(num) / int(den)
+            elif line.strip() and not line.startswith("#"):
+                # stream, dts, pts, czas trwania, rozmiar, suma kontrolna
+                times.append(int(line.split(",")[2]) * time_base)
+    return np.asarray(times)
+
+
+def _coarse_scores_ffmpeg(video_source, full_width, params, coarse, monitor=None):
+    if not coarse["coarse_keyframes_only"]:
+        # Co n-ta klatka przez filtr fps - dekodowane są wszystkie klatki nagrania
+        source = FfmpegFrameSource(video_source, gray=True, width=coarse["coarse_width"],
+                                   target_fps=coarse["coarse_fps"])
+        try:
+            scores = _score_stream(source.read, source.frame_size[0] / full_width, params, monitor)
+        finally:
+            source.release()
+        return np.arange(len(scores) + 1) / source.output_fps, scores, source.frame_count
+    # Same klatki kluczowe, każda dokładnie raz (bez powielania do stałego fps). Ich czasy
+    # zapisuje drugie wyjście tego samego procesu (framecrc) - bez ponownego czytania pliku.
+    crc_file = tempfile.NamedTemporaryFile(suffix=".framecrc", delete=False)
+    crc_file.close()
+    try:
+        source = FfmpegFrameSource(video_source, gray=True, width=coarse["coarse_width"],
+                                   input_args=["-vsync", "passthrough", "-skip_frame", "nokey"],
+                                   extra_output_args=["-map", "0:v:0", "-f", "framecrc", "-y", crc_file.name])
+        try:
+            scores = _score_stream(source.read, source.frame_size[0] / full_width, params, monitor)
+        finally:
+            source.release()
+        times = _read_frame_times(crc_file.name)
+    finally:
+        os.remove(crc_file.name)
+    if len(scores) and len(times) != len(scores) + 1:
+        raise Exception(f"Przebieg zgrubny: {len(scores) + 1} klatek kluczowych, {len(times)} znaczników czasu "
+                        f"({video_source})")
+    return times, scores, len(times)
+
+
+def _coarse_scores_opencv(video_source, fps, width, params, coarse, monitor=None):
+    cap = cv2.VideoCapture(video_source)
+    stride = max(1, int(round(fps / coarse["coarse_fps"])))
+    scale = min(1.0, coarse["coarse_width"] / width)
+    decoded = 0
+
+    def read_strided():
+        nonlocal decoded
+        # grab() pomija konwersję kolorów i kopiowanie, ale nie dekodowanie pominiętych klatek
+        for _ in range(stride - 1):
+            if not cap.grab():
+                return False, None
+            decoded += 1
+        ret, frame = cap.read()
+        if not ret:
+            return False, None
+        decoded += 1
+        return True, cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    try:
+        scores = _score_stream(read_strided, scale, params, monitor)
+    finally:
+        cap.release()
+    # Klatka zgrubna i to klatka nagrania (i+1)*stride-1
+    return ((np.arange(len(scores) + 1) + 1) * stride - 1) / fps, scores, decoded
+
+
+def _score_stream(read, scale, params, monitor=None):
+    """Wyniki kolejnych klatek zgrubnych względem poprzedniej (o jeden mniej niż klatek)."""
+    ret, frame = read()
+    if not ret:
+        return np.zeros(0)
+    # Filtr migotania działa w pikselach - promień skalujemy razem z klatką
+    kernel = FrameKernel(params["flicker_filter_intensity"] * scale,
+                         roi_top=params["roi_top"] / 100, roi_bottom=params["roi_bottom"] / 100,
+                         gray_filter=params.get("flicker_filter_gray", False))
+    kernel.reset(frame)
+    scores = []
+    while True:
+        ret, frame = read()
+        if not ret:
+            break
+        if monitor is not None:
+            monitor.check_cancelled()
+        scores.append(kernel.process(frame))
+    return np.asarray(scores)
+
+
+def candidate_windows(times, scores, threshold, margin_seconds, join_seconds, fps, frame_count):
+    """
+    Zamienia odcinki między klatkami zgrubnymi (times[i], times[i+1]) z wynikiem scores[i]
+    powyżej progu na scalone zakresy klatek [start, end). Okna nachodzące na siebie albo
+    odległe o mniej niż join_seconds są łączone - krótki odstęp taniej przeczytać, niż przewijać.
+    """
+    hits = np.flatnonzero(scores > threshold)
+    join_frames = int(join_seconds * fps)
+    windows = []
+    # Różnica zgrubna obejmuje cały odcinek od poprzedniej klatki zgrubnej
+    for t0, t1 in zip(times[hits].tolist(), times[hits + 1].tolist()):
+        start = max(1, int((t0 - margin_seconds) * fps))
+        end = min(frame_count, int((t1 + margin_seconds) * fps) + 1)
+        if windows and start <= windows[-1][1] + join_frames:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return [tuple(w) for w in windows]
+
+
+def _capture_screenshots(source, screenshots, before):
+    """Zrzuty krawędzi o indeksach < before leżące poza oknami - ze źródła klatek przebiegu dokładnego."""
+    for idx in sorted(idx for idx in screenshots.pending if idx < before):
+        source.seek(idx)
+        ret, frame = source.read()
+        if ret:
+            screenshots.offer(idx, frame)
+
+
+def _refine_windows(source, windows, params, spatial_accum, frame_count, screenshots=None, monitor=None):
+    """
+    Pełne wyniki klatek okien w jednym przebiegu po nagraniu - przewijanie tylko
+    między oknami. Jeżeli okno kończy się w trakcie ruchu, czytamy dalej, aż wynik
+    spadnie poniżej progu (szczyt zamyka się w oknie); okno, na które zachodzi takie
+    przedłużenie, jest czytane dalej bez przewijania. Numery klatek pochodzą ze
+    źródła (source.frame_index), więc przy decode_fps są to klatki nagrania.
+    Zwraca (klatki, wyniki, liczba zdekodowanych klatek).
+    """
+    roi_top, roi_bottom = kernel_roi(params)
+    kernel = FrameKernel(params["flicker_filter_intensity"], roi_top=roi_top, roi_bottom=roi_bottom,
+                         gray_filter=params.get("flicker_filter_gray", False))
+    threshold = params["motion_threshold"]
+    frames, scores = [], []
+    decoded = 0
+    # Klatka za ostatnią policzoną - okno zaczynające się wcześniej jest czytane dalej
+    next_idx = 0
+    for start, end in windows:
+        start = max(start, next_idx)
+        if start >= end:
+            continue
+        if start > next_idx or not frames:
+            # Klatka start-1 jest klatką odniesienia dla pierwszej różnicy okna
+            if start - 1 != source.frame_index + 1:
+                if screenshots is not None:
+                    _capture_screenshots(source, screenshots, start - 1)
+                source.seek(start - 1)
+            ret, frame = source.read()
+            if not ret:
+                break
+            decoded += 1
+            if screenshots is not None:
+                screenshots.offer(source.frame_index, frame)
+            kernel.reset(frame)
+        while source.frame_index + 1 < frame_count:
+            if source.frame_index + 1 >= end and scores[-1] <= threshold:
+                break
+            ret, frame = source.read()
+            if not ret:
+                break
+            frame_idx = source.frame_index
+            decoded += 1
+            frames.append(frame_idx)
+            scores.append(kernel.process(frame, spatial_accum))
+            if screenshots is not None:
+                screenshots.offer(frame_idx, frame)
+            if monitor is not None:
+                # Postęp liczony pozycją w nagraniu - klatki poza oknami są pomijane
+                monitor.frames_done(frame_idx + 1)
+        next_idx = source.frame_index + 1
+    return frames, scores, decoded
+
+
+def coarse_to_fine_scores(video_file, params, monitor=None, out=None):
+    """
+    Zwraca (klatki, wyniki, spatial_accum, fps, liczba klatek, rozmiar klatki, okna,
+    zdekodowane klatki {"coarse_pass", "refine_pass"}).
+    Klatki spoza okien nie są liczone - przyjmuje się, że nie ma w nich ruchu.
+    Z out (prepare_output) zrzuty krawędzi są zapisywane w przebiegu dokładnym.
+    """
+    monitor = monitor or AnalysisMonitor()
+    coarse = _coarse_params(params)
+    # Przebieg dokładny czyta klatki tym samym źródłem co pełna analiza (params["decoder"])
+    with monitor.stage("open_source"):
+        source = open_frame_source(video_file, params, monitor)
+    if source is None:
+        raise Exception(f"Nie udało się otworzyć pliku: {video_file}")
+    fps = source.fps
+    frame_count = source.frame_count
+    frame_size = source.frame_size
+    video_source = source.temp_file or video_file
+    monitor.frame_count = frame_count
+    spatial_accum = np.zeros(spatial_accum_shape(frame_size, params), dtype=np.float32)
+    screenshots = None
+    if out is not None:
+        roi_top, roi_bottom = kernel_roi(params)
+        screenshots = ScreenshotCollector(frame_count, out["out_dir"], out["base_name"], out["timestamp"],
+                                          roi_top * 100, roi_bottom * 100)
+    try:
+        with monitor.stage("coarse_pass"):
+            if params.get("decoder") == "ffmpeg" or coarse["coarse_keyframes_only"]:
+                times, coarse_scores, coarse_decoded = _coarse_scores_ffmpeg(video_source, frame_size[0], params,
+                                                                             coarse, monitor)
+            else:
+                times, coarse_scores, coarse_decoded = _coarse_scores_opencv(video_source, fps, frame_size[0], params,
+                                                                             coarse, monitor)
+        windows = candidate_windows(times, coarse_scores, params["motion_threshold"] * coarse["coarse_ratio"],
+                                    coarse["coarse_margin_seconds"], coarse["coarse_join_seconds"], fps, frame_count)
+        with monitor.stage("refine_windows"):
+            frames, scores, refine_decoded = _refine_windows(source, windows, params, spatial_accum, frame_count,
+                                                             screenshots, monitor)
+        if screenshots is not None:
+            with monitor.stage("screenshots"):
+                _capture_screenshots(source, screenshots, frame_count)
+                screenshots.finish()
+    finally:
+        source.release()
+    decoded = {"coarse_pass": coarse_decoded, "refine_pass": refine_decoded}
+    return (np.asarray(frames, dtype=np.int64), np.asarray(scores, dtype=np.float64), spatial_accum, fps,
+            frame_count, frame_size, windows, decoded)
+
+
+def peaks_match(peaks, reference, tolerance_frames):
+    """Czy dwie listy szczytów są zgodne z dokładnością do tolerance_frames (początek, maksimum, koniec)."""
+    if len(peaks) != len(reference):
+        return False
+    for a, b in zip(peaks, reference):
+        for key in ("start_frame", "max_frame", "end_frame"):
+            if abs(a[key] - b[key]) > tolerance_frames:
+                return False
+    return True
+
+
+def analyze_video_coarse(video_file, output_dir, params, monitor=None):
+    """Odpowiednik analyze_video z dwustopniowym wyszukiwaniem ruchu."""
+    monitor = monitor or AnalysisMonitor()
+    out = prepare_output(video_file, output_dir)
+    monitor.start(video_file, 0, timing_log_path(params, out), output=out)
+    if params.get("peak_thumbnails"):
+        monitor.notice("Miniatury szczytów nie są zapisywane w analizie dwustopniowej (coarse_scan).")
+    if params.get("show_motion"):
+        monitor.notice("Podgląd ruchu (show_motion) nie jest wyświetlany w analizie dwustopniowej (coarse_scan).")
+    (frames, scores, spatial_accum, fps, frame_count, frame_size,
+     windows, decoded) = coarse_to_fine_scores(video_file, params, monitor, out)
+    video_duration = frame_count / fps
+
+    # Seria zawiera tylko klatki z okien kandydatów
+    series_writer = MotionSeriesWriter(out["output_csv"], out["series_npy"])
+    series_writer.extend(frames, frames / fps, scores)
+    series_writer.close()
+    series = load_motion_series(out["series_npy"])
+    with monitor.stage("detect_peaks"):
+        motion_peaks = detect_motion_peaks(series, params, fps, video_duration)
+
+    result = finish_analysis(video_file, params, out, motion_peaks, series,
+                             spatial_accum, fps, frame_size, video_duration, screenshots_done=True,
+                             monitor=monitor)
+    result["coarse_windows"] = windows
+    # Klatki faktycznie zdekodowane w obu przebiegach (nie tylko te z wynikiem)
+    result["coarse_decoded_frames"] = decoded
+    result["coarse_decoded_fraction"] = round(sum(decoded.values()) / max(1, frame_count), 4)
+    return result
@@ -1,12 +1,58 @@
 # diagnostics.py
+"""
+Testy diagnostyczne środowiska (importy zależności, okno Tkinter).
+
+Wynik udanego testu jest zapamiętywany w katalogu pamięci podręcznej razem
+z opisem środowiska (interpreter, wersje OpenCV, NumPy, matplotlib). Przy
+kolejnych uruchomieniach testy są pomijane, dopóki środowisko się nie zmieni
+- okno testowe Tkinter i import matplotlib nie opóźniają startu programu.
+"""
+
+import json
+import os
+import sys
+
+# Pakiety, których wersja wchodzi do opisu środowiska (pierwsza znaleziona nazwa)
+ENVIRONMENT_PACKAGES = (
+    ("opencv-python", "opencv-python-headless", "opencv-contrib-python"),
+    ("numpy",),
+    ("matplotlib",),
+)
+
+def environment_key():
+    """Opis środowiska bez importowania zależności (tylko metadane pakietów)."""
+    from importlib import metadata
+    versions = {}
+    for names in ENVIRONMENT_PACKAGES:
+        for name in names:
+            try:
+                versions[names[0]] = metadata.version(name)
+                break
+            except metadata.PackageNotFoundError:
+                continue
+    return {"executable": sys.executable, "python": sys.version, "packages": versions}
+
+def _result_path():
+    from cache_utils import default_cache_dir
+    return os.path.join(default_cache_dir("diagnostics"), "wynik.json")
+
+def diagnostics_passed():
+    """True, jeśli testy przeszły już w tym samym środowisku."""
+    try:
+        with open(_result_path(), "r", encoding="utf-8") as f:
+            return json.load(f) == environment_key()
+    except (OSError, ValueError):
+        return False
 
 def run_import_test():
     print("Test importów:")
     try:
-        import cv2, numpy, matplotlib, pandas, tkinter
+        import cv2, numpy, matplotlib, tkinter
         print("  OK – wszystkie moduły zaimportowane.")
+        return True
     except Exception as e:
         print("  Błąd importu:", e)
+        return False
 
 def run_tkinter_test():
     import tkinter as tk
@@ -19,10 +65,18 @@ def run_tkinter_test():
         root.after(2000, root.destroy)
         root.mainloop()
         print("  OK – Tkinter działa.")
+        return True
     except Exception as e:
         print("  Błąd Tkinter:", e)
+        return False
 
-def run_diagnostic_tests():
-    run_import_test()
-    run_tkinter_test()
+def run_diagnostic_tests(force=False):
+    """Uruchamia testy, chyba że przeszły już w tym środowisku (force=True - zawsze)."""
+    if not force and diagnostics_passed():
+        return True
+    passed = run_import_test() and run_tkinter_test()
     print("Testy diagnostyczne zakończone.\n")
+    if passed:
+        with open(_result_path(), "w", encoding="utf-8") as f:
+            json.dump(environment_key(), f, ensure_ascii=False)
+    return passed
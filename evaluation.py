@@ -0,0 +1,23 @@
+# evaluation.py
+"""
+Ocena wykrytych szczytów względem listy prawdziwych zdarzeń.
+
+Wspólne dla testów wydajności (benchmark.py - zdarzenia podłożone w syntetycznym
+nagraniu) i kalibracji (calibration.py - zdarzenia podane przez użytkownika).
+Szczyt to słownik z "start_time" i "end_time", zdarzenie to para (początek,
+koniec) w sekundach.
+"""
+
+
+def match_events(peaks, events):
+    """Zdarzenie jest wykryte, jeśli nachodzi na nie któryś szczyt; szczyt jest trafny, jeśli nachodzi na zdarzenie."""
+    def overlaps(peak, event):
+        return peak["start_time"] <= event[1] and peak["end_time"] >= event[0]
+    detected = sum(1 for event in events if any(overlaps(p, event) for p in peaks))
+    correct = sum(1 for p in peaks if any(overlaps(p, event) for event in events))
+    return {
+        "events": len(events),
+        "peaks": len(peaks),
+        "recall": detected / len(events) if events else 1.0,
+        "precision": correct / len(peaks) if peaks else 1.0,
+    }
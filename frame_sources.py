@@ -0,0 +1,261 @@
+# frame_sources.py
+"""
+Źródła klatek dla pętli analizy.
+
+Każde źródło udostępnia ten sam interfejs: fps, frame_count, frame_size
+(szerokość, wysokość zwracanych klatek), read() -> (ret, frame), seek()
+i release(). fps i frame_count dotyczą nagrania, a frame_index to numer
+w nagraniu klatki zwróconej ostatnio przez read() - przy zmniejszonej liczbie
+klatek (target_fps) raporty, CSV i szczyty używają więc numerów klatek
+nagrania, a nie kolejnych numerów klatek przerzedzonych.
+
+- OpenCVFrameSource - dotychczasowe cv2.VideoCapture (klatki BGR w pełnej rozdzielczości),
+- FfmpegFrameSource - strumień rawvideo z procesu ffmpeg; konwersja do skali
+  szarości, wycięcie pasa ROI, zmniejszenie rozdzielczości i liczby klatek
+  odbywają się już w dekoderze, więc do Pythona trafia tylko to, co jest liczone.
+"""
+
+import json
+import math
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+
+# Ile ostatnich bajtów komunikatów ffmpeg dołączać do zgłaszanego błędu
+STDERR_TAIL_BYTES = 2000
+
+
+class FrameSource:
+    fps = 0.0
+    frame_count = 0
+    frame_size = (0, 0)
+    # Ile klatek nagrania przypada na jedną zwracaną klatkę (> 1 przy target_fps)
+    frame_step = 1.0
+    # Numer w nagraniu klatki zwróconej ostatnio przez read()
+    frame_index = -1
+    # Ścieżka pliku tymczasowego (np. skonwertowany DAV) albo None
+    temp_file = None
+
+    def read(self):
+        raise NotImplementedError
+
+    def seek(self, frame_idx):
+        """
+        Następne read() zwróci klatkę frame_idx (numeracja od początku nagrania),
+        a przy frame_step > 1 ostatnią zwracaną klatkę nie późniejszą niż frame_idx.
+        """
+        raise NotImplementedError
+
+    def decoder_position(self):
+        """
+        Numer w nagraniu ostatnio zwróconej klatki według dekodera (a nie licznika
+        read()) - do sprawdzenia, czy seek() trafił w żądaną klatkę.
+        """
+        return self.frame_index
+
+    def release(self):
+        pass
+
+
+class OpenCVFrameSource(FrameSource):
+    def __init__(self, cap, temp_file=None):
+        self.cap = cap
+        self.temp_file = temp_file
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if ret:
+            self.frame_index += 1
+        return ret, frame
+
+    def seek(self, frame_idx):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        self.frame_index = frame_idx - 1
+
+    def decoder_position(self):
+        # Przewijanie CAP_PROP_POS_FRAMES bywa niedokładne (klatki kluczowe, zmienne fps) -
+        # pozycja po read() pochodzi ze znacznika czasu zdekodowanej klatki
+        return int(round(self.cap.get(cv2.CAP_PROP_POS_FRAMES))) - 1
+
+    def release(self):
+        self.cap.release()
+
+
+def _parse_rate(rate):
+    if not rate or rate == "0/0":
+        return 0.0
+    if "/" in rate:
+        num, den = rate.split("/")
+        return float(num) / float(den) if float(den) else 0.0
+    return float(rate)
+
+
+def probe_video(video_file):
+    """Zwraca (szerokość, wysokość, fps, liczba klatek, czas trwania) odczytane przez ffprobe."""
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate,nb_frames:format=duration",
+        "-of", "json", video_file
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    fps = _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate"))
+    duration = float(info.get("format", {}).get("duration") or 0)
+    nb_frames = stream.get("nb_frames")
+    frame_count = int(nb_frames) if nb_frames and nb_frames.isdigit() else int(round(duration * fps))
+    return int(stream["width"]), int(stream["height"]), fps, frame_count, duration
+
+
+class FfmpegFrameSource(FrameSource):
+    """
+    Klatki z potoku `ffmpeg ... -f rawvideo pipe:1`.
+
+    gray        - klatki jednokanałowe (pix_fmt gray) zamiast BGR,
+    crop_rows   - (góra, dół) jako ułamki wysokości; dekoder zwraca tylko ten pas,
+    width       - docelowa szerokość (wysokość proporcjonalnie),
+    target_fps  - docelowa liczba klatek na sekundę (filtr fps); fps i frame_count
+                  źródła pozostają wartościami nagrania, a frame_index to numer
+                  klatki nagrania najbliższej zwróconej klatce,
+    start_time  - przewinięcie wejścia (w sekundach) przed dekodowaniem,
+    input_format - wymuszony format wejścia (np. "dhav" dla surowych plików DAV),
+    input_args  - dodatkowe opcje wejścia (np. ["-re"] albo ["-rtsp_transport", "tcp"]),
+    extra_output_args - dodatkowe wyjścia tego samego procesu ffmpeg (np. zapis
+                  segmentów bez rekompresji obok strumienia klatek),
+    source_info - (szerokość, wysokość, fps) podane ręcznie zamiast ffprobe
+                  (wymagane dla wejścia z potoku, którego nie da się sondować).
+
+    Komunikaty ffmpeg trafiają do pliku tymczasowego; jeśli proces zakończy się
+    błędem, read() zgłasza wyjątek z ich końcówką zamiast udawać koniec nagrania.
+    """
+
+    def __init__(self, video_file, gray=True, crop_rows=None, width=None, target_fps=None,
+                 start_time=0.0, input_format=None, input_args=None, extra_output_args=None,
+                 source_info=None):
+        if source_info is not None:
+            src_w, src_h, src_fps = source_info
+            src_count, duration = 0, 0.0
+        else:
+            src_w, src_h, src_fps, src_count, duration = probe_video(video_file)
+        filters = []
+        out_w, out_h = src_w, src_h
+        if crop_rows is not None:
+            top, bottom = int(crop_rows[0] * src_h), int(crop_rows[1] * src_h)
+            out_h = max(1, bottom - top)
+            filters.append(f"crop={src_w}:{out_h}:0:{top}")
+        if width and width < out_w:
+            out_h = max(2, int(round(out_h * width / out_w / 2)) * 2)
+            out_w = int(width)
+            filters.append(f"scale={out_w}:{out_h}:flags=area")
+        self.fps = src_fps
+        self.frame_count = src_count
+        # Liczba klatek na sekundę zwracanych przez dekoder
+        self.output_fps = src_fps
+        if target_fps and target_fps < src_fps:
+            filters.append(f"fps={target_fps}")
+            self.output_fps = float(target_fps)
+            self.frame_step = src_fps / self.output_fps
+        self.video_file = video_file
+        self.frame_size = (out_w, out_h)
+        self.source_size = (src_w, src_h)
+        self.channels = 1 if gray else 3
+        self._frame_bytes = out_w * out_h * self.channels
+
+        # Wejście "-" (potok) jest czytane z stdin procesu nadrzędnego - wtedy bez -nostdin
+        self._from_pipe = video_file in ("-", "pipe:0")
+        input_cmd = []
+        if input_format:
+            input_cmd += ["-f", input_format]
+        input_cmd += list(input_args or [])
+        input_cmd += ["-i", video_file, "-map", "0:v:0", "-an", "-sn"]
+        if filters:
+            input_cmd += ["-vf", ",".join(filters)]
+        input_cmd += ["-pix_fmt", "gray" if gray else "bgr24", "-f", "rawvideo", "pipe:1"]
+        input_cmd += list(extra_output_args or [])
+        self._input_cmd = input_cmd
+        self.proc = None
+        self._stderr = None
+        # Numer (w strumieniu dekodera) ostatnio zwróconej klatki
+        self._output_index = -1
+        if start_time > 0:
+            self.seek(int(start_time * self.fps))
+        else:
+            self._start(0)
+
+    def _start(self, output_index):
+        cmd = ["ffmpeg", "-v", "error"] + ([] if self._from_pipe else ["-nostdin"])
+        if output_index > 0:
+            # Przewinięcie do klatki siatki output_fps - ta sama siatka co przy czytaniu od początku
+            cmd += ["-ss", f"{output_index / self.output_fps:.6f}"]
+        self._output_index = output_index - 1
+        self.frame_index = self._frame_number(self._output_index)
+        self._stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd + self._input_cmd, stdin=None if self._from_pipe else subprocess.DEVNULL,
+                                     stdout=subprocess.PIPE, stderr=self._stderr,
+                                     bufsize=self._frame_bytes * 4)
+
+    def _frame_number(self, output_index):
+        return int(math.floor(output_index * self.frame_step + 0.5))
+
+    def seek(self, frame_idx):
+        # Dekoder jest uruchamiany od nowa z przewinięciem wejścia - od ostatniej
+        # klatki siatki output_fps, której numer nie przekracza frame_idx
+        self.release()
+        output_index = max(0, math.ceil((frame_idx + 0.5) / self.frame_step) - 1)
+        while output_index > 0 and self._frame_number(output_index) > frame_idx:
+            output_index -= 1
+        while self._frame_number(output_index + 1) <= frame_idx:
+            output_index += 1
+        self._start(output_index)
+
+    # decoder_position() z klasy bazowej: -ss przed -i przy dekodowaniu jest dokładne
+    # co do klatki (ffmpeg odrzuca klatki przed znacznikiem czasu), więc licznik
+    # klatek odpowiada pozycji dekodera
+
+    def _stderr_tail(self):
+        self._stderr.seek(0, 2)
+        size = self._stderr.tell()
+        self._stderr.seek(max(0, size - STDERR_TAIL_BYTES))
+        return self._stderr.read().decode("utf-8", "replace").strip()
+
+    def _check_exit(self):
+        """Po końcu danych: błąd ffmpeg zamiast cichego końca nagrania."""
+        returncode = self.proc.wait()
+        if returncode != 0:
+            raise Exception(f"ffmpeg zakończył się błędem ({returncode}) przy dekodowaniu {self.video_file}: "
+                            f"{self._stderr_tail() or 'brak komunikatu'}")
+
+    def read(self):
+        if self.proc is None:
+            return False, None
+        shape = (self.frame_size[1], self.frame_size[0]) if self.channels == 1 else \
+            (self.frame_size[1], self.frame_size[0], 3)
+        frame = np.empty(shape, dtype=np.uint8)
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < self._frame_bytes:
+            n = self.proc.stdout.readinto(view[filled:])
+            if not n:
+                self._check_exit()
+                return False, None
+            filled += n
+        self._output_index += 1
+        self.frame_index = self._frame_number(self._output_index)
+        return True, frame
+
+    def release(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+        self.proc = None
+        self._stderr.close()
+        self._stderr = None
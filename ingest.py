@@ -0,0 +1,223 @@
+# ingest.py
+"""
+Usługa automatycznej analizy nowych nagrań w obserwowanym katalogu.
+
+Katalog jest sprawdzany co poll_seconds sekund. Plik trafia do kolejki
+dopiero wtedy, gdy jego rozmiar i czas modyfikacji nie zmieniły się przez
+stable_seconds sekund (rejestrator skończył zapis). Pliki już przeanalizowane
+są pomijane na podstawie odcisku zawartości (cache_utils.file_fingerprint),
+więc zmiana nazwy lub ponowne skopiowanie nagrania nie powoduje ponownej
+analizy. Rejestr przetworzonych plików zapisywany jest w katalogu wyjściowym
+(ingest_rejestr.json).
+
+Analizy działają w ograniczonej puli procesów. Każde zadanie zapisuje punkty
+kontrolne (checkpoint.py) w katalogu _checkpointy, więc po awarii lub
+ponownym uruchomieniu usługi przerwany plik jest analizowany od ostatniego
+punktu kontrolnego, a nie od początku.
+
+Przykład:
+    python ingest.py "//rejestrator/eksport" -o wyniki -j 2 --prog 15
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from batch import (PARAM_FLAGS, VIDEO_EXTENSIONS, _analyze_one, _init_worker, drop_shared_recording_start,
+                   format_summary, load_params)
+from cache_utils import file_fingerprint
+
+REGISTRY_NAME = "ingest_rejestr.json"
+CHECKPOINT_DIR = "_checkpointy"
+# Co ile sekund sprawdzany jest katalog
+POLL_SECONDS = 10.0
+# Ile sekund plik musi mieć niezmieniony rozmiar i czas modyfikacji
+STABLE_SECONDS = 30.0
+
+
+class FolderWatcher:
+    """Zwraca pliki wideo z katalogu, które przestały rosnąć; każdą wersję pliku tylko raz."""
+
+    def __init__(self, watch_dir, stable_seconds=STABLE_SECONDS):
+        self.watch_dir = watch_dir
+        self.stable_seconds = stable_seconds
+        # ścieżka -> (rozmiar, mtime, od kiedy bez zmian)
+        self._seen = {}
+        self._reported = set()
+
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        ready = []
+        current = set()
+        try:
+            entries = list(os.scandir(self.watch_dir))
+        except OSError as e:
+            print(f"Nie można odczytać katalogu {self.watch_dir}: {e}", file=sys.stderr)
+            return ready
+        for entry in entries:
+            if not entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            path = entry.path
+            current.add(path)
+            version = (stat.st_size, stat.st_mtime_ns)
+            previous = self._seen.get(path)
+            if previous is None or previous[:2] != version:
+                self._seen[path] = (*version, now)
+                continue
+            if now - previous[2] >= self.stable_seconds and (path, *version) not in self._reported:
+                self._reported.add((path, *version))
+                ready.append(path)
+        # Usunięte pliki nie są dłużej śledzone
+        for path in set(self._seen) - current:
+            del self._seen[path]
+        self._reported = {item for item in self._reported if item[0] in current}
+        return sorted(ready)
+
+
+class IngestRegistry:
+    """Rejestr JSON: odcisk zawartości -> {file, status, peaks, finished, error}."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_done(self, fingerprint):
+        return self.entries.get(fingerprint, {}).get("status") == "done"
+
+    def update(self, fingerprint, **fields):
+        self.entries.setdefault(fingerprint, {}).update(fields)
+        part_file = f"{self.path}.part"
+        with open(part_file, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(part_file, self.path)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def run_ingest(watch_dir, output_dir, params, workers=1, poll_seconds=POLL_SECONDS,
+               stable_seconds=STABLE_SECONDS, stop_event=None, max_cycles=None):
+    """
+    Obserwuje watch_dir i analizuje nowe nagrania, dopóki nie zostanie ustawione
+    stop_event (threading.Event). max_cycles - po tylu przeglądach katalogu
+    kończy przyjmowanie plików, dokańcza kolejkę i wraca (np. do uruchomień z crona).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    registry = IngestRegistry(os.path.join(output_dir, REGISTRY_NAME))
+    watcher = FolderWatcher(watch_dir, stable_seconds)
+    checkpoint_dir = os.path.join(output_dir, CHECKPOINT_DIR)
+    # (ścieżka, rozmiar, mtime) -> odcisk; odcisk liczony jest raz dla każdej wersji pliku
+    fingerprints = {}
+    pending = deque()
+    queued = set()
+    failed = set()
+    running = {}
+    cycles = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        while True:
+            accepting = not (stop_event is not None and stop_event.is_set()) and \
+                (max_cycles is None or cycles < max_cycles)
+            if accepting:
+                cycles += 1
+                for path in watcher.poll():
+                    try:
+                        stat = os.stat(path)
+                        key = (path, stat.st_size, stat.st_mtime_ns)
+                        if key not in fingerprints:
+                            fingerprints[key] = file_fingerprint(path)
+                    except OSError:
+                        continue
+                    fingerprint = fingerprints[key]
+                    if fingerprint in queued or fingerprint in failed or registry.is_done(fingerprint):
+                        continue
+                    queued.add(fingerprint)
+                    pending.append((path, fingerprint))
+                    print(f"W kolejce: {path}", flush=True)
+            elif not running and not (pending and (stop_event is None or not stop_event.is_set())):
+                break
+
+            # Nowe zadania tylko do limitu procesów - kolejka czeka w tym procesie
+            while pending and len(running) < workers and not (stop_event is not None and stop_event.is_set()):
+                path, fingerprint = pending.popleft()
+                job_params = dict(params, checkpoint_path=os.path.join(checkpoint_dir, f"{fingerprint}.npz"))
+                registry.update(fingerprint, file=path, status="running", started=_now())
+                running[pool.submit(_analyze_one, path, output_dir, job_params)] = (path, fingerprint)
+
+            if running:
+                done, _ = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+            else:
+                done = ()
+                if stop_event is not None:
+                    stop_event.wait(poll_seconds)
+                elif accepting:
+                    time.sleep(poll_seconds)
+            for future in done:
+                path, fingerprint = running.pop(future)
+                queued.discard(fingerprint)
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    entry = {"file": path, "status": "error", "seconds": 0.0, "error": str(e)}
+                print(format_summary(entry), flush=True)
+                if entry["status"] == "ok":
+                    registry.update(fingerprint, status="done", peaks=entry["peaks_count"],
+                                    seconds=entry["seconds"], finished=_now(), error=None)
+                else:
+                    # Plik z błędem nie wraca do kolejki aż do ponownego uruchomienia usługi
+                    failed.add(fingerprint)
+                    registry.update(fingerprint, status="error", finished=_now(), error=entry["error"])
+    return registry.entries
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analizator ruchu 2025 - automatyczna analiza nowych nagrań w katalogu.")
+    parser.add_argument("watch_dir", help="obserwowany katalog z nagraniami")
+    parser.add_argument("-o", "--output", required=True, help="katalog wyjściowy (tu zapisywany jest też rejestr)")
+    parser.add_argument("-c", "--config", help="plik JSON z parametrami analizy")
+    parser.add_argument("-j", "--procesy", type=int, default=1, help="liczba równoczesnych analiz (domyślnie 1)")
+    parser.add_argument("--interwal", type=float, default=POLL_SECONDS,
+                        help="co ile sekund sprawdzać katalog (domyślnie %(default)s)")
+    parser.add_argument("--stabilnosc", type=float, default=STABLE_SECONDS,
+                        help="ile sekund plik musi się nie zmieniać przed analizą (domyślnie %(default)s)")
+    parser.add_argument("--punkt-kontrolny", dest="checkpoint_seconds", type=float, default=None,
+                        help="co ile sekund zapisywać punkt kontrolny analizy (domyślnie 60)")
+    for flag, key, typ, help_text in PARAM_FLAGS:
+        parser.add_argument(flag, dest=key, type=typ, default=None, help=help_text)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    overrides = {key: getattr(args, key) for _, key, _, _ in PARAM_FLAGS}
+    overrides["checkpoint_seconds"] = args.checkpoint_seconds
+    # Każde nowe nagranie ma własny początek - wspólny napis recording_start nie ma sensu
+    params = drop_shared_recording_start(load_params(args.config, overrides))
+    if not os.path.isdir(args.watch_dir):
+        print(f"Brak katalogu: {args.watch_dir}", file=sys.stderr)
+        return 1
+    print(f"Obserwowanie {args.watch_dir} (co {args.interwal:g} s), procesy: {args.procesy}. Ctrl+C kończy.",
+          flush=True)
+    try:
+        run_ingest(args.watch_dir, args.output, params, max(1, args.procesy), args.interwal, args.stabilnosc)
+    except KeyboardInterrupt:
+        print("\nPrzerwano - przerwane pliki zostaną wznowione przy następnym uruchomieniu.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# instrumentation.py
+"""
+Pomiar czasu etapów analizy i raportowanie postępu.
+
+AnalysisMonitor zbiera łączny czas każdego etapu (dekodowanie, filtr migotania,
+różnica klatek, wykresy, konwersja DAV, procesy ffmpeg...), liczbę przetworzonych
+klatek, bieżącą prędkość i przewidywany czas do końca. Co progress_interval
+sekund wywoływany jest callback(zdarzenie), gdzie zdarzenie to słownik:
+
+    {"event": "progress" | "stage" | "notice" | "resume" | "done", "file": ..., "frames": ..., "frame_count": ...,
+     "fps": ..., "eta_seconds": ..., "elapsed": ..., "stage": ..., "stages": {...},
+     "subprocess_seconds": ..., "message": ...}
+
+Zdarzenie "notice" niesie komunikat dla użytkownika (np. opcja pominięta w danym
+trybie analizy); komunikaty trafiają też do podsumowania pod kluczem "notices".
+Zdarzenie "resume" oznacza wznowienie przerwanej analizy z punktu kontrolnego -
+"frames" to numer pierwszej liczonej klatki, a podsumowanie ma "resumed_from".
+
+Jeśli podano cancel_event (threading.Event), ustawienie go przerywa analizę
+przy następnej klatce lub następnym etapie wyjątkiem AnalysisCancelled.
+
+Opcjonalnie (params["timing_log"]) po analizie zapisywany jest plik
+czasy_<nazwa>_<znacznik>.json z pełnym podsumowaniem.
+
+Przykład:
+    monitor = AnalysisMonitor(callback=lambda e: print(e["frames"], e["eta_seconds"]))
+    analyze_video(plik, katalog, params, monitor=monitor)
+"""
+
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Co ile klatek sprawdzany jest zegar przed ewentualnym wywołaniem callbacku
+PROGRESS_CHECK_FRAMES = 16
+
+
+class AnalysisCancelled(Exception):
+    """Analiza przerwana na żądanie (AnalysisMonitor.cancel_event)."""
+
+
+class AnalysisMonitor:
+    def __init__(self, callback=None, progress_interval=0.5, cancel_event=None):
+        self.callback = callback
+        self.progress_interval = progress_interval
+        self.cancel_event = cancel_event
+        self.stages = defaultdict(float)
+        self.subprocess_stages = set()
+        self.file = None
+        self.frame_count = 0
+        self.frames = 0
+        self.log_path = None
+        # Ścieżki wyników bieżącej analizy (prepare_output) - do sprzątania po przerwaniu
+        self.output = None
+        self.notices = []
+        # Klatka, od której wznowiono analizę z punktu kontrolnego (None - od początku)
+        self.resumed_from = None
+        self._started = time.perf_counter()
+        self._last_report = self._started
+        self._last_report_frames = 0
+        self._last_check_frames = 0
+        self._fps = 0.0
+
+    def start(self, video_file, frame_count=0, log_path=None, output=None):
+        self.file = video_file
+        self.frame_count = frame_count
+        self.log_path = log_path
+        self.output = output
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise AnalysisCancelled(self.file)
+
+    @contextmanager
+    def stage(self, name, subprocess=False):
+        """Mierzy blok kodu jako etap name; subprocess=True oznacza czas procesów zewnętrznych (ffmpeg)."""
+        if subprocess:
+            self.subprocess_stages.add(name)
+        self.check_cancelled()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+            self._emit("stage", stage=name)
+
+    def frames_done(self, frames):
+        """Wywoływane w pętli analizy; callback dostaje postęp co progress_interval sekund."""
+        self.frames = frames
+        self.check_cancelled()
+        if frames - self._last_check_frames < PROGRESS_CHECK_FRAMES:
+            return
+        self._last_check_frames = frames
+        now = time.perf_counter()
+        if now - self._last_report < self.progress_interval:
+            return
+        self._fps = (frames - self._last_report_frames) / (now - self._last_report)
+        self._last_report = now
+        self._last_report_frames = frames
+        self._emit("progress")
+
+    def notice(self, message):
+        """Komunikat dla użytkownika - callback dostaje zdarzenie "notice"."""
+        self.notices.append(message)
+        self._emit("notice", message=message)
+
+    def resumed(self, frame_idx):
+        """Analiza wznowiona od klatki frame_idx - callback dostaje zdarzenie "resume"."""
+        self.resumed_from = frame_idx
+        self.frames = frame_idx
+        self._last_report_frames = frame_idx
+        self._last_check_frames = frame_idx
+        self._emit("resume", message=f"Wznowiono analizę {self.file} od klatki {frame_idx}")
+
+    def eta_seconds(self):
+        if not self.frame_count or not self._fps:
+            return None
+        return max(0.0, (self.frame_count - self.frames) / self._fps)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._started
+        return {
+            "file": self.file,
+            "frames": self.frames,
+            "frame_count": self.frame_count,
+            "elapsed": round(elapsed, 3),
+            "average_fps": round(self.frames / elapsed, 1) if elapsed else 0.0,
+            "stages": {name: round(seconds, 4) for name, seconds in
+                       sorted(self.stages.items(), key=lambda item: -item[1])},
+            "subprocess_seconds": round(sum(self.stages[name] for name in self.subprocess_stages), 4),
+            "notices": list(self.notices),
+            "resumed_from": self.resumed_from,
+        }
+
+    def finish(self):
+        """Zapisuje dziennik czasów (jeśli ustawiono log_path) i zwraca podsumowanie."""
+        summary = self.summary()
+        if self.log_path:
+            with open(self.log_path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+        self._emit("done")
+        return summary
+
+    def _emit(self, event, stage=None, message=None):
+        if self.callback is None:
+            return
+        self.callback({
+            "event": event,
+            "file": self.file,
+            "frames": self.frames,
+            "frame_count": self.frame_count,
+            "fps": round(self._fps, 1),
+            "eta_seconds": self.eta_seconds(),
+            "elapsed": time.perf_counter() - self._started,
+            "stage": stage,
+            "stages": dict(self.stages),
+            "subprocess_seconds": sum(self.stages[name] for name in self.subprocess_stages),
+            "message": message,
+        })
+
+
+def format_progress(event):
+    """Krótki opis postępu do wypisania w konsoli lub pasku stanu."""
+    if event["frame_count"]:
+        text = f"{100 * event['frames'] / event['frame_count']:.0f}% ({event['frames']}/{event['frame_count']} klatek)"
+    else:
+        text = f"{event['frames']} klatek"
+    if event["file"]:
+        text = f"{event['file']}: {text}"
+    if event["fps"]:
+        text += f", {event['fps']:.0f} kl/s"
+    if event["eta_seconds"] is not None:
+        minutes, seconds = divmod(int(event["eta_seconds"]), 60)
+        text += f", pozostało {minutes}:{seconds:02d}"
+    return text
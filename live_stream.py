@@ -0,0 +1,296 @@
+# live_stream.py
+"""
+Wykrywanie ruchu na żywo (kamera RTSP, potok, rosnący plik).
+
+Jeden proces ffmpeg ma dwa wyjścia:
+  1. klatki w skali szarości (rawvideo) do pętli wykrywania - FrameKernel + PeakDetector,
+  2. krótkie segmenty MPEG-TS z oryginalnym strumieniem (bez rekompresji).
+
+Ostatnie seconds_before sekund segmentów trzymane jest w pamięci w buforze
+pierścieniowym o stałym rozmiarze. Gdy zaczyna się ruch, bufor trafia do pliku
+zdarzenia, kolejne segmenty są dopisywane na bieżąco, a po zamknięciu szczytu
+(+ seconds_after) plik jest domykany. Pamięć i opóźnienie nie zależą od czasu
+działania - zakończone szczyty nie są przechowywane.
+
+Przykład (test na lokalnym pliku odtwarzanym w czasie rzeczywistym):
+    python live_stream.py nagranie.mp4 -o wyniki --re
+    python live_stream.py rtsp://kamera/stream -o wyniki --rtsp-tcp --prog 15
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from batch import PARAM_FLAGS, load_params
+from frame_sources import FfmpegFrameSource
+from video_processing import FrameKernel, PeakDetector
+
+# Docelowa długość segmentu (faktyczna zależy od odstępu klatek kluczowych kamery)
+SEGMENT_SECONDS = 1.0
+# Co ile sekund materiału sprawdzana jest lista nowych segmentów
+SEGMENT_POLL_SECONDS = 0.5
+# Opcje z batch.PARAM_FLAGS obsługiwane na żywo - dekoder to zawsze ffmpeg, szczyty nie są
+# łączone, a po zdarzeniu nie powstają raporty, indeks ani inne wyniki analizy pliku
+LIVE_PARAMS = ("roi_top", "roi_bottom", "seconds_before", "seconds_after", "motion_threshold",
+               "flicker_filter_intensity", "decode_width", "decode_fps")
+LIVE_FLAGS = [flag for flag in PARAM_FLAGS if flag[1] in LIVE_PARAMS]
+
+
+class SegmentRing:
+    """Bufor pierścieniowy ostatnich segmentów (start, koniec, dane) obejmujący co najmniej keep_seconds."""
+
+    def __init__(self, keep_seconds):
+        self.keep_seconds = keep_seconds
+        self.segments = deque()
+
+    def push(self, start, end, data):
+        self.segments.append((start, end, data))
+        # Najstarszy segment usuwamy dopiero, gdy bez niego bufor nadal obejmuje keep_seconds
+        while len(self.segments) > 1 and end - self.segments[1][0] >= self.keep_seconds:
+            self.segments.popleft()
+
+    def since(self, start_time):
+        return [data for start, end, data in self.segments if end > start_time]
+
+
+class SegmentWatcher:
+    """Czyta listę segmentów zapisywaną przez ffmpeg i zwraca nowe, zamknięte segmenty (plik jest potem usuwany)."""
+
+    _index_re = re.compile(r"seg_(\d+)\.ts$")
+
+    def __init__(self, segment_dir, list_path):
+        self.segment_dir = segment_dir
+        self.list_path = list_path
+        self.last_index = -1
+
+    def poll(self):
+        try:
+            with open(self.list_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        new_segments = []
+        for line in lines:
+            parts = line.split(",")
+            if len(parts) < 3:
+                continue
+            match = self._index_re.search(parts[0])
+            if not match or int(match.group(1)) <= self.last_index:
+                continue
+            path = os.path.join(self.segment_dir, os.path.basename(parts[0]))
+            try:
+                with open(path, "rb") as seg:
+                    data = seg.read()
+                os.remove(path)
+            except OSError:
+                continue
+            self.last_index = int(match.group(1))
+            new_segments.append((float(parts[1]), float(parts[2]), data))
+        return new_segments
+
+
+class LiveEventRecorder:
+    """
+    Zapisuje zdarzenia ruchu z bufora segmentów do plików, zamykając każde zaraz po jego końcu.
+    Przepakowanie do MP4 działa w osobnym wątku - pętla wykrywania nie czeka na ffmpeg.
+    """
+
+    def __init__(self, out_dir, base_name, seconds_before, started_at, remux_mp4=True):
+        self.out_dir = out_dir
+        self.base_name = base_name
+        self.started_at = started_at
+        self.remux_mp4 = remux_mp4
+        self.ring = SegmentRing(seconds_before + SEGMENT_SECONDS)
+        self.log_path = os.path.join(out_dir, f"zdarzenia_{base_name}.txt")
+        self._file = None
+        self._path = None
+        self._stop_at = None
+        self._last_end = 0.0
+        self._remux = ThreadPoolExecutor(max_workers=1) if remux_mp4 else None
+        self.events_written = 0
+
+    def on_segment(self, start, end, data):
+        self.ring.push(start, end, data)
+        self._last_end = end
+        if self._file is not None:
+            self._file.write(data)
+            if self._stop_at is not None and end >= self._stop_at:
+                self._close()
+
+    def start_event(self, start_time):
+        if self._file is not None:
+            # Nowy ruch przed domknięciem poprzedniego zdarzenia - przedłużamy ten sam plik
+            self._stop_at = None
+            return
+        wall = self.started_at + timedelta(seconds=start_time)
+        self._path = os.path.join(self.out_dir, f"zdarzenie_{self.base_name}_{wall.strftime('%Y%m%d_%H%M%S')}.ts")
+        self._file = open(self._path, "wb")
+        for data in self.ring.since(start_time):
+            self._file.write(data)
+        self._stop_at = None
+
+    def end_event(self, peak):
+        wall = self.started_at + timedelta(seconds=peak["max_time"])
+        with open(self.log_path, "a", encoding="utf-8") as log:
+            log.write(f"{wall.isoformat(sep=' ', timespec='seconds')}\tszczyt {peak['max_score']:.4f}\t"
+                      f"{peak['start_time']:.1f}-{peak['end_time']:.1f} s\n")
+        if self._file is None:
+            return
+        self._stop_at = peak["end_time"]
+        if self._last_end >= self._stop_at:
+            self._close()
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+        self._stop_at = None
+        self.events_written += 1
+        if self._remux is not None:
+            self._remux.submit(self._remux_event, self._path)
+        else:
+            print(f"Zapisano zdarzenie: {self._path}", flush=True)
+
+    @staticmethod
+    def _remux_event(path):
+        mp4_path = os.path.splitext(path)[0] + ".mp4"
+        cmd = ["ffmpeg", "-v", "error", "-i", path, "-map", "0", "-c", "copy", mp4_path, "-y"]
+        if subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode == 0:
+            os.remove(path)
+            path = mp4_path
+        print(f"Zapisano zdarzenie: {path}", flush=True)
+
+    def close(self):
+        """Domyka bieżące zdarzenie i czeka na zakończenie przepakowań."""
+        if self._file is not None:
+            self._close()
+        if self._remux is not None:
+            self._remux.shutdown(wait=True)
+
+
+def _source_name(source):
+    name = os.path.splitext(os.path.basename(source.rstrip("/")))[0] if source not in ("-", "pipe:0") else "potok"
+    return re.sub(r"[^\w.-]+", "_", name) or "kamera"
+
+
+def run_live(source_url, output_dir, params, input_args=None, source_info=None,
+             stop_event=None, max_seconds=None):
+    """Pętla wykrywania na żywo. Kończy się z końcem strumienia, po max_seconds lub po stop_event.set()."""
+    base_name = _source_name(source_url)
+    out_dir = os.path.join(output_dir, base_name)
+    segment_dir = os.path.join(out_dir, "_bufor")
+    os.makedirs(segment_dir, exist_ok=True)
+    list_path = os.path.join(segment_dir, "segmenty.csv")
+    if os.path.exists(list_path):
+        os.remove(list_path)
+
+    segment_args = [
+        "-map", "0:v:0", "-map", "0:a?", "-c", "copy",
+        "-f", "segment", "-segment_time", str(SEGMENT_SECONDS), "-reset_timestamps", "1",
+        "-segment_format", "mpegts", "-segment_list", list_path, "-segment_list_type", "csv",
+        "-segment_list_size", "32",
+        os.path.join(segment_dir, "seg_%08d.ts")
+    ]
+    source = FfmpegFrameSource(source_url, gray=True, width=params.get("decode_width"),
+                               target_fps=params.get("decode_fps"), input_args=input_args,
+                               extra_output_args=segment_args, source_info=source_info)
+    fps = source.fps
+    started_at = datetime.now()
+    kernel = FrameKernel(params["flicker_filter_intensity"],
+                         roi_top=params["roi_top"] / 100, roi_bottom=params["roi_bottom"] / 100,
+                         gray_filter=params.get("flicker_filter_gray", False))
+    detector = PeakDetector(params["motion_threshold"], params["seconds_before"], params["seconds_after"],
+                            fps, float("inf"))
+    recorder = LiveEventRecorder(out_dir, base_name, params["seconds_before"], started_at,
+                                 remux_mp4=params.get("live_remux_mp4", True))
+    watcher = SegmentWatcher(segment_dir, list_path)
+    # Co ile zdekodowanych klatek (przy decode_fps rzadszych niż klatki strumienia)
+    poll_every = max(1, int(source.output_fps * SEGMENT_POLL_SECONDS))
+    frames_read = 0
+    print(f"Nasłuch: {source_url} ({source.frame_size[0]}x{source.frame_size[1]}, {fps:.2f} fps)", flush=True)
+    try:
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frames_read += 1
+            frame_idx = source.frame_index
+            if frames_read == 1:
+                kernel.reset(frame)
+                continue
+            motion_score = kernel.process(frame)
+            if detector.update(frame_idx, motion_score):
+                recorder.start_event(detector.current_peak["start_time"])
+            if detector.peaks:
+                for peak in detector.peaks:
+                    recorder.end_event(peak)
+                # Zakończone szczyty są już zapisane - lista nie rośnie przez dni działania
+                detector.peaks.clear()
+            if frames_read % poll_every == 0:
+                for segment in watcher.poll():
+                    recorder.on_segment(*segment)
+                if stop_event is not None and stop_event.is_set():
+                    break
+                if max_seconds is not None and frame_idx / fps >= max_seconds:
+                    break
+    finally:
+        source.release()
+        # Po zakończeniu ffmpeg lista segmentów jest kompletna
+        time.sleep(SEGMENT_POLL_SECONDS)
+        for segment in watcher.poll():
+            recorder.on_segment(*segment)
+        for peak in detector.finish():
+            recorder.end_event(peak)
+        recorder.close()
+    return recorder.events_written
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analizator ruchu 2025 - wykrywanie ruchu na żywo.")
+    parser.add_argument("source", help="adres strumienia (rtsp://...), plik lub '-' (potok na stdin)")
+    parser.add_argument("-o", "--output", required=True, help="katalog wyjściowy")
+    parser.add_argument("-c", "--config", help="plik JSON z parametrami analizy")
+    for flag, key, typ, help_text in LIVE_FLAGS:
+        parser.add_argument(flag, dest=key, type=typ, default=None, help=help_text)
+    parser.add_argument("--re", action="store_true", help="czytaj plik w tempie odtwarzania (test na nagraniu)")
+    parser.add_argument("--follow", action="store_true", help="czytaj rosnący plik (czekaj na nowe dane)")
+    parser.add_argument("--rtsp-tcp", action="store_true", help="RTSP przez TCP")
+    parser.add_argument("--rozmiar", help="rozmiar klatek dla potoku, np. 1920x1080")
+    parser.add_argument("--fps", type=float, help="liczba klatek na sekundę dla potoku")
+    parser.add_argument("--czas", type=float, help="zakończ po tylu sekundach materiału")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = load_params(args.config, {key: getattr(args, key) for _, key, _, _ in LIVE_FLAGS})
+    input_args = []
+    source = args.source
+    if args.re:
+        input_args.append("-re")
+    if args.rtsp_tcp:
+        input_args += ["-rtsp_transport", "tcp"]
+    if args.follow:
+        input_args += ["-follow", "1"]
+        source = source if source.startswith("file:") else f"file:{source}"
+    source_info = None
+    if args.rozmiar:
+        width, height = (int(v) for v in args.rozmiar.lower().split("x"))
+        source_info = (width, height, args.fps or 25.0)
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        events = run_live(source, args.output, params, input_args=input_args,
+                          source_info=source_info, max_seconds=args.czas)
+    except KeyboardInterrupt:
+        return 0
+    print(f"Zakończono, zapisane zdarzenia: {events}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,17 @@
 # main.py
+import argparse
+
 from diagnostics import run_diagnostic_tests
-from ui import main as run_ui
 
-def main():
-    run_diagnostic_tests()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analizator ruchu 2025")
+    parser.add_argument("--diagnostyka", action="store_true",
+                        help="wymuś testy diagnostyczne (domyślnie tylko przy pierwszym uruchomieniu w danym środowisku)")
+    parser.add_argument("--bez-diagnostyki", action="store_true", help="pomiń testy diagnostyczne")
+    args = parser.parse_args(argv)
+    if not args.bez_diagnostyki:
+        run_diagnostic_tests(force=args.diagnostyka)
+    from ui import main as run_ui
     run_ui()
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+# motion_preview.py
+"""
+Podgląd wykrytego ruchu niezależny od pętli wykrywania.
+
+Pętla analizy tylko wkłada zmniejszoną klatkę do ograniczonej kolejki
+(put_nowait - bez czekania). Osobny wątek wyświetla klatki przez
+motion_display_time sekund każdą. Gdy kolejka jest pełna, nowa klatka jest
+pomijana, więc wyświetlanie nigdy nie spowalnia analizy.
+"""
+
+import queue
+import threading
+import time
+
+import cv2
+
+PREVIEW_WINDOW = "Wykryty ruch"
+# Ile klatek może czekać na wyświetlenie
+PREVIEW_QUEUE_SIZE = 4
+# Co ile ms okno obsługuje zdarzenia i sprawdza zamknięcie podglądu
+PREVIEW_POLL_MS = 50
+
+
+class MotionPreview:
+    def __init__(self, display_time=2.0, scale=0.5, queue_size=PREVIEW_QUEUE_SIZE):
+        self.display_time = display_time
+        self.scale = scale
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def show(self, frame):
+        """Wywoływane z pętli analizy; zwraca False, jeśli klatka została pominięta."""
+        small_frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale)
+        try:
+            self.frames.put_nowait(small_frame)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        shown = False
+        while not self._stop.is_set():
+            try:
+                frame = self.frames.get(timeout=PREVIEW_POLL_MS / 1000)
+            except queue.Empty:
+                continue
+            cv2.imshow(PREVIEW_WINDOW, frame)
+            shown = True
+            deadline = time.monotonic() + self.display_time
+            while time.monotonic() < deadline and not self._stop.is_set():
+                cv2.waitKey(PREVIEW_POLL_MS)
+        if shown:
+            cv2.destroyWindow(PREVIEW_WINDOW)
+            cv2.waitKey(1)
+
+    def close(self):
+        """Zamyka okno podglądu (najpóźniej po PREVIEW_POLL_MS); nieobejrzane klatki są pomijane."""
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,179 @@
+# motion_series.py
+"""
+Seria czasowa wyników ruchu (jedna pozycja na klatkę) zapisywana strumieniowo.
+
+Wartości trafiają do bufora NumPy o stałym rozmiarze; po jego zapełnieniu
+blok jest dopisywany na dysk jednocześnie do pliku CSV (dla ludzi i arkuszy)
+i do pliku .npy (tablica strukturalna frame/time/score). Pamięć nie rośnie
+z długością nagrania, a plik .npy można wczytać bez kopiowania:
+
+    series = load_motion_series("analiza_ruchu_....npy")   # np.memmap
+    series["score"], series["time"], series["frame"]
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+SERIES_DTYPE = np.dtype([("frame", "<i8"), ("time", "<f8"), ("score", "<f8")])
+
+# Nagłówek .npy ma stały rozmiar, żeby po zakończeniu zapisu można było
+# nadpisać w nim liczbę wierszy bez przepisywania danych.
+_NPY_HEADER_BYTES = 256
+
+CSV_HEADER = "klatka,czas_s,czas,wynik_ruchu\n"
+
+
+def _npy_header(dtype, length):
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (length,)})
+    prefix = b"\x93NUMPY\x01\x00"
+    body_len = _NPY_HEADER_BYTES - len(prefix) - 2
+    header = header.ljust(body_len - 1) + "\n"
+    return prefix + body_len.to_bytes(2, "little") + header.encode("latin1")
+
+
+class MotionSeriesWriter:
+    """
+    resume_from - (liczba wierszy, rozmiar CSV w bajtach) zwrócone wcześniej przez
+    position(): pliki są przycinane do tego miejsca i zapis jest kontynuowany.
+    """
+
+    def __init__(self, csv_path=None, npy_path=None, chunk_size=8192, resume_from=None):
+        self.csv_path = csv_path
+        self.npy_path = npy_path
+        self._buffer = np.empty(chunk_size, dtype=SERIES_DTYPE)
+        self._fill = 0
+        self.length = 0
+        self._csv = None
+        self._npy = None
+        if resume_from is not None:
+            self._reopen(*resume_from)
+            return
+        self._csv = open(csv_path, "w", encoding="utf-8", newline="") if csv_path else None
+        self._npy = open(npy_path, "wb") if npy_path else None
+        if self._csv:
+            self._csv.write(CSV_HEADER)
+        if self._npy:
+            self._npy.write(_npy_header(SERIES_DTYPE, 0))
+
+    def _reopen(self, length, csv_bytes):
+        # Po awarii pliki mogą zawierać wiersze zapisane po punkcie wznowienia - obcinamy je
+        self.length = length
+        if self.csv_path:
+            with open(self.csv_path, "r+b") as f:
+                f.truncate(csv_bytes)
+            self._csv = open(self.csv_path, "a", encoding="utf-8", newline="")
+        if self.npy_path:
+            self._npy = open(self.npy_path, "r+b")
+            self._npy.truncate(_NPY_HEADER_BYTES + length * SERIES_DTYPE.itemsize)
+            self._npy.seek(0, 2)
+
+    def position(self):
+        """Zapisuje bufor na dysk i zwraca (liczba wierszy, rozmiar CSV w bajtach) - punkt wznowienia."""
+        self.flush()
+        csv_bytes = 0
+        if self._csv:
+            self._csv.flush()
+            csv_bytes = self._csv.tell()
+        if self._npy:
+            self._npy.flush()
+        return self.length, csv_bytes
+
+    def append(self, frame_idx, time_sec, score):
+        row = self._buffer[self._fill]
+        row["frame"] = frame_idx
+        row["time"] = time_sec
+        row["score"] = score
+        self._fill += 1
+        if self._fill == len(self._buffer):
+            self.flush()
+
+    def extend(self, frames, times, scores):
+        """Dopisuje całe kolumny naraz (np. wyniki z analizy równoległej)."""
+        block = np.empty(len(scores), dtype=SERIES_DTYPE)
+        block["frame"] = frames
+        block["time"] = times
+        block["score"] = scores
+        self.flush()
+        self._write_block(block)
+
+    def flush(self):
+        if self._fill:
+            self._write_block(self._buffer[:self._fill])
+            self._fill = 0
+
+    def _write_block(self, block):
+        if self._csv:
+            self._csv.write("".join(
+                f"{frame},{time_sec:.3f},{timedelta(seconds=int(time_sec))},{score:.6f}\n"
+                for frame, time_sec, score in zip(block["frame"].tolist(), block["time"].tolist(),
+                                                  block["score"].tolist())
+            ))
+        if self._npy:
+            self._npy.write(block.tobytes())
+        self.length += len(block)
+
+    def close(self):
+        self.flush()
+        if self._csv:
+            self._csv.close()
+            self._csv = None
+        if self._npy:
+            self._npy.seek(0)
+            self._npy.write(_npy_header(SERIES_DTYPE, self.length))
+            self._npy.close()
+            self._npy = None
+
+
+def load_motion_series(npy_path, mmap=True):
+    """Wczytuje serię zapisaną przez MotionSeriesWriter (domyślnie jako memmap, bez kopiowania)."""
+    return np.load(npy_path, mmap_mode="r" if mmap else None)
+
+
+def iter_blocks(series, block_size=1 << 20):
+    for start in range(0, len(series), block_size):
+        yield series[start:start + block_size]
+
+
+def flicker_sample(series, threshold, max_points=200_000):
+    """
+    Punkty (czas, wynik) poniżej progu do wykresu migotania - liczone blokami,
+    a przy bardzo długich nagraniach równomiernie przerzedzone do max_points.
+    """
+    total = sum(int(np.count_nonzero(block["score"] <= threshold)) for block in iter_blocks(series))
+    step = max(1, -(-total // max_points))
+    times, scores = [], []
+    offset = 0
+    for block in iter_blocks(series):
+        mask = block["score"] <= threshold
+        idx = np.flatnonzero(mask)
+        # Wybór co step-ty punkt liczony globalnie, żeby granice bloków nie zaburzały próbkowania
+        keep = idx[(offset + np.arange(len(idx))) % step == 0]
+        offset += len(idx)
+        times.append(np.asarray(block["time"][keep]))
+        scores.append(np.asarray(block["score"][keep]))
+    if not times:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(times), np.concatenate(scores)
+
+
+def decimate_max(series, max_points=5000):
+    """Przerzedza serię do max_points, zachowując maksimum w każdym przedziale (szczyty nie znikają z wykresu)."""
+    n = len(series)
+    if n <= max_points:
+        return np.asarray(series["time"]), np.asarray(series["score"])
+    bucket = -(-n // max_points)
+    times, scores = [], []
+    for block in iter_blocks(series, block_size=bucket * 4096):
+        count = len(block) // bucket * bucket
+        if count:
+            s = np.asarray(block["score"][:count]).reshape(-1, bucket)
+            arg = s.argmax(axis=1)
+            times.append(np.asarray(block["time"][:count]).reshape(-1, bucket)[np.arange(len(arg)), arg])
+            scores.append(s[np.arange(len(arg)), arg])
+        if count < len(block):
+            tail = block[count:]
+            arg = int(np.argmax(tail["score"]))
+            times.append(np.asarray([tail["time"][arg]]))
+            scores.append(np.asarray([tail["score"][arg]]))
+    return np.concatenate(times), np.concatenate(scores)
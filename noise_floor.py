@@ -0,0 +1,160 @@
+# noise_floor.py
+"""
+Adaptacyjny poziom szumu i tłumienie globalnych zmian oświetlenia.
+
+Próg adaptacyjny (params["adaptive_threshold"]): średnia i średnie odchylenie
+wyniku w spoczynku liczone są online jako średnie wykładnicze (EMA, stała
+czasowa noise_floor_seconds, domyślnie 30 s) - O(1) na klatkę. Klatka jest
+porównywana z progiem max(motion_threshold, średnia * noise_floor_ratio,
+średnia + noise_floor_k * odchylenie), więc stały próg obowiązuje przy
+spokojnym obrazie, a rośnie, gdy kamera szumi mocniej (np. w trybie
+podczerwieni). Statystyki aktualizują tylko klatki poniżej progu - ruch nie
+podnosi poziomu szumu - z wyjątkiem pierwszych noise_floor_learn_seconds
+(domyślnie 2 s) analizy i klatek pomijanych po zmianie oświetlenia, kiedy
+poziom szumu uczony jest od nowa ze wszystkich klatek (inaczej szum trybu IR
+tuż nad progiem nigdy nie trafiłby do statystyk).
+
+Tłumienie zmian oświetlenia (params["suppress_illumination"]): klatka (po
+filtrze migotania) jest zmniejszana do siatki ILLUMINATION_GRID komórek. Jeśli
+średnia jasność ponad illumination_coverage (domyślnie 60%) komórek zmieniła
+się względem poprzedniej klatki o więcej niż illumination_level poziomów,
+zmiana dotyczy całego kadru (włączenie światła, przełączenie dzień/IR) - taka
+klatka i illumination_hold_seconds po niej nie trafiają do maszyny stanów
+szczytów. Człowiek na schodach zmienia niewiele komórek, a szum pikseli
+(np. w trybie IR) uśrednia się w komórce, więc żadne z nich nie jest tłumione.
+"""
+
+import cv2
+import numpy as np
+
+# Siatka (kolumny, wiersze) do oceny, jak dużą część kadru obejmuje zmiana
+ILLUMINATION_GRID = (16, 12)
+NOISE_FLOOR_SECONDS = 30.0
+NOISE_FLOOR_K = 4.0
+NOISE_FLOOR_LEARN_SECONDS = 2.0
+# Wynik ruchu musi być co najmniej tyle razy większy od poziomu szumu
+NOISE_FLOOR_RATIO = 1.5
+ILLUMINATION_COVERAGE = 0.6
+ILLUMINATION_LEVEL = 8.0
+ILLUMINATION_HOLD_SECONDS = 0.5
+
+# Parametry wpływające na szczyty (klucz punktów kontrolnych)
+NOISE_FLOOR_PARAMS = ("adaptive_threshold", "noise_floor_seconds", "noise_floor_k", "noise_floor_ratio",
+                      "noise_floor_learn_seconds",
+                      "suppress_illumination",
+                      "illumination_coverage", "illumination_level", "illumination_hold_seconds")
+
+
+def noise_floor_enabled(params):
+    return bool(params.get("adaptive_threshold") or params.get("suppress_illumination"))
+
+
+class NoiseFloor:
+    """
+    Bramka między wynikiem klatki a PeakDetector: update() ustawia próg
+    detektora i zwraca False dla klatek, które należy pominąć.
+    """
+
+    def __init__(self, params, fps):
+        self.base_threshold = params["motion_threshold"]
+        self.threshold = self.base_threshold
+        self.adaptive = bool(params.get("adaptive_threshold"))
+        self.suppress = bool(params.get("suppress_illumination"))
+        self.window = max(1.0, float(params.get("noise_floor_seconds", NOISE_FLOOR_SECONDS)) * fps)
+        self.k = float(params.get("noise_floor_k", NOISE_FLOOR_K))
+        self.ratio = float(params.get("noise_floor_ratio", NOISE_FLOOR_RATIO))
+        self.min_samples = int(float(params.get("noise_floor_learn_seconds", NOISE_FLOOR_LEARN_SECONDS)) * fps)
+        # Ile kolejnych klatek uczy poziom szumu bez względu na próg
+        self.learning = self.min_samples
+        self.coverage = float(params.get("illumination_coverage", ILLUMINATION_COVERAGE))
+        self.level = float(params.get("illumination_level", ILLUMINATION_LEVEL))
+        self.hold_frames = int(float(params.get("illumination_hold_seconds", ILLUMINATION_HOLD_SECONDS)) * fps)
+        self.mean = 0.0
+        self.deviation = 0.0
+        self.samples = 0
+        self.hold = 0
+        self.suppressed_frames = 0
+        self.illumination_changes = 0
+        self.max_threshold = self.base_threshold
+        self._cells = np.empty(ILLUMINATION_GRID[::-1], dtype=np.uint8)
+        self._prev_cells = None
+        # Czy ostatnia klatka zmieniła oświetlenie całego kadru
+        self.changed = False
+
+    def _global_change(self, gray):
+        cv2.resize(gray, ILLUMINATION_GRID, dst=self._cells, interpolation=cv2.INTER_AREA)
+        cells = self._cells.astype(np.float32)
+        if self._prev_cells is None:
+            self._prev_cells = cells
+            return False
+        changed = np.count_nonzero(np.abs(cells - self._prev_cells) > self.level)
+        self._prev_cells = cells
+        return changed >= self.coverage * cells.size
+
+    def update(self, score, gray=None, detector=None, changed=None):
+        """
+        score - wynik ROI klatki, gray - bieżąca klatka po filtrze migotania.
+        changed - zmiana oświetlenia tej klatki oceniona już przez inną bramkę
+        (strefy korzystają z oceny całego kadru zamiast liczyć ją ponownie).
+        Zwraca True, jeśli klatka ma trafić do detektora (próg detektora jest już ustawiony).
+        """
+        if changed is None:
+            changed = self.suppress and gray is not None and self._global_change(gray)
+        changed = self.suppress and changed
+        self.changed = changed
+        if changed:
+            if self.hold == 0:
+                self.illumination_changes += 1
+            self.hold = self.hold_frames + 1
+            # Nowe oświetlenie to zwykle inny poziom szumu - statystyki od nowa
+            self.samples = 0
+            self.learning = self.hold
+        if self.adaptive:
+            if not changed and (self.learning > 0 or score <= self.threshold):
+                self._learn(score)
+            if detector is not None:
+                detector.threshold = self.threshold
+        if self.hold:
+            self.hold -= 1
+            self.suppressed_frames += 1
+            return False
+        return True
+
+    def _learn(self, score):
+        self.learning = max(0, self.learning - 1)
+        self.samples += 1
+        if self.samples == 1:
+            self.mean, self.deviation = score, 0.0
+        else:
+            # Średnia zwykła na początku (brak zależności od pierwszej klatki), potem EMA
+            alpha = 1.0 / min(self.samples, self.window)
+            error = score - self.mean
+            self.mean += alpha * error
+            self.deviation += alpha * (abs(error) - self.deviation)
+        threshold = max(self.base_threshold, self.mean * self.ratio)
+        if self.samples >= self.min_samples:
+            # Odchylenie z kilku klatek jest niewiarygodne - jedna klatka ruchu podniosłaby próg
+            threshold = max(threshold, self.mean + self.k * self.deviation)
+        self.threshold = threshold
+        self.max_threshold = max(self.max_threshold, self.threshold)
+
+    def state(self):
+        return {"threshold": self.threshold, "mean": self.mean, "deviation": self.deviation,
+                "samples": self.samples, "learning": self.learning, "hold": self.hold, "suppressed_frames": self.suppressed_frames,
+                "illumination_changes": self.illumination_changes, "max_threshold": self.max_threshold,
+                "prev_cells": self._prev_cells.tolist() if self._prev_cells is not None else None}
+
+    def restore(self, state):
+        state = dict(state)
+        prev_cells = state.pop("prev_cells", None)
+        if prev_cells is not None:
+            self._prev_cells = np.array(prev_cells, dtype=np.float32)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def summary(self):
+        summary = {"suppressed_frames": self.suppressed_frames, "illumination_changes": self.illumination_changes}
+        if self.adaptive:
+            summary.update(noise_mean=round(self.mean, 4), final_threshold=round(self.threshold, 4),
+                           max_threshold=round(self.max_threshold, 4))
+        return summary
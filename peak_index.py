@@ -0,0 +1,301 @@
+# peak_index.py
+"""
+Indeks szczytów ruchu ze wszystkich nagrań (SQLite).
+
+Po każdej analizie z params["peak_index"] = "ścieżka/do/bazy.sqlite" (w trybie
+wsadowym --indeks) połączone szczyty trafiają do bazy razem z czasem
+zegarowym: początek nagrania + czas szczytu w pliku. Początek nagrania
+pochodzi kolejno z params["recording_start"] (napis ISO dla analizy jednego
+pliku albo słownik {nazwa lub ścieżka pliku: napis ISO}), z nazwy pliku (np.
+NVR_ch1_main_20250513180000_...dav, 2025-05-13_18-00-00.mp4), ze znacznika
+creation_time kontenera (ffprobe) albo z czasu modyfikacji pliku minus
+długość nagrania. Kamera to params["camera"] albo nazwa katalogu nagrania.
+
+Czas zapisywany jest jako liczba sekund czasu lokalnego rejestratora (bez
+strefy), a tabela szczytów ma indeksy na początku szczytu i wyniku, więc
+zapytanie o zakres czasu w miesiącach nagrań nie czyta plików z wynikami.
+Ponowna analiza tego samego nagrania (ten sam odcisk zawartości) zastępuje
+jego szczyty.
+
+Przykład:
+    python peak_index.py indeks.sqlite --od "2025-05-13 18:00" --do "2025-05-13 20:00"
+    python peak_index.py indeks.sqlite --od 2025-05-13 --min-wynik 15 --kamera schody --eksport zdarzenia
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+from cache_utils import file_fingerprint
+
+# Czas lokalny jako sekundy od tej daty (bez stref i zmian czasu)
+_EPOCH = datetime(1970, 1, 1)
+# RRRR MM DD GG MM SS z dowolnymi separatorami (lub bez) - typowe nazwy eksportów rejestratorów
+_NAME_TIME = re.compile(r"(?<!\d)(20\d{2})[-_.]?(\d{2})[-_.]?(\d{2})[-_.T ]?(\d{2})[-_.:]?(\d{2})[-_.:]?(\d{2})(?!\d)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    camera TEXT,
+    start_ts REAL NOT NULL,
+    duration REAL,
+    fps REAL,
+    time_source TEXT,
+    out_dir TEXT,
+    indexed TEXT
+);
+CREATE TABLE IF NOT EXISTS peaks (
+    id INTEGER PRIMARY KEY,
+    recording_id INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    max_ts REAL NOT NULL,
+    start_frame INTEGER,
+    end_frame INTEGER,
+    max_frame INTEGER,
+    start_time REAL,
+    end_time REAL,
+    max_score REAL,
+    fragment TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL);
+CREATE INDEX IF NOT EXISTS peaks_start_ts ON peaks(start_ts);
+CREATE INDEX IF NOT EXISTS peaks_max_score ON peaks(max_score);
+CREATE INDEX IF NOT EXISTS peaks_recording ON peaks(recording_id);
+CREATE INDEX IF NOT EXISTS recordings_camera ON recordings(camera);
+"""
+
+
+def to_ts(moment):
+    return (moment - _EPOCH).total_seconds()
+
+
+def from_ts(ts):
+    return _EPOCH + timedelta(seconds=ts)
+
+
+def connect(db_path):
+    # Kilka procesów wsadowych może zapisywać jednocześnie - WAL i czekanie na blokadę
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _creation_time(video_file):
+    cmd = ["ffprobe", "-v", "error", "-show_entries", "format_tags=creation_time", "-of", "json", video_file]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        value = json.loads(result.stdout).get("format", {}).get("tags", {}).get("creation_time")
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        # creation_time jest w UTC - zamiana na czas lokalny komputera
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def recording_start(video_file, video_duration, params):
+    """Zwraca (początek nagrania jako datetime, źródło tej informacji)."""
+    value = params.get("recording_start")
+    if isinstance(value, dict):
+        value = value.get(os.path.abspath(video_file)) or value.get(video_file) or \
+            value.get(os.path.basename(video_file))
+    if value:
+        return datetime.fromisoformat(value), "params"
+    match = _NAME_TIME.search(os.path.basename(video_file))
+    if match:
+        try:
+            return datetime(*(int(part) for part in match.groups())), "file_name"
+        except ValueError:
+            pass
+    moment = _creation_time(video_file)
+    if moment is not None and moment.year > 1970:
+        return moment, "creation_time"
+    # Rejestrator kończy zapis pliku w chwili końca nagrania
+    return datetime.fromtimestamp(os.path.getmtime(video_file)) - timedelta(seconds=video_duration), "mtime"
+
+
+def index_result(db_path, video_file, params, merged_peaks, fps, video_duration, fragments=(), out_dir=None):
+    """Zapisuje (lub zastępuje) szczyty jednego nagrania; zwraca liczbę zapisanych szczytów."""
+    start, time_source = recording_start(video_file, video_duration, params)
+    start_ts = to_ts(start)
+    fingerprint = file_fingerprint(video_file)
+    camera = params.get("camera") or os.path.basename(os.path.dirname(os.path.abspath(video_file)))
+    # fragment_<nazwa>_<znacznik>_<nr>.mp4 - numer odpowiada kolejności szczytów
+    fragment_by_number = {}
+    for fragment in fragments:
+        number = os.path.splitext(fragment)[0].rsplit("_", 1)[-1]
+        if number.isdigit():
+            fragment_by_number[int(number)] = os.path.abspath(fragment)
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO recordings (fingerprint, path, camera, start_ts, duration, fps, time_source, out_dir, indexed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(fingerprint) DO UPDATE SET
+                    path=excluded.path, camera=excluded.camera, start_ts=excluded.start_ts,
+                    duration=excluded.duration, fps=excluded.fps, time_source=excluded.time_source,
+                    out_dir=excluded.out_dir, indexed=excluded.indexed
+            """, (fingerprint, os.path.abspath(video_file), camera, start_ts, video_duration, fps,
+                  time_source, out_dir and os.path.abspath(out_dir), datetime.now().isoformat(timespec="seconds")))
+            recording_id = conn.execute("SELECT id FROM recordings WHERE fingerprint = ?",
+                                        (fingerprint,)).fetchone()[0]
+            conn.execute("DELETE FROM peaks WHERE recording_id = ?", (recording_id,))
+            rows = [(recording_id, start_ts + peak["start_time"], start_ts + peak["end_time"],
+                     start_ts + peak["max_time"], peak["start_frame"], peak["end_frame"], peak["max_frame"],
+                     peak["start_time"], peak["end_time"], float(peak["max_score"]), fragment_by_number.get(i))
+                    for i, peak in enumerate(merged_peaks, 1)]
+            conn.executemany("""
+                INSERT INTO peaks (recording_id, start_ts, end_ts, max_ts, start_frame, end_frame, max_frame,
+                                   start_time, end_time, max_score, fragment)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            # Najdłuższy szczyt ogranicza zakres indeksu przy szukaniu szczytów nachodzących na przedział
+            longest = max((row[2] - row[1] for row in rows), default=0.0)
+            conn.execute("""
+                INSERT INTO meta (key, value) VALUES ('max_peak_seconds', ?)
+                ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+            """, (longest,))
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def query_peaks(db_path, start=None, end=None, min_score=None, max_score=None, camera=None, limit=None):
+    """
+    Szczyty nachodzące na przedział [start, end] (datetime, oba opcjonalne), z filtrami
+    wyniku i kamery, posortowane według czasu. Zwraca listę słowników z datetime.
+    """
+    conn = connect(db_path)
+    try:
+        conditions, args = [], []
+        if start is not None:
+            longest = conn.execute("SELECT value FROM meta WHERE key = 'max_peak_seconds'").fetchone()
+            conditions.append("p.start_ts >= ? AND p.end_ts >= ?")
+            args += [to_ts(start) - (longest[0] if longest else 0.0), to_ts(start)]
+        if end is not None:
+            conditions.append("p.start_ts <= ?")
+            args.append(to_ts(end))
+        # Przy zakresie czasu tylko indeks start_ts (jednoargumentowy "+" wyłącza
+        # pozostałe indeksy) - bez statystyk planista wybiera indeks kamery lub wyniku
+        # i sortuje cały wynik; bez zakresu sortowanie nie może blokować indeksu wyniku
+        ranged = start is not None or end is not None
+        plain = "+" if ranged else ""
+        if min_score is not None:
+            conditions.append(f"{plain}p.max_score >= ?")
+            args.append(min_score)
+        if max_score is not None:
+            conditions.append(f"{plain}p.max_score <= ?")
+            args.append(max_score)
+        if camera is not None:
+            conditions.append("+r.camera = ?")
+            args.append(camera)
+        sql = """
+            SELECT p.*, r.path, r.camera, r.duration FROM peaks p JOIN recordings r ON r.id = p.recording_id
+        """
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY p.start_ts" if ranged or min_score is None and max_score is None else " ORDER BY +p.start_ts"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        peaks = []
+        for row in conn.execute(sql, args):
+            peak = dict(row)
+            for name in ("start", "end", "max"):
+                peak[name] = from_ts(peak[f"{name}_ts"])
+            peaks.append(peak)
+        return peaks
+    finally:
+        conn.close()
+
+
+def export_fragments(peaks, out_dir):
+    """
+    Zapisuje fragmenty znalezionych szczytów do out_dir (nazwy z czasem zegarowym).
+    Fragment jest wycinany z nagrania źródłowego, a gdy go już nie ma - kopiowany
+    z fragmentu zapisanego podczas analizy. Zwraca listę zapisanych plików.
+    """
+    from video_processing import cut_fragments
+    os.makedirs(out_dir, exist_ok=True)
+    exported = []
+    by_source = {}
+    for peak in peaks:
+        name = f"{peak['camera'] or 'nagranie'}_{peak['start'].strftime('%Y%m%d_%H%M%S')}_{peak['id']}.mp4"
+        target = os.path.join(out_dir, name)
+        if os.path.exists(peak["path"]):
+            by_source.setdefault(peak["path"], []).append((peak["id"], peak, target))
+        elif peak["fragment"] and os.path.exists(peak["fragment"]):
+            shutil.copyfile(peak["fragment"], target)
+            exported.append(target)
+        else:
+            print(f"Brak nagrania i fragmentu dla szczytu {peak['id']} ({peak['path']})", file=sys.stderr)
+    for source, jobs in by_source.items():
+        exported.extend(cut_fragments(jobs, source, jobs[0][1]["duration"]))
+    return exported
+
+
+def _parse_moment(text, end_of_day=False):
+    moment = datetime.fromisoformat(text)
+    # Sama data w --do oznacza cały dzień
+    if end_of_day and len(text) <= 10:
+        moment += timedelta(days=1) - timedelta(microseconds=1)
+    return moment
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analizator ruchu 2025 - wyszukiwanie szczytów ruchu w indeksie nagrań.")
+    parser.add_argument("db", help="plik bazy indeksu (params[\"peak_index\"], w trybie wsadowym --indeks)")
+    parser.add_argument("--od", help="początek przedziału, np. \"2025-05-13 18:00\" lub 2025-05-13")
+    parser.add_argument("--do", help="koniec przedziału (sama data - do końca dnia)")
+    parser.add_argument("--min-wynik", type=float, help="minimalny wynik szczytu")
+    parser.add_argument("--max-wynik", type=float, help="maksymalny wynik szczytu")
+    parser.add_argument("--kamera", help="tylko nagrania tej kamery")
+    parser.add_argument("--limit", type=int, help="najwyżej tyle szczytów")
+    parser.add_argument("--eksport", help="zapisz fragmenty znalezionych szczytów do tego katalogu")
+    parser.add_argument("--json", action="store_true", help="wypisz wyniki jako JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.exists(args.db):
+        print(f"Brak bazy indeksu: {args.db}", file=sys.stderr)
+        return 1
+    peaks = query_peaks(args.db,
+                        start=_parse_moment(args.od) if args.od else None,
+                        end=_parse_moment(args.do, end_of_day=True) if args.do else None,
+                        min_score=args.min_wynik, max_score=args.max_wynik, camera=args.kamera, limit=args.limit)
+    if args.json:
+        print(json.dumps(peaks, ensure_ascii=False, indent=2, default=str))
+    else:
+        for peak in peaks:
+            print(f"{peak['start']:%Y-%m-%d %H:%M:%S} - {peak['end']:%H:%M:%S}  {peak['camera']}  "
+                  f"wynik {peak['max_score']:.2f}  {os.path.basename(peak['path'])} "
+                  f"({timedelta(seconds=int(peak['start_time']))})")
+        print(f"Znaleziono szczytów: {len(peaks)}")
+    if args.eksport and peaks:
+        exported = export_fragments(peaks, args.eksport)
+        print(f"Zapisano fragmentów: {len(exported)} w {args.eksport}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
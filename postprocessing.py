@@ -0,0 +1,77 @@
+# postprocessing.py
+"""
+Równoległe zapisywanie wyników po pętli analizy.
+
+Raport szczytów, wykresy, mapa ruchu, zrzuty i procesy ffmpeg (fragmenty,
+plik połączony) są od siebie niezależne - zależą tylko od połączonych
+szczytów. TaskGraph uruchamia każde zadanie, gdy gotowe są jego zależności,
+w puli params["postprocess_workers"] wątków (domyślnie 3). Zadania ffmpeg
+startują pierwsze: to procesy zewnętrzne, więc wykresy i raport rysowane są
+w czasie, gdy wątek czeka na ffmpeg, a czas zapisu wyników jest zbliżony do
+czasu najwolniejszego zadania zamiast sumy wszystkich.
+
+Wykresy rysowane są przez obiektowe API matplotlib (Figure + FigureCanvasAgg),
+bez globalnego stanu pyplot, więc mogą powstawać w kilku wątkach naraz.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+POSTPROCESS_WORKERS = 3
+
+
+class TaskGraph:
+    """
+    Zadania bez argumentów z zależnościami (nazwy innych zadań). Wyniki trafiają
+    do results[nazwa]. Błąd zadania zatrzymuje uruchamianie kolejnych; po
+    zakończeniu już działających zadań pierwszy błąd jest zgłaszany dalej.
+    """
+
+    def __init__(self, max_workers=POSTPROCESS_WORKERS, monitor=None):
+        self.max_workers = max(1, int(max_workers))
+        self.monitor = monitor
+        self.tasks = {}
+        self.results = {}
+
+    def add(self, name, func, deps=(), subprocess=False):
+        """subprocess=True - zadanie czeka głównie na proces zewnętrzny (uruchamiane w pierwszej kolejności)."""
+        unknown = [dep for dep in deps if dep not in self.tasks]
+        if unknown:
+            raise ValueError(f"Zadanie {name}: nieznane zależności {unknown}")
+        self.tasks[name] = {"func": func, "deps": tuple(deps), "subprocess": subprocess}
+
+    def _run_task(self, name):
+        task = self.tasks[name]
+        stage = self.monitor.stage(name, subprocess=task["subprocess"]) if self.monitor else nullcontext()
+        with stage:
+            return task["func"]()
+
+    def run(self):
+        pending = dict(self.tasks)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    ready = [name for name, task in pending.items()
+                             if all(dep in self.results for dep in task["deps"])]
+                    # Najpierw procesy zewnętrzne - reszta wykonuje się w czasie ich trwania
+                    ready.sort(key=lambda name: not pending[name]["subprocess"])
+                    for name in ready:
+                        del pending[name]
+                        running[pool.submit(self._run_task, name)] = name
+                elif not running:
+                    break
+                if not running:
+                    raise ValueError(f"Zadania z niespełnionymi zależnościami: {sorted(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+        if error is not None:
+            raise error
+        return self.results
@@ -0,0 +1,88 @@
+# score_cache.py
+"""
+Pamięć podręczna wyników klatek i akumulatora przestrzennego.
+
+Zmiana motion_threshold, seconds_before, seconds_after czy merge_gap_threshold
+nie wpływa na wyniki klatek, więc ponowna analiza z innymi wartościami tych
+parametrów nie musi dekodować nagrania. Wpis przechowuje też zrzuty krawędzi ROI
+(pliki PNG), więc analiza z pamięci podręcznej nie otwiera nagrania. Klucz wpisu to odcisk zawartości pliku
+plus wyłącznie parametry wpływające na wynik klatki. Rozmiar katalogu jest
+ograniczany (usuwane są najdawniej używane wpisy).
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cache_utils import default_cache_dir, evict_lru, file_fingerprint, touch
+
+# Parametry, od których zależy wynik klatki (pozostałe są stosowane dopiero do serii wyników)
+SCORING_PARAMS = {
+    "roi_top": None,
+    "roi_bottom": None,
+    "flicker_filter_intensity": None,
+    "flicker_filter_gray": False,
+    "decoder": "opencv",
+    "decode_width": None,
+    "decode_fps": None,
+    "decode_crop_roi": False,
+    "spatial_cell_accum": False,
+}
+
+SCORE_CACHE_MAX_GB = 5
+
+SCREENSHOT_PREFIX = "krawedz_"
+
+
+def score_cache_dir(params):
+    return params.get("score_cache_dir") or default_cache_dir("scores")
+
+
+def score_cache_key(video_file, params):
+    scoring = {name: params.get(name, default) for name, default in SCORING_PARAMS.items()}
+    for name in ("roi_top", "roi_bottom", "flicker_filter_intensity"):
+        scoring[name] = float(scoring[name])
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(file_fingerprint(video_file).encode())
+    digest.update(json.dumps(scoring, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def load_scores(key, params):
+    """Zwraca {"series", "spatial_accum", "meta", "screenshots"} albo None, jeśli wpisu nie ma."""
+    path = os.path.join(score_cache_dir(params), f"{key}.npz")
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            entry = {
+                "series": data["series"],
+                "spatial_accum": data["spatial_accum"],
+                "meta": json.loads(str(data["meta"])),
+                # {indeks klatki: zawartość pliku PNG}; starsze wpisy nie mają zrzutów
+                "screenshots": {int(name[len(SCREENSHOT_PREFIX):]): data[name].tobytes()
+                                for name in data.files if name.startswith(SCREENSHOT_PREFIX)}
+            }
+    except (OSError, ValueError, KeyError):
+        # Uszkodzony wpis (np. przerwany zapis) traktujemy jak brak wpisu
+        return None
+    touch(path)
+    return entry
+
+
+def store_scores(key, params, series, spatial_accum, meta, screenshots=None):
+    """screenshots - {indeks klatki: zawartość pliku PNG} zrzutów krawędzi."""
+    cache_dir = score_cache_dir(params)
+    path = os.path.join(cache_dir, f"{key}.npz")
+    part_file = f"{path}.{os.getpid()}.part"
+    images = {f"{SCREENSHOT_PREFIX}{idx}": np.frombuffer(data, dtype=np.uint8)
+              for idx, data in (screenshots or {}).items()}
+    with open(part_file, "wb") as f:
+        np.savez(f, series=np.asarray(series), spatial_accum=spatial_accum, meta=np.array(json.dumps(meta)),
+                 **images)
+    os.replace(part_file, path)
+    max_bytes = int(float(params.get("score_cache_max_gb", SCORE_CACHE_MAX_GB)) * 1024**3)
+    evict_lru(cache_dir, max_bytes, keep=[path])
+    return path
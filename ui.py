@@ -3,7 +3,12 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-from video_processing import analyze_video
+import queue
+import threading
+from instrumentation import AnalysisCancelled, AnalysisMonitor, format_progress
+
+# Co ile milisekund okno odbiera komunikaty z wątku analizy
+QUEUE_POLL_MS = 100
 
 class AnalizatorRuchuUI:
     def __init__(self, root):
@@ -11,7 +16,14 @@ class AnalizatorRuchuUI:
         self.root.title("Analizator ruchu 2025, Autor: Paweł")
         self.root.geometry("1000x750")
         self.root.configure(bg="#E6E6FA")
+        self.messages = queue.Queue()
+        self.worker = None
+        self.cancel_event = None
+        self.abort_all = False
+        # Zamknięcie okna w trakcie analizy czeka na komunikat "finished" wątku roboczego
+        self.close_pending = False
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def setup_ui(self):
         main_frame = ttk.Frame(self.root, padding="10")
@@ -89,12 +101,34 @@ class AnalizatorRuchuUI:
         ttk.Checkbutton(options_frame, text="Wyświetlaj wykryte ruchy", variable=self.show_motion_var).grid(row=0, column=0, padx=5, pady=5)
         self.merge_fragments_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(options_frame, text="Połącz fragmenty", variable=self.merge_fragments_var).grid(row=0, column=1, padx=5, pady=5)
+        self.save_fragments_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Zapisuj osobne fragmenty", variable=self.save_fragments_var).grid(row=0, column=2, padx=5, pady=5)
+        self.peak_thumbnails_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Miniatury szczytów", variable=self.peak_thumbnails_var).grid(row=0, column=3, padx=5, pady=5)
+        self.score_cache_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Zapamiętuj wyniki klatek", variable=self.score_cache_var).grid(row=1, column=0, padx=5, pady=5)
+        self.noise_floor_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Próg adaptacyjny i tłumienie zmian oświetlenia", variable=self.noise_floor_var).grid(row=1, column=1, columnspan=2, padx=5, pady=5)
         
         # Przyciski sterowania
         control_frame = ttk.Frame(main_frame, padding="10")
         control_frame.pack(fill=tk.X, pady=5)
-        ttk.Button(control_frame, text="Rozpocznij analizę", command=self.start_analysis).pack(side=tk.LEFT, padx=5)
-        ttk.Button(control_frame, text="Zatrzymaj analizę", command=self.stop_analysis).pack(side=tk.LEFT, padx=5)
+        self.start_button = ttk.Button(control_frame, text="Rozpocznij analizę", command=self.start_analysis)
+        self.start_button.pack(side=tk.LEFT, padx=5)
+        self.skip_button = ttk.Button(control_frame, text="Pomiń bieżący plik", command=self.skip_file, state=tk.DISABLED)
+        self.skip_button.pack(side=tk.LEFT, padx=5)
+        self.stop_button = ttk.Button(control_frame, text="Zatrzymaj analizę", command=self.stop_analysis, state=tk.DISABLED)
+        self.stop_button.pack(side=tk.LEFT, padx=5)
+        
+        # Postęp analizy
+        progress_frame = ttk.LabelFrame(main_frame, text="Postęp", padding="10")
+        progress_frame.pack(fill=tk.X, pady=5)
+        self.files_label = ttk.Label(progress_frame, text="")
+        self.files_label.pack(fill=tk.X)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate", maximum=100)
+        self.progress_bar.pack(fill=tk.X, pady=5)
+        self.status_label = ttk.Label(progress_frame, text="Gotowy.")
+        self.status_label.pack(fill=tk.X)
     
     def browse_files(self):
         files = filedialog.askopenfilenames(
@@ -112,33 +146,134 @@ class AnalizatorRuchuUI:
             self.output_entry.delete(0, tk.END)
             self.output_entry.insert(0, directory)
     
+    def read_params(self):
+        return {
+            "roi_top": float(self.roi_top_entry.get()),
+            "roi_bottom": float(self.roi_bottom_entry.get()),
+            "seconds_before": float(self.sec_before_entry.get()),
+            "seconds_after": float(self.sec_after_entry.get()),
+            "motion_threshold": float(self.motion_thresh_entry.get()),
+            "flicker_filter_intensity": float(self.flicker_intensity_entry.get()),
+            "merge_gap_threshold": float(self.merge_gap_entry.get()),
+            "show_motion": self.show_motion_var.get(),
+            "merge_fragments": self.merge_fragments_var.get(),
+            "save_fragments": self.save_fragments_var.get(),
+            "peak_thumbnails": self.peak_thumbnails_var.get(),
+            "score_cache": self.score_cache_var.get(),
+            "adaptive_threshold": self.noise_floor_var.get(),
+            "suppress_illumination": self.noise_floor_var.get(),
+            "motion_display_time": float(self.motion_display_time_entry.get()),
+            "motion_display_scale": float(self.motion_display_scale_entry.get())
+        }
+    
     def start_analysis(self):
+        if self.worker is not None and self.worker.is_alive():
+            return
         try:
             output_dir = self.output_entry.get()
-            video_files = self.video_files
-            params = {
-                "roi_top": float(self.roi_top_entry.get()),
-                "roi_bottom": float(self.roi_bottom_entry.get()),
-                "seconds_before": float(self.sec_before_entry.get()),
-                "seconds_after": float(self.sec_after_entry.get()),
-                "motion_threshold": float(self.motion_thresh_entry.get()),
-                "flicker_filter_intensity": float(self.flicker_intensity_entry.get()),
-                "merge_gap_threshold": float(self.merge_gap_entry.get()),
-                "show_motion": self.show_motion_var.get(),
-                "merge_fragments": self.merge_fragments_var.get(),
-                "motion_display_time": float(self.motion_display_time_entry.get()),
-                "motion_display_scale": float(self.motion_display_scale_entry.get())
-            }
-            results = []
-            for video in video_files:
-                res = analyze_video(video, output_dir, params)
-                results.append(res)
-            messagebox.showinfo("Sukces", "Analiza zakończona.")
+            video_files = list(self.video_files)
+            params = self.read_params()
         except Exception as e:
             messagebox.showerror("Błąd", str(e))
+            return
+        self.abort_all = False
+        self.start_button.config(state=tk.DISABLED)
+        self.skip_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.NORMAL)
+        self.progress_bar["value"] = 0
+        # Analiza w osobnym wątku - okno odbiera tylko komunikaty z kolejki
+        self.worker = threading.Thread(target=self.run_analysis, args=(video_files, output_dir, params), daemon=True)
+        self.worker.start()
+        self.root.after(QUEUE_POLL_MS, self.poll_messages)
+    
+    def run_analysis(self, video_files, output_dir, params):
+        """Wątek roboczy: nie dotyka widżetów, wszystko przekazuje przez self.messages."""
+        # Import przy pierwszej analizie - okno pojawia się bez czekania na OpenCV
+        from video_processing import analyze_video
+        summary = {"ok": 0, "skipped": 0, "errors": [], "notices": []}
+        for i, video in enumerate(video_files, 1):
+            if self.abort_all:
+                break
+            self.cancel_event = threading.Event()
+            self.messages.put(("file", i, len(video_files), video))
+            monitor = AnalysisMonitor(callback=self.messages.put, cancel_event=self.cancel_event)
+            try:
+                analyze_video(video, output_dir, params, monitor=monitor)
+                summary["ok"] += 1
+                summary["notices"] += [f"{os.path.basename(video)}: {notice}" for notice in monitor.notices]
+            except AnalysisCancelled:
+                summary["skipped"] += 1
+            except Exception as e:
+                summary["errors"].append(f"{os.path.basename(video)}: {e}")
+        summary["aborted"] = self.abort_all
+        self.messages.put(("finished", summary))
+    
+    def poll_messages(self):
+        try:
+            while True:
+                message = self.messages.get_nowait()
+                if isinstance(message, dict):
+                    self.show_progress(message)
+                elif message[0] == "file":
+                    _, i, total, video = message
+                    self.files_label.config(text=f"Plik {i} z {total}: {os.path.basename(video)}")
+                    self.progress_bar["value"] = 0
+                elif message[0] == "finished":
+                    if self.close_pending:
+                        # Wątek usunął już częściowe wyniki przerwanego pliku
+                        self.root.destroy()
+                    else:
+                        self.analysis_finished(message[1])
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(QUEUE_POLL_MS, self.poll_messages)
+    
+    def show_progress(self, event):
+        if event["event"] == "progress" and event["frame_count"]:
+            self.progress_bar["value"] = 100 * event["frames"] / event["frame_count"]
+            self.status_label.config(text=format_progress(dict(event, file=None)))
+        elif event["event"] == "stage" and event["stage"]:
+            self.status_label.config(text=f"Etap: {event['stage']}")
+        elif event["event"] == "resume":
+            self.status_label.config(text=event["message"])
+    
+    def analysis_finished(self, summary):
+        self.start_button.config(state=tk.NORMAL)
+        self.skip_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.DISABLED)
+        self.progress_bar["value"] = 0
+        text = f"Przeanalizowano plików: {summary['ok']}, pominięto: {summary['skipped']}."
+        self.status_label.config(text=text)
+        if summary["errors"]:
+            messagebox.showerror("Błąd", text + "\n\n" + "\n".join(summary["errors"]))
+        elif summary["aborted"]:
+            messagebox.showinfo("Info", "Analiza zatrzymana. " + text)
+        else:
+            messagebox.showinfo("Sukces", "\n\n".join(["Analiza zakończona."] + summary["notices"]))
+    
+    def skip_file(self):
+        """Przerywa bieżący plik (przy następnej klatce), kolejne pliki są analizowane dalej."""
+        if self.cancel_event is not None:
+            self.status_label.config(text="Przerywanie bieżącego pliku...")
+            self.cancel_event.set()
     
     def stop_analysis(self):
-        messagebox.showinfo("Info", "Funkcja zatrzymania analizy nie została zaimplementowana.")
+        """Przerywa bieżący plik i nie rozpoczyna kolejnych."""
+        self.abort_all = True
+        self.skip_file()
+    
+    def on_close(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.root.destroy()
+            return
+        # Wątek jest demonem - okno zamykamy dopiero po jego zakończeniu, inaczej interpreter
+        # kończy pracę przed usunięciem częściowych wyników przerwanego pliku
+        self.close_pending = True
+        self.stop_analysis()
+        self.skip_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.DISABLED)
+        self.status_label.config(text="Zamykanie po przerwaniu analizy...")
 
 def main():
     root = tk.Tk()
@@ -1,11 +1,18 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 import subprocess
-import tempfile
+import time
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-import pandas as pd
+from cache_utils import default_cache_dir, evict_lru, file_fingerprint, touch
+from checkpoint import CHECKPOINT_SECONDS, checkpoint_key, load_checkpoint, remove_checkpoint, save_checkpoint
+from frame_sources import FfmpegFrameSource, OpenCVFrameSource
+from instrumentation import AnalysisCancelled, AnalysisMonitor
+from motion_series import MotionSeriesWriter, decimate_max, flicker_sample, load_motion_series
+from noise_floor import NoiseFloor, noise_floor_enabled
+from postprocessing import POSTPROCESS_WORKERS, TaskGraph
+from score_cache import load_scores, score_cache_key, store_scores
 
 def apply_flicker_filter(frame, intensity=2.0):
     if frame is None or intensity <= 0:
@@ -27,6 +34,114 @@ def process_frame(prev_gray, gray, roi_top=0.1, roi_bottom=0.9):
     diff = cv2.absdiff(prev_roi, roi)
     return np.sum(diff) / diff.size
 
+class FrameKernel:
+    """
+    Jednoprzebiegowe przetwarzanie klatki: filtr migotania, konwersja do skali
+    szarości i jedna różnica klatek wykorzystana zarówno do wyniku ROI, jak
+    i do akumulatora przestrzennego. Wszystkie bufory są alokowane raz, przy
+    pierwszej klatce.
+
+    Klatki kolorowe są filtrowane w BGR, tak jak w apply_flicker_filter, więc
+    wyniki są identyczne z dotychczasowymi (te same progi). Z gray_filter=True
+    klatka jest najpierw zamieniana na szarość, a filtr liczony na jednym
+    kanale - ok. 2,5x szybciej, ale bez obcinania każdego kanału do 0..255
+    wyniki są inne (średnio o kilka procent, w klatkach z szumem nawet o
+    kilkadziesiąt), więc progi trzeba dobrać od nowa. Klatki jednokanałowe
+    (dekoder ffmpeg) zawsze mają wyniki w tej skali.
+
+    Jeśli timings jest słownikiem (np. AnalysisMonitor.stages), process()
+    dolicza do niego czas etapów "flicker_filter" i "absdiff".
+    """
+
+    def __init__(self, flicker_intensity=2.0, roi_top=0.1, roi_bottom=0.9, gray_filter=False):
+        self.flicker_intensity = flicker_intensity
+        self.roi_top = roi_top
+        self.roi_bottom = roi_bottom
+        self.gray_filter = gray_filter
+        self.prev_gray = None
+        self.gray = None
+        self.diff = None
+        self._raw_gray = None
+        self._blurred = None
+        self._color = None
+        self._color_blurred = None
+        self._roi = None
+        self._cells = None
+        self.timings = None
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self.prev_gray = np.empty((height, width), dtype=np.uint8)
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.diff = np.empty((height, width), dtype=np.uint8)
+        self._raw_gray = np.empty((height, width), dtype=np.uint8)
+        self._blurred = np.empty((height, width), dtype=np.uint8)
+        self._roi = (int(self.roi_top * height), int(self.roi_bottom * height))
+
+    def _filter_into(self, frame, out):
+        if frame.ndim == 3 and not self.gray_filter:
+            # Filtr w BGR, potem szarość - ta sama kolejność co apply_flicker_filter
+            if self.flicker_intensity <= 0:
+                return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out)
+            if self._color is None or self._color.shape != frame.shape:
+                self._color = np.empty(frame.shape, dtype=np.uint8)
+                self._color_blurred = np.empty(frame.shape, dtype=np.uint8)
+            cv2.GaussianBlur(frame, (0, 0), self.flicker_intensity, dst=self._color_blurred)
+            cv2.addWeighted(frame, 1.5, self._color_blurred, -0.5, 0, dst=self._color)
+            return cv2.cvtColor(self._color, cv2.COLOR_BGR2GRAY, dst=out)
+        if frame.ndim == 3:
+            src = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._raw_gray)
+        else:
+            src = frame
+        if self.flicker_intensity <= 0:
+            np.copyto(out, src)
+            return out
+        cv2.GaussianBlur(src, (0, 0), self.flicker_intensity, dst=self._blurred)
+        cv2.addWeighted(src, 1.5, self._blurred, -0.5, 0, dst=out)
+        return out
+
+    def restore(self, prev_gray):
+        """Ustawia poprzednią klatkę już po filtrze (wznowienie z punktu kontrolnego)."""
+        self._allocate(prev_gray.shape)
+        np.copyto(self.prev_gray, prev_gray)
+
+    def reset(self, frame):
+        """Ustawia pierwszą klatkę (bez liczenia różnicy)."""
+        if self.prev_gray is None or self.prev_gray.shape != frame.shape[:2]:
+            self._allocate(frame.shape)
+        self._filter_into(frame, self.prev_gray)
+
+    def process(self, frame, spatial_accum=None):
+        """Zwraca wynik ruchu w ROI; opcjonalnie dodaje różnicę do spatial_accum."""
+        if self.prev_gray is None:
+            self.reset(frame)
+            return 0
+        timings = self.timings
+        if timings is not None:
+            t0 = time.perf_counter()
+        self._filter_into(frame, self.gray)
+        if timings is not None:
+            t1 = time.perf_counter()
+            timings["flicker_filter"] += t1 - t0
+        cv2.absdiff(self.prev_gray, self.gray, dst=self.diff)
+        if spatial_accum is not None:
+            if spatial_accum.shape == self.diff.shape:
+                cv2.accumulate(self.diff, spatial_accum)
+            else:
+                # Akumulator w rozdzielczości komórek mapy ruchu
+                if self._cells is None or self._cells.shape != spatial_accum.shape:
+                    self._cells = np.empty(spatial_accum.shape, dtype=np.uint8)
+                cv2.resize(self.diff, spatial_accum.shape[::-1], dst=self._cells, interpolation=cv2.INTER_AREA)
+                cv2.accumulate(self._cells, spatial_accum)
+        top, bottom = self._roi
+        roi = self.diff[top:bottom, :]
+        score = cv2.sumElems(roi)[0] / roi.size if roi.size else 0
+        if timings is not None:
+            timings["absdiff"] += time.perf_counter() - t1
+        # Zamiana buforów zamiast kopiowania
+        self.prev_gray, self.gray = self.gray, self.prev_gray
+        return score
+
 def is_dav_file(file_path):
     _, ext = os.path.splitext(file_path)
     return ext.lower() == ".dav"
@@ -43,36 +158,86 @@ def check_audio(video_file):
         print(f"Error checking audio: {e}")
         return False
 
-def create_video_capture(video_file):
+def create_video_capture(video_file, dav_cache_dir=None, dav_cache_max_bytes=None, monitor=None):
     if is_dav_file(video_file):
-        return process_dav_file(video_file)
+        return process_dav_file(video_file, dav_cache_dir, dav_cache_max_bytes, monitor)
     else:
         cap = cv2.VideoCapture(video_file)
         if not cap.isOpened():
             return None, None
         return cap, None
 
-def process_dav_file(dav_file):
+def open_frame_source(video_file, params, monitor=None):
+    """
+    Zwraca źródło klatek wybrane przez params["decoder"]: "opencv" (domyślnie)
+    albo "ffmpeg" (klatki w skali szarości prosto z dekodera, opcjonalnie
+    przycięte do pasa ROI - "decode_crop_roi", zmniejszone do szerokości
+    "decode_width" i z ograniczoną liczbą klatek "decode_fps").
+    """
+    if params.get("decoder", "opencv") == "ffmpeg":
+        # ffmpeg czyta pliki DAV bezpośrednio - bez pliku pośredniego
+        crop_rows = None
+        if params.get("decode_crop_roi"):
+            crop_rows = (params["roi_top"] / 100, params["roi_bottom"] / 100)
+        return FfmpegFrameSource(video_file, gray=True, crop_rows=crop_rows,
+                                 width=params.get("decode_width"), target_fps=params.get("decode_fps"))
+    cap, temp_file = create_video_capture(video_file, params.get("dav_cache_dir"), dav_cache_max_bytes(params),
+                                          monitor)
+    if cap is None:
+        return None
+    return OpenCVFrameSource(cap, temp_file)
+
+def kernel_roi(params):
+    """Pas ROI dla FrameKernel (ułamki wysokości klatki zwracanej przez źródło)."""
+    if params.get("decoder", "opencv") == "ffmpeg" and params.get("decode_crop_roi"):
+        return 0.0, 1.0
+    return params["roi_top"] / 100, params["roi_bottom"] / 100
+
+# Domyślny limit katalogu ze skonwertowanymi plikami DAV
+DAV_CACHE_MAX_GB = 20
+
+def dav_cache_max_bytes(params):
+    return int(float(params.get("dav_cache_max_gb", DAV_CACHE_MAX_GB)) * 1024**3)
+
+def _convert_dav(dav_file, mp4_file):
     try:
         from dav2mp4 import convert_dav_to_mp4
-        temp_dir = tempfile.gettempdir()
-        base_name = os.path.basename(dav_file)
-        mp4_file = os.path.join(temp_dir, f"{os.path.splitext(base_name)[0]}_temp.mp4")
         convert_dav_to_mp4(dav_file, mp4_file)
-        cap = cv2.VideoCapture(mp4_file)
-        if not cap.isOpened():
-            raise Exception(f"Failed to open converted file: {mp4_file}")
-        return cap, mp4_file
     except ImportError:
-        temp_dir = tempfile.gettempdir()
-        base_name = os.path.basename(dav_file)
-        mp4_file = os.path.join(temp_dir, f"{os.path.splitext(base_name)[0]}_temp.mp4")
-        cmd = ["ffmpeg", "-i", dav_file, "-c:v", "copy", "-c:a", "copy", mp4_file, "-y"]
+        cmd = ["ffmpeg", "-i", dav_file, "-c:v", "copy", "-c:a", "copy", "-f", "mp4", mp4_file, "-y"]
         subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        cap = cv2.VideoCapture(mp4_file)
-        if not cap.isOpened():
-            raise Exception(f"Failed to open converted file: {mp4_file}")
-        return cap, mp4_file
+
+def converted_dav_path(dav_file, cache_dir=None, max_bytes=None, monitor=None):
+    """
+    Zwraca ścieżkę pliku MP4 skonwertowanego z DAV. Konwersja odbywa się raz:
+    wynik trafia do pamięci podręcznej pod kluczem odcisku zawartości, więc
+    kolejne etapy analizy i ponowne uruchomienia korzystają z tego samego pliku.
+    Katalog jest ograniczany do max_bytes (usuwane są najdawniej używane pliki).
+    """
+    cache_dir = cache_dir or default_cache_dir("dav")
+    max_bytes = DAV_CACHE_MAX_GB * 1024**3 if max_bytes is None else max_bytes
+    mp4_file = os.path.join(cache_dir, f"{file_fingerprint(dav_file)}.mp4")
+    if os.path.exists(mp4_file):
+        touch(mp4_file)
+        return mp4_file
+    # Zapis do pliku .part i zamiana nazwy - równoległe procesy nie zobaczą niepełnego pliku
+    part_file = f"{mp4_file}.{os.getpid()}.part"
+    try:
+        with monitor.stage("dav_conversion", subprocess=True) if monitor else nullcontext():
+            _convert_dav(dav_file, part_file)
+        os.replace(part_file, mp4_file)
+    finally:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+    evict_lru(cache_dir, max_bytes, keep=[mp4_file])
+    return mp4_file
+
+def process_dav_file(dav_file, cache_dir=None, max_bytes=None, monitor=None):
+    mp4_file = converted_dav_path(dav_file, cache_dir, max_bytes, monitor)
+    cap = cv2.VideoCapture(mp4_file)
+    if not cap.isOpened():
+        raise Exception(f"Failed to open converted file: {mp4_file}")
+    return cap, mp4_file
 
 def merge_motion_peaks(peaks, frame_tolerance=5, gap_threshold=5):
     if not peaks:
@@ -98,27 +263,77 @@ def merge_motion_peaks(peaks, frame_tolerance=5, gap_threshold=5):
     merged.append(current)
     return merged
 
+def _figure(figsize=None):
+    # matplotlib jest importowany dopiero przy pierwszym wykresie (szybki start
+    # procesów roboczych). Figure z własnym FigureCanvasAgg nie korzysta z
+    # globalnego stanu pyplot ani z ekranu, więc wykresy mogą powstawać
+    # równolegle w wątkach zapisu wyników (postprocessing.py).
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
 def plot_flicker_trend(flicker_time_list, flicker_list, out_dir):
-    if not flicker_time_list:
+    if len(flicker_time_list) == 0:
         return
-    plt.figure()
-    plt.plot(flicker_time_list, flicker_list, "o", label="Wartość migotania")
+    fig = _figure()
+    ax = fig.add_subplot()
+    ax.plot(flicker_time_list, flicker_list, "o", label="Wartość migotania")
     coeffs = np.polyfit(flicker_time_list, flicker_list, 1)
     trend = np.poly1d(coeffs)
-    x_trend = np.linspace(min(flicker_time_list), max(flicker_time_list), 100)
-    plt.plot(x_trend, trend(x_trend), "r-", label="Trend")
-    plt.xlabel("Czas (s)")
-    plt.ylabel("Wartość migotania")
-    plt.title("Wykres wykrytego migotania")
-    plt.legend()
+    x_trend = np.linspace(np.min(flicker_time_list), np.max(flicker_time_list), 100)
+    ax.plot(x_trend, trend(x_trend), "r-", label="Trend")
+    ax.set_xlabel("Czas (s)")
+    ax.set_ylabel("Wartość migotania")
+    ax.set_title("Wykres wykrytego migotania")
+    ax.legend()
     filename = os.path.join(out_dir, "wykres_wykrytego_migotania.png")
-    plt.savefig(filename, dpi=300, bbox_inches="tight")
-    plt.close()
+    fig.savefig(filename, dpi=300, bbox_inches="tight")
+
+# Rozmiar komórki mapy ruchu (w pikselach klatki)
+SPATIAL_CELL_SIZE = 10
+
+def spatial_accum_shape(frame_size, params):
+    """
+    Kształt akumulatora przestrzennego: pełna rozdzielczość klatki albo - przy
+    params["spatial_cell_accum"] - od razu rozdzielczość komórek mapy ruchu.
+    """
+    width, height = frame_size
+    if params.get("spatial_cell_accum"):
+        return (-(-height // SPATIAL_CELL_SIZE), -(-width // SPATIAL_CELL_SIZE))
+    return (height, width)
+
+def _cell_means(norm, cell_size):
+    # Średnie w komórkach cell_size x cell_size jedną operacją (ostatni wiersz
+    # i kolumna komórek mogą być niepełne - dzielimy przez faktyczną liczbę pikseli).
+    height, width = norm.shape
+    rows, cols = -(-height // cell_size), -(-width // cell_size)
+    padded = np.zeros((rows * cell_size, cols * cell_size), dtype=np.float64)
+    padded[:height, :width] = norm
+    sums = padded.reshape(rows, cell_size, cols, cell_size).sum(axis=(1, 3))
+    row_counts = np.full(rows, cell_size)
+    row_counts[-1] = height - (rows - 1) * cell_size
+    col_counts = np.full(cols, cell_size)
+    col_counts[-1] = width - (cols - 1) * cell_size
+    return sums / np.outer(row_counts, col_counts)
+
+def plot_motion_series(time_points, motion_scores, threshold, plot_filename):
+    if len(time_points) == 0:
+        return
+    fig = _figure(figsize=(12, 4))
+    ax = fig.add_subplot()
+    ax.plot(time_points, motion_scores, "-", linewidth=0.6, label="Wynik ruchu")
+    ax.axhline(threshold, color="r", linestyle="--", linewidth=0.8, label="Próg")
+    ax.set_xlabel("Czas (s)")
+    ax.set_ylabel("Wynik ruchu")
+    ax.set_title("Wykres ruchu")
+    ax.legend()
+    fig.savefig(plot_filename, dpi=150, bbox_inches="tight")
 
 def generate_spatial_analysis_image(accum, out_dir, base_name, timestamp, frame_size):
     norm = cv2.normalize(accum, None, 0, 1.0, cv2.NORM_MINMAX)
-    height, width = norm.shape
-    spatial_img = np.zeros((height, width, 3), dtype=np.uint8)
+    width, height = frame_size
     violet_palette = [
         (230, 190, 250),
         (200, 150, 220),
@@ -127,17 +342,18 @@ def generate_spatial_analysis_image(accum, out_dir, base_name, timestamp, frame_
         (110, 30, 130)
     ]
     blue_color = (255, 0, 0)
-    cell_size = 10
-    for y in range(0, height, cell_size):
-        for x in range(0, width, cell_size):
-            cell = norm[y:min(y+cell_size, height), x:min(x+cell_size, width)]
-            avg = np.mean(cell)
-            if avg < 0.1:
-                color = blue_color
-            else:
-                idx = int(min(4, (avg - 0.1) / (0.9/5)))
-                color = violet_palette[idx]
-            cv2.rectangle(spatial_img, (x, y), (x+cell_size-1, y+cell_size-1), color, -1)
+    cell_size = SPATIAL_CELL_SIZE
+    if norm.shape == (height, width):
+        cells = _cell_means(norm, cell_size)
+    else:
+        # Akumulator liczony od razu w rozdzielczości komórek
+        cells = norm.astype(np.float64)
+    # Indeks koloru: 0 - brak ruchu, 1..5 - kolejne odcienie fioletu
+    color_idx = np.where(cells < 0.1, 0,
+                         1 + np.clip(np.floor((cells - 0.1) / (0.9/5)), 0, 4)).astype(np.intp)
+    palette_lut = np.array([blue_color] + violet_palette, dtype=np.uint8)
+    cell_img = palette_lut[color_idx]
+    spatial_img = np.repeat(np.repeat(cell_img, cell_size, axis=0), cell_size, axis=1)[:height, :width]
     legend_height = int(0.2 * height)
     final_img = np.full((height+legend_height, width, 3), 255, dtype=np.uint8)
     final_img[0:height, 0:width] = spatial_img
@@ -156,58 +372,194 @@ def generate_spatial_analysis_image(accum, out_dir, base_name, timestamp, frame_
     spatial_filename = os.path.join(out_dir, f"analiza_przestrzenna_{base_name}_{timestamp}.png")
     cv2.imwrite(spatial_filename, final_img)
 
-def generate_krawedz_screenshots(cap, out_dir, base_name, timestamp, roi_top_percent, roi_bottom_percent):
+def _krawedz_dir(out_dir):
     krawedz_dir = os.path.join(out_dir, "Krawedz")
     if not os.path.exists(krawedz_dir):
         os.makedirs(krawedz_dir)
+    return krawedz_dir
+
+def _krawedz_filename(krawedz_dir, base_name, timestamp, idx):
+    return os.path.join(krawedz_dir, f"screenshot_{base_name}_{timestamp}_{idx}.png")
+
+def krawedz_indices(total_frames):
+    return [0, total_frames-1, total_frames//4, total_frames//2, (3*total_frames)//4]
+
+def save_krawedz_screenshot(frame, idx, krawedz_dir, base_name, timestamp, roi_top_percent, roi_bottom_percent):
+    if frame.ndim == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    else:
+        frame = frame.copy()
+    height = frame.shape[0]
+    roi_top = int((roi_top_percent/100)*height)
+    roi_bottom = int((roi_bottom_percent/100)*height)
+    cv2.line(frame, (0, roi_top), (frame.shape[1], roi_top), (0,0,255), 2)
+    cv2.line(frame, (0, roi_bottom), (frame.shape[1], roi_bottom), (0,0,255), 2)
+    cv2.imwrite(_krawedz_filename(krawedz_dir, base_name, timestamp, idx), frame)
+
+def generate_krawedz_screenshots(cap, out_dir, base_name, timestamp, roi_top_percent, roi_bottom_percent):
+    krawedz_dir = _krawedz_dir(out_dir)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    indices = [0, total_frames-1, total_frames//4, total_frames//2, (3*total_frames)//4]
-    for idx in indices:
+    for idx in krawedz_indices(total_frames):
         cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
         ret, frame = cap.read()
         if ret:
-            height = frame.shape[0]
-            roi_top = int((roi_top_percent/100)*height)
-            roi_bottom = int((roi_bottom_percent/100)*height)
-            cv2.line(frame, (0, roi_top), (frame.shape[1], roi_top), (0,0,255), 2)
-            cv2.line(frame, (0, roi_bottom), (frame.shape[1], roi_bottom), (0,0,255), 2)
-            screenshot_filename = os.path.join(krawedz_dir, f"screenshot_{base_name}_{timestamp}_{idx}.png")
-            cv2.imwrite(screenshot_filename, frame)
+            save_krawedz_screenshot(frame, idx, krawedz_dir, base_name, timestamp, roi_top_percent, roi_bottom_percent)
     cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-def extract_fragments(motion_peaks, fps, frame_size, base_name, timestamp, out_dir, video_source, video_duration):
-    if not motion_peaks:
-        return []
+class ScreenshotCollector:
+    """
+    Zapisuje zrzuty krawędzi ROI (pierwsza, ostatnia klatka i kwartyle) w trakcie
+    głównej pętli - indeksy są znane z góry z liczby klatek, więc nie trzeba
+    ponownie otwierać nagrania ani przewijać. Opcjonalnie zapisuje miniaturę
+    każdego wykrytego szczytu w klatce max_frame (katalog "Szczyty").
+    """
+
+    def __init__(self, frame_count, out_dir, base_name, timestamp, roi_top_percent, roi_bottom_percent,
+                 peak_thumbnails=False, frame_range=None):
+        self.out_dir = out_dir
+        self.base_name = base_name
+        self.timestamp = timestamp
+        self.roi = (roi_top_percent, roi_bottom_percent)
+        indices = set(krawedz_indices(frame_count))
+        if frame_range is not None:
+            start, end = frame_range
+            indices = {idx for idx in indices if idx >= start and (end is None or idx < end)}
+        self.pending = indices
+        self.peak_thumbnails = peak_thumbnails
+        self._peak_frame = None
+        self._peaks_seen = 0
+        self._last = None
+
+    def offer(self, frame_idx, frame):
+        """
+        Wywoływane dla każdej zdekodowanej klatki. Przy zmniejszonej liczbie klatek
+        (decode_fps) zrzut dostaje pierwsza zdekodowana klatka nie wcześniejsza niż indeks.
+        """
+        self._last = (frame_idx, frame)
+        if self.pending and frame_idx >= min(self.pending):
+            for idx in sorted(idx for idx in self.pending if idx <= frame_idx):
+                self.pending.discard(idx)
+                save_krawedz_screenshot(frame, idx, _krawedz_dir(self.out_dir), self.base_name,
+                                        self.timestamp, *self.roi)
+
+    def observe_peak(self, frame_idx, frame, detector):
+        """Śledzi klatkę maksimum bieżącego szczytu i zapisuje miniaturę, gdy szczyt się zamknie."""
+        if not self.peak_thumbnails:
+            return
+        peak = detector.current_peak
+        if peak is not None and peak["max_frame"] == frame_idx:
+            self._peak_frame = frame
+        if len(detector.peaks) > self._peaks_seen:
+            for closed in detector.peaks[self._peaks_seen:]:
+                self._save_peak(closed)
+            self._peaks_seen = len(detector.peaks)
+
+    def _save_peak(self, peak):
+        if self._peak_frame is None:
+            return
+        peaks_dir = os.path.join(self.out_dir, "Szczyty")
+        os.makedirs(peaks_dir, exist_ok=True)
+        filename = os.path.join(peaks_dir, f"szczyt_{self.base_name}_{self.timestamp}_{peak['max_frame']}.jpg")
+        cv2.imwrite(filename, self._peak_frame)
+        self._peak_frame = None
+
+    def finish(self, detector=None):
+        # Liczba klatek z kontenera bywa zawyżona - brakujące indeksy z końca
+        # nagrania dostają ostatnią faktycznie zdekodowaną klatkę.
+        if self._last is not None:
+            last_idx, last_frame = self._last
+            for idx in sorted(self.pending):
+                if idx > last_idx:
+                    save_krawedz_screenshot(last_frame, idx, _krawedz_dir(self.out_dir), self.base_name,
+                                            self.timestamp, *self.roi)
+            self.pending = {idx for idx in self.pending if idx <= last_idx}
+        if detector is not None and self.peak_thumbnails:
+            for closed in detector.peaks[self._peaks_seen:]:
+                self._save_peak(closed)
+            self._peaks_seen = len(detector.peaks)
+
+# Ile fragmentów wycina jeden proces ffmpeg (ogranicza długość wiersza poleceń i liczbę otwartych plików)
+FRAGMENT_BATCH_SIZE = 32
+
+def _fragment_input_args(peak, video_source, video_duration):
+    # -ss/-t przed -i: ffmpeg przewija wejście do najbliższej klatki kluczowej
+    # i czyta tylko ten zakres, zamiast dekodować plik od początku.
+    start_time = peak["start_time"]
+    end_time = peak["end_time"]
+    args = []
+    if start_time > 0:
+        args += ["-ss", f"{start_time:.3f}"]
+    if end_time < video_duration:
+        args += ["-t", f"{end_time - start_time:.3f}"]
+    return args + ["-i", video_source]
+
+def _fragment_output_args(input_idx, fragment_filename):
+    return ["-map", f"{input_idx}:v:0", "-map", f"{input_idx}:a?",
+            "-c:v", "copy", "-c:a", "copy", fragment_filename]
+
+def _extract_fragment_batch(batch, video_source, video_duration):
+    """Wycina wszystkie fragmenty z batch [(nr, peak, plik), ...] jednym procesem ffmpeg."""
+    cmd = ["ffmpeg", "-v", "error", "-y"]
+    for _, peak, _ in batch:
+        cmd += _fragment_input_args(peak, video_source, video_duration)
+    for input_idx, (_, _, fragment_filename) in enumerate(batch):
+        cmd += _fragment_output_args(input_idx, fragment_filename)
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def cut_fragments(jobs, video_source, video_duration):
+    """
+    Wycina fragmenty jobs [(nr, peak, plik), ...] z video_source partiami po
+    FRAGMENT_BATCH_SIZE (jeden proces ffmpeg na partię); zwraca listę zapisanych plików.
+    """
     all_fragments = []
-    for i, peak in enumerate(motion_peaks, 1):
-        start_time = peak["start_time"]
-        end_time = peak["end_time"]
-        cmd = ["ffmpeg", "-i", video_source]
-        if start_time > 0:
-            cmd += ["-ss", str(start_time)]
-        if end_time < video_duration:
-            cmd += ["-to", str(end_time)]
-        fragment_filename = os.path.join(out_dir, f"fragment_{base_name}_{timestamp}_{i}.mp4")
-        cmd += ["-c:v", "copy", "-c:a", "copy", fragment_filename, "-y"]
+    for b in range(0, len(jobs), FRAGMENT_BATCH_SIZE):
+        batch = jobs[b:b + FRAGMENT_BATCH_SIZE]
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            all_fragments.append(fragment_filename)
-        except subprocess.CalledProcessError as e:
-            print(f"Error extracting fragment {i}: {e.stderr.decode()}")
+            _extract_fragment_batch(batch, video_source, video_duration)
+            all_fragments.extend(filename for _, _, filename in batch)
+        except subprocess.CalledProcessError:
+            # Jeden uszkodzony zakres nie może zablokować pozostałych - ponawiamy pojedynczo
+            for job in batch:
+                try:
+                    _extract_fragment_batch([job], video_source, video_duration)
+                    all_fragments.append(job[2])
+                except subprocess.CalledProcessError as e:
+                    print(f"Error extracting fragment {job[0]}: {e.stderr.decode()}")
     return all_fragments
 
-def merge_fragments(fragment_list, out_dir):
+def extract_fragments(motion_peaks, fps, frame_size, base_name, timestamp, out_dir, video_source, video_duration):
+    if not motion_peaks:
+        return []
+    jobs = [(i, peak, os.path.join(out_dir, f"fragment_{base_name}_{timestamp}_{i}.mp4"))
+            for i, peak in enumerate(motion_peaks, 1)]
+    return cut_fragments(jobs, video_source, video_duration)
+
+def _concat_quote(path):
+    return "'" + os.path.abspath(path).replace("'", "'\\''") + "'"
+
+def merge_peaks_from_source(motion_peaks, video_source, out_dir, video_duration):
+    """
+    Buduje plik z połączonymi fragmentami ruchu bezpośrednio z nagrania
+    źródłowego - jeden przebieg ffmpeg (concat z dyrektywami inpoint/outpoint,
+    kopiowanie strumieni), bez zapisywania i ponownego czytania fragmentów.
+    """
+    if not motion_peaks:
+        return None
     merged_filename = os.path.join(out_dir, "Wszystkie_polaczone_fragmenty.mp4")
     list_file = os.path.join(out_dir, "fragments_list.txt")
     with open(list_file, "w", encoding="utf-8") as f:
-        for frag in fragment_list:
-            full_path = os.path.abspath(frag)
-            f.write(f"file '{full_path}'\n")
+        for peak in motion_peaks:
+            f.write(f"file {_concat_quote(video_source)}\n")
+            if peak["start_time"] > 0:
+                f.write(f"inpoint {peak['start_time']:.3f}\n")
+            if peak["end_time"] < video_duration:
+                f.write(f"outpoint {peak['end_time']:.3f}\n")
     cmd_merge = [
         "ffmpeg",
         "-f", "concat",
         "-safe", "0",
         "-i", list_file,
+        "-map", "0:v:0", "-map", "0:a?",
         "-c", "copy",
         merged_filename,
         "-y"
@@ -215,105 +567,93 @@ def merge_fragments(fragment_list, out_dir):
     subprocess.run(cmd_merge, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return merged_filename
 
-def analyze_video(video_file, output_dir, params):
-    cap, temp_file = create_video_capture(video_file)
-    if cap is None:
-        raise Exception(f"Nie udało się otworzyć pliku: {video_file}")
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    video_duration = frame_count / fps
-    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    base_name = os.path.splitext(os.path.basename(video_file))[0]
-    out_dir = os.path.join(output_dir, base_name)
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    output_filename = os.path.join(out_dir, f"analiza_ruchu_{base_name}_{timestamp}.csv")
-    peak_filename = os.path.join(out_dir, f"szczytowe_momenty_{base_name}_{timestamp}.txt")
-    plot_filename = os.path.join(out_dir, f"wykres_ruchu_{base_name}_{timestamp}.png")
-    
-    spatial_accum = np.zeros(frame_size[::-1], dtype=np.float32)
-    flicker_list, flicker_time_list, motion_list = [], [], []
-    frame_indices, motion_scores, time_points, motion_peaks = [], [], [], []
-    frame_idx = 0
-    threshold = params["motion_threshold"]
-    seconds_before = params["seconds_before"]
-    seconds_after = params["seconds_after"]
-    current_peak = None
-    
-    ret, frame = cap.read()
-    if not ret or frame is None:
-        cap.release()
-        raise Exception(f"Nie udało się odczytać pierwszej klatki z {video_file}")
-    frame = apply_flicker_filter(frame, params["flicker_filter_intensity"])
-    prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_idx += 1
-        time_sec = frame_idx / fps
-        time_str = str(timedelta(seconds=int(time_sec)))
-        filtered_frame = apply_flicker_filter(frame, params["flicker_filter_intensity"])
-        gray = cv2.cvtColor(filtered_frame, cv2.COLOR_BGR2GRAY)
-        spatial_accum += cv2.absdiff(prev_gray, gray).astype(np.float32)
-        motion_score = process_frame(prev_gray, gray, roi_top=params["roi_top"]/100, roi_bottom=params["roi_bottom"]/100)
-        frame_indices.append(frame_idx)
-        time_points.append(timedelta(seconds=int(time_sec)))
-        motion_scores.append(motion_score)
-        
-        if motion_score <= threshold:
-            flicker_list.append(motion_score)
-            flicker_time_list.append(time_sec)
-        else:
-            motion_list.append(motion_score)
-        
-        if motion_score > threshold:
-            if current_peak is None:
-                start_time_sec = 0 if time_sec <= seconds_before else time_sec - seconds_before
-                start_frame = 0 if time_sec <= seconds_before else frame_idx - int(seconds_before * fps)
-                current_peak = {"start_frame": start_frame,
-                                "start_time": start_time_sec,
-                                "start_time_str": str(timedelta(seconds=int(start_time_sec))),
-                                "max_score": motion_score,
-                                "max_frame": frame_idx,
-                                "max_time": time_sec,
-                                "max_time_str": str(timedelta(seconds=int(time_sec)))}
-                if params["show_motion"]:
-                    scale = params.get("motion_display_scale", 0.5)
-                    display_time_ms = int(params.get("motion_display_time", 2) * 1000)
-                    small_frame = cv2.resize(frame, None, fx=scale, fy=scale)
-                    cv2.imshow("Wykryty ruch", small_frame)
-                    cv2.waitKey(display_time_ms)
-                    cv2.destroyWindow("Wykryty ruch")
-            elif motion_score > current_peak["max_score"]:
-                current_peak["max_score"] = motion_score
-                current_peak["max_frame"] = frame_idx
-                current_peak["max_time"] = time_sec
-                current_peak["max_time_str"] = str(timedelta(seconds=int(time_sec)))
-        elif current_peak is not None and motion_score <= threshold:
-            end_time_sec = time_sec + seconds_after
-            if end_time_sec > video_duration:
-                end_time_sec = video_duration
-            current_peak["end_frame"] = frame_idx + int(seconds_after * fps)
-            current_peak["end_time"] = end_time_sec
-            current_peak["end_time_str"] = str(timedelta(seconds=int(end_time_sec)))
-            motion_peaks.append(current_peak)
-            current_peak = None
-        prev_gray = gray
-    if current_peak is not None:
-        end_time_sec = time_sec + seconds_after
-        if end_time_sec > video_duration:
-            end_time_sec = video_duration
-        current_peak["end_frame"] = frame_idx + int(seconds_after * fps)
-        current_peak["end_time"] = end_time_sec
-        current_peak["end_time_str"] = str(timedelta(seconds=int(end_time_sec)))
-        motion_peaks.append(current_peak)
-    cap.release()
-    
-    merged_peaks = merge_motion_peaks(motion_peaks, frame_tolerance=5, gap_threshold=params["merge_gap_threshold"])
-    
+class PeakDetector:
+    """
+    Maszyna stanów wykrywania szczytów ruchu: otwiera szczyt, gdy wynik
+    przekroczy próg, śledzi maksimum i zamyka szczyt przy pierwszej klatce
+    poniżej progu (z doliczeniem seconds_before/seconds_after).
+    """
+
+    def __init__(self, threshold, seconds_before, seconds_after, fps, video_duration):
+        self.threshold = threshold
+        self.seconds_before = seconds_before
+        self.seconds_after = seconds_after
+        self.fps = fps
+        self.video_duration = video_duration
+        self.current_peak = None
+        self.peaks = []
+        self.last_frame = 0
+
+    def update(self, frame_idx, motion_score):
+        """Przetwarza wynik klatki; zwraca True, gdy właśnie rozpoczął się nowy szczyt."""
+        self.last_frame = frame_idx
+        time_sec = frame_idx / self.fps
+        if motion_score > self.threshold:
+            if self.current_peak is None:
+                start_time_sec = 0 if time_sec <= self.seconds_before else time_sec - self.seconds_before
+                start_frame = 0 if time_sec <= self.seconds_before else frame_idx - int(self.seconds_before * self.fps)
+                self.current_peak = {"start_frame": start_frame,
+                                     "start_time": start_time_sec,
+                                     "start_time_str": str(timedelta(seconds=int(start_time_sec))),
+                                     "max_score": motion_score,
+                                     "max_frame": frame_idx,
+                                     "max_time": time_sec,
+                                     "max_time_str": str(timedelta(seconds=int(time_sec)))}
+                return True
+            if motion_score > self.current_peak["max_score"]:
+                self.current_peak["max_score"] = motion_score
+                self.current_peak["max_frame"] = frame_idx
+                self.current_peak["max_time"] = time_sec
+                self.current_peak["max_time_str"] = str(timedelta(seconds=int(time_sec)))
+        elif self.current_peak is not None:
+            self._close(frame_idx)
+        return False
+
+    def _close(self, frame_idx):
+        end_time_sec = frame_idx / self.fps + self.seconds_after
+        if end_time_sec > self.video_duration:
+            end_time_sec = self.video_duration
+        self.current_peak["end_frame"] = frame_idx + int(self.seconds_after * self.fps)
+        self.current_peak["end_time"] = end_time_sec
+        self.current_peak["end_time_str"] = str(timedelta(seconds=int(end_time_sec)))
+        self.peaks.append(self.current_peak)
+        self.current_peak = None
+
+    def feed_series(self, frames, scores):
+        """
+        Przetwarza całą serię wyników naraz. Do maszyny stanów trafiają tylko
+        klatki, które mogą zmienić jej stan (początek serii powyżej progu,
+        jej maksimum i pierwsza klatka poniżej progu), więc wynik jest taki sam
+        jak przy wywoływaniu update() dla każdej klatki, a czas zależy od liczby
+        szczytów, a nie od długości nagrania.
+        """
+        frames = np.asarray(frames)
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            return
+        above = np.flatnonzero(scores > self.threshold)
+        if self.current_peak is not None and (len(above) == 0 or above[0] != 0):
+            self.update(int(frames[0]), float(scores[0]))
+        if len(above):
+            breaks = np.flatnonzero(np.diff(above) != 1)
+            run_starts = np.concatenate(([above[0]], above[breaks + 1]))
+            run_ends = np.concatenate((above[breaks], [above[-1]]))
+            for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+                self.update(int(frames[start]), float(scores[start]))
+                peak_pos = start + int(np.argmax(scores[start:end + 1]))
+                if peak_pos != start:
+                    self.update(int(frames[peak_pos]), float(scores[peak_pos]))
+                if end + 1 < len(scores):
+                    self.update(int(frames[end + 1]), float(scores[end + 1]))
+        self.last_frame = int(frames[-1])
+
+    def finish(self):
+        """Zamyka szczyt trwający do końca nagrania i zwraca listę szczytów."""
+        if self.current_peak is not None:
+            self._close(self.last_frame)
+        return self.peaks
+
+def write_peaks_report(merged_peaks, peak_filename):
     with open(peak_filename, "w", encoding="utf-8") as f:
         if not merged_peaks:
             f.write("Nie wykryto znaczącego ruchu.\n")
@@ -323,19 +663,377 @@ def analyze_video(video_file, output_dir, params):
                 f.write(f"  Początek: {peak['start_time_str']} (klatka {peak['start_frame']})\n")
                 f.write(f"  Koniec: {peak['end_time_str']} (klatka {peak['end_frame']})\n")
                 f.write(f"  Szczyt: {peak['max_time_str']} (klatka {peak['max_frame']}, wynik: {peak['max_score']:.4f})\n\n")
-    
-    plot_flicker_trend(flicker_time_list, flicker_list, out_dir)
-    generate_spatial_analysis_image(spatial_accum, out_dir, base_name, timestamp, frame_size)
-    cap0, _ = create_video_capture(video_file)
-    generate_krawedz_screenshots(cap0, out_dir, base_name, timestamp, params["roi_top"], params["roi_bottom"])
-    fragments = extract_fragments(merged_peaks, fps, frame_size, base_name, timestamp, out_dir, video_file, video_duration)
-    merged_file = None
-    if params["merge_fragments"] and fragments:
-        merged_file = merge_fragments(fragments, out_dir)
+
+def prepare_output(video_file, output_dir):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_name = os.path.splitext(os.path.basename(video_file))[0]
+    out_dir = os.path.join(output_dir, base_name)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    return {
+        "timestamp": timestamp,
+        "base_name": base_name,
+        "out_dir": out_dir,
+        "output_csv": os.path.join(out_dir, f"analiza_ruchu_{base_name}_{timestamp}.csv"),
+        "series_npy": os.path.join(out_dir, f"analiza_ruchu_{base_name}_{timestamp}.npy"),
+        "peaks_txt": os.path.join(out_dir, f"szczytowe_momenty_{base_name}_{timestamp}.txt"),
+        "motion_plot": os.path.join(out_dir, f"wykres_ruchu_{base_name}_{timestamp}.png"),
+        "timing_log": os.path.join(out_dir, f"czasy_{base_name}_{timestamp}.json"),
+        "started_at": time.time()
+    }
+
+# Pliki wyników bez znacznika czasu w nazwie (nadpisywane przy każdej analizie)
+SHARED_OUTPUTS = ("wykres_wykrytego_migotania.png", "Wszystkie_polaczone_fragmenty.mp4", "fragments_list.txt")
+
+def remove_partial_outputs(out):
+    """
+    Sprząta po przerwanej analizie: usuwa pliki ze znacznikiem czasu tej analizy
+    oraz wspólne pliki zapisane po jej rozpoczęciu. Wyniki wcześniejszych analiz zostają.
+    """
+    out_dir = out["out_dir"]
+    tag = f"{out['base_name']}_{out['timestamp']}"
+    for directory in (os.path.join(out_dir, "Krawedz"), os.path.join(out_dir, "Szczyty"), out_dir):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            if tag in name or (name in SHARED_OUTPUTS and os.path.getmtime(path) >= out["started_at"]):
+                os.remove(path)
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+def media_source(video_file, params, monitor=None):
+    """
+    Plik, z którego ffmpeg wycina fragmenty: dla DAV (dekoder OpenCV) skonwertowany
+    MP4 z pamięci podręcznej - konwersja nie jest powtarzana, a ffmpeg nie demultipleksuje
+    surowego DAV przy każdym fragmencie. Dekoder ffmpeg czyta DAV bezpośrednio.
+    """
+    if is_dav_file(video_file) and params.get("decoder", "opencv") != "ffmpeg":
+        return converted_dav_path(video_file, params.get("dav_cache_dir"), dav_cache_max_bytes(params), monitor)
+    return video_file
+
+def finish_analysis(video_file, params, out, motion_peaks, series,
+                    spatial_accum, fps, frame_size, video_duration, screenshots_done=False, monitor=None,
+                    video_source=None):
+    """
+    Wspólna część po pętli analizy: łączenie szczytów, raporty, zrzuty i fragmenty.
+    Niezależne wyniki zapisywane są równolegle (postprocessing.TaskGraph,
+    params["postprocess_workers"] wątków), procesy ffmpeg w pierwszej kolejności.
+    video_source - plik już otwarty przez analizę (np. skonwertowany DAV, FrameSource.temp_file);
+    bez niego wyznacza go media_source.
+    """
+    monitor = monitor or AnalysisMonitor()
+    out_dir, base_name, timestamp = out["out_dir"], out["base_name"], out["timestamp"]
+    with monitor.stage("merge_peaks"):
+        merged_peaks = merge_motion_peaks(motion_peaks, frame_tolerance=5, gap_threshold=params["merge_gap_threshold"])
+    needs_source = not screenshots_done or (merged_peaks and (params.get("save_fragments", True) or
+                                                              params["merge_fragments"]))
+    if video_source is None and needs_source:
+        # Przed grafem zadań - zadania ffmpeg działają równolegle i nie mogą konwertować pliku jednocześnie
+        video_source = media_source(video_file, params, monitor)
+
+    def screenshots():
+        cap0, _ = create_video_capture(video_source, params.get("dav_cache_dir"), dav_cache_max_bytes(params))
+        generate_krawedz_screenshots(cap0, out_dir, base_name, timestamp, params["roi_top"], params["roi_bottom"])
+        cap0.release()
+
+    graph = TaskGraph(params.get("postprocess_workers", POSTPROCESS_WORKERS), monitor)
+    graph.add("peaks_report", lambda: write_peaks_report(merged_peaks, out["peaks_txt"]))
+    graph.add("plot_flicker_trend",
+              lambda: plot_flicker_trend(*flicker_sample(series, params["motion_threshold"]), out_dir))
+    graph.add("plot_motion_series",
+              lambda: plot_motion_series(*decimate_max(series), params["motion_threshold"], out["motion_plot"]))
+    graph.add("spatial_analysis_image",
+              lambda: generate_spatial_analysis_image(spatial_accum, out_dir, base_name, timestamp, frame_size))
+    if not screenshots_done:
+        graph.add("screenshots", screenshots)
+    if params.get("save_fragments", True):
+        graph.add("ffmpeg_fragments", lambda: extract_fragments(merged_peaks, fps, frame_size, base_name, timestamp,
+                                                                out_dir, video_source, video_duration),
+                  subprocess=True)
+    if params["merge_fragments"] and merged_peaks:
+        graph.add("ffmpeg_merge", lambda: merge_peaks_from_source(merged_peaks, video_source, out_dir, video_duration),
+                  subprocess=True)
+    if params.get("peak_index"):
+        def index_peaks():
+            from peak_index import index_result
+            return index_result(params["peak_index"], video_file, params, merged_peaks, fps, video_duration,
+                                graph.results.get("ffmpeg_fragments", []), out_dir)
+        # Indeks zapisuje ścieżki fragmentów, więc czeka na ich wycięcie
+        graph.add("peak_index", index_peaks, deps=[name for name in ("ffmpeg_fragments",) if name in graph.tasks])
+    results = graph.run()
+    fragments = results.get("ffmpeg_fragments", [])
+    merged_file = results.get("ffmpeg_merge")
     
     return {
-        "output_csv": output_filename,
-        "peaks_txt": peak_filename,
-        "motion_plot": plot_filename,
-        "merged_file": merged_file
+        "output_csv": out["output_csv"],
+        "series_npy": out["series_npy"],
+        "peaks_txt": out["peaks_txt"],
+        "motion_plot": out["motion_plot"],
+        "merged_file": merged_file,
+        "fragments": fragments,
+        "peaks": merged_peaks,
+        "timings": monitor.finish()
+    }
+
+def timing_log_path(params, out):
+    """Plik dziennika czasów etapów, jeśli włączono params["timing_log"]."""
+    return out["timing_log"] if params.get("timing_log") else None
+
+def detect_motion_peaks(series, params, fps, video_duration):
+    detector = PeakDetector(params["motion_threshold"], params["seconds_before"], params["seconds_after"],
+                            fps, video_duration)
+    detector.feed_series(series["frame"], series["score"])
+    return detector.finish()
+
+def cache_scores(video_file, params, series, spatial_accum, fps, frame_count, frame_size, video_duration, out):
+    if not params.get("score_cache"):
+        return
+    meta = {"fps": fps, "frame_count": frame_count, "frame_size": list(frame_size),
+            "video_duration": video_duration}
+    # Zrzuty krawędzi zapisane już w tym przebiegu - analiza z pamięci podręcznej ich nie dekoduje
+    screenshots = {}
+    krawedz_dir = _krawedz_dir(out["out_dir"])
+    for idx in set(krawedz_indices(frame_count)):
+        filename = _krawedz_filename(krawedz_dir, out["base_name"], out["timestamp"], idx)
+        if os.path.exists(filename):
+            with open(filename, "rb") as f:
+                screenshots[idx] = f.read()
+    store_scores(score_cache_key(video_file, params), params, series, spatial_accum, meta, screenshots)
+
+def redetect_peaks(video_file, params):
+    """
+    Szybkie ponowne wyznaczenie szczytów (np. po zmianie motion_threshold,
+    seconds_before/after czy merge_gap_threshold) z wyników zapisanych
+    w pamięci podręcznej - bez dekodowania nagrania i bez zapisywania wyników.
+    Zwraca None, jeśli nagranie z tymi parametrami ROI/filtru nie było jeszcze analizowane.
+    """
+    cached = load_scores(score_cache_key(video_file, params), params)
+    if cached is None:
+        return None
+    meta = cached["meta"]
+    motion_peaks = detect_motion_peaks(cached["series"], params, meta["fps"], meta["video_duration"])
+    return merge_motion_peaks(motion_peaks, frame_tolerance=5, gap_threshold=params["merge_gap_threshold"])
+
+def _analyze_cached(video_file, output_dir, params, cached, monitor):
+    meta = cached["meta"]
+    fps, video_duration, frame_size = meta["fps"], meta["video_duration"], tuple(meta["frame_size"])
+    out = prepare_output(video_file, output_dir)
+    monitor.start(video_file, meta["frame_count"], timing_log_path(params, out), output=out)
+    series = cached["series"]
+    series_writer = MotionSeriesWriter(out["output_csv"], out["series_npy"])
+    series_writer.extend(series["frame"], series["time"], series["score"])
+    series_writer.close()
+    motion_peaks = detect_motion_peaks(series, params, fps, video_duration)
+    screenshots = cached["screenshots"]
+    if screenshots:
+        krawedz_dir = _krawedz_dir(out["out_dir"])
+        for idx, data in screenshots.items():
+            with open(_krawedz_filename(krawedz_dir, out["base_name"], out["timestamp"], idx), "wb") as f:
+                f.write(data)
+    if params.get("peak_thumbnails"):
+        monitor.notice("Miniatury szczytów nie są zapisywane przy wynikach z pamięci podręcznej "
+                       "(score_cache) - nagranie nie jest dekodowane.")
+    return finish_analysis(video_file, params, out, motion_peaks, load_motion_series(out["series_npy"]),
+                           cached["spatial_accum"], fps, frame_size, video_duration,
+                           screenshots_done=bool(screenshots), monitor=monitor)
+
+def analyze_video(video_file, output_dir, params, monitor=None):
+    """
+    Analiza jednego nagrania. monitor (AnalysisMonitor) zbiera czasy etapów
+    i przekazuje postęp do swojego callbacku; wynik zawiera podsumowanie
+    czasów pod kluczem "timings". Po ustawieniu monitor.cancel_event analiza
+    kończy się wyjątkiem AnalysisCancelled, a jej niepełne wyniki są usuwane.
+    """
+    monitor = monitor or AnalysisMonitor()
+    try:
+        return _analyze_video(video_file, output_dir, params, monitor)
+    except AnalysisCancelled:
+        if monitor.output is not None:
+            remove_partial_outputs(monitor.output)
+        # Punkt kontrolny wskazywałby na usunięte pliki
+        remove_checkpoint(params.get("checkpoint_path"))
+        raise
+
+def _analyze_video(video_file, output_dir, params, monitor):
+    if params.get("zones") or noise_floor_enabled(params):
+        # Strefy i tłumienie zmian oświetlenia potrzebują pełnej mapy różnic każdej klatki -
+        # tylko przebieg sekwencyjny
+        return _analyze_sequential(video_file, output_dir, params, monitor)
+    if params.get("score_cache"):
+        with monitor.stage("score_cache"):
+            cached = load_scores(score_cache_key(video_file, params), params)
+        if cached is not None:
+            return _analyze_cached(video_file, output_dir, params, cached, monitor)
+    if params.get("checkpoint_path"):
+        # Punkty kontrolne zapisuje tylko przebieg sekwencyjny
+        return _analyze_sequential(video_file, output_dir, params, monitor)
+    if params.get("coarse_scan"):
+        from coarse_scan import analyze_video_coarse
+        return analyze_video_coarse(video_file, output_dir, params, monitor)
+    if params.get("parallel_chunks", 0) > 1:
+        from chunked_analysis import analyze_video_chunked
+        return analyze_video_chunked(video_file, output_dir, params, monitor)
+    return _analyze_sequential(video_file, output_dir, params, monitor)
+
+def _save_loop_checkpoint(path, key, frame_idx, out, kernel, detector, spatial_accum, series_writer, screenshots,
+                          noise_floor=None):
+    rows, csv_bytes = series_writer.position()
+    state = {
+        "frame_idx": frame_idx,
+        "out": out,
+        "detector": {"current_peak": detector.current_peak, "peaks": detector.peaks,
+                     "last_frame": detector.last_frame},
+        "series": [rows, csv_bytes],
+        "peaks_seen": screenshots._peaks_seen,
+        "noise_floor": noise_floor.state() if noise_floor is not None else None,
     }
+    save_checkpoint(path, key, state, {"prev_gray": kernel.prev_gray, "spatial_accum": spatial_accum,
+                                       "peak_frame": screenshots._peak_frame})
+
+def _analyze_sequential(video_file, output_dir, params, monitor):
+    with monitor.stage("open_source"):
+        source = open_frame_source(video_file, params, monitor)
+    if source is None:
+        raise Exception(f"Nie udało się otworzyć pliku: {video_file}")
+    frame_count = source.frame_count
+    fps = source.fps
+    video_duration = frame_count / fps
+    frame_size = source.frame_size
+    
+    # Strefy nie są zapisywane w punkcie kontrolnym - z nimi analiza zawsze startuje od początku
+    checkpoint_path = params.get("checkpoint_path") if not params.get("zones") else None
+    checkpoint = None
+    if checkpoint_path:
+        key = checkpoint_key(video_file, params)
+        checkpoint = load_checkpoint(checkpoint_path, key)
+        checkpoint_seconds = float(params.get("checkpoint_seconds", CHECKPOINT_SECONDS))
+    out = checkpoint[0]["out"] if checkpoint else prepare_output(video_file, output_dir)
+    monitor.start(video_file, frame_count, timing_log_path(params, out), output=out)
+    
+    threshold = params["motion_threshold"]
+    detector = PeakDetector(threshold, params["seconds_before"], params["seconds_after"], fps, video_duration)
+    roi_top, roi_bottom = kernel_roi(params)
+    kernel = FrameKernel(params["flicker_filter_intensity"], roi_top=roi_top, roi_bottom=roi_bottom,
+                         gray_filter=params.get("flicker_filter_gray", False))
+    # Poziom szumu aktualizowany jest dla każdej zdekodowanej klatki - przy decode_fps rzadziej niż fps nagrania
+    noise_floor = NoiseFloor(params, fps / source.frame_step) if noise_floor_enabled(params) else None
+    if checkpoint:
+        # Klatka frame_idx jest już policzona - czytamy ją tylko, żeby ustawić dekoder za nią.
+        # Pozycję sprawdza dekoder, a nie licznik klatek: po niedokładnym przewinięciu seria
+        # i szczyty byłyby przesunięte, więc analiza zaczyna się wtedy od początku.
+        frame_idx = checkpoint[0]["frame_idx"]
+        source.seek(frame_idx)
+        ret, _ = source.read()
+        if not ret or source.decoder_position() != frame_idx:
+            monitor.notice(f"Nie udało się wznowić analizy od klatki {frame_idx + 1} "
+                           f"(niedokładne przewijanie nagrania) - analiza od początku")
+            checkpoint = None
+            source.seek(0)
+    if checkpoint:
+        state, arrays = checkpoint
+        detector.current_peak = state["detector"]["current_peak"]
+        detector.peaks = state["detector"]["peaks"]
+        detector.last_frame = state["detector"]["last_frame"]
+        if noise_floor is not None and state.get("noise_floor"):
+            noise_floor.restore(state["noise_floor"])
+            detector.threshold = noise_floor.threshold
+        spatial_accum = arrays["spatial_accum"].copy()
+        series_writer = MotionSeriesWriter(out["output_csv"], out["series_npy"], resume_from=state["series"])
+        kernel.restore(arrays["prev_gray"])
+        screenshots = ScreenshotCollector(frame_count, out["out_dir"], out["base_name"], out["timestamp"],
+                                          roi_top * 100, roi_bottom * 100,
+                                          peak_thumbnails=params.get("peak_thumbnails", False),
+                                          frame_range=(frame_idx + 1, None))
+        screenshots._peaks_seen = state["peaks_seen"]
+        screenshots._peak_frame = arrays.get("peak_frame")
+        monitor.resumed(frame_idx + 1)
+    else:
+        spatial_accum = np.zeros(spatial_accum_shape(frame_size, params), dtype=np.float32)
+        series_writer = MotionSeriesWriter(out["output_csv"], out["series_npy"])
+        ret, frame = source.read()
+        if not ret or frame is None:
+            source.release()
+            series_writer.close()
+            raise Exception(f"Nie udało się odczytać pierwszej klatki z {video_file}")
+        frame_idx = source.frame_index
+        kernel.reset(frame)
+        screenshots = ScreenshotCollector(frame_count, out["out_dir"], out["base_name"], out["timestamp"],
+                                          roi_top * 100, roi_bottom * 100,
+                                          peak_thumbnails=params.get("peak_thumbnails", False))
+        screenshots.offer(frame_idx, frame)
+    zone_analysis = None
+    if params.get("zones"):
+        from zones import ZoneAnalysis
+        zone_analysis = ZoneAnalysis(params["zones"], frame_size, params, fps, video_duration, out,
+                                     frame_step=source.frame_step)
+    preview = None
+    if params["show_motion"]:
+        from motion_preview import MotionPreview
+        preview = MotionPreview(params.get("motion_display_time", 2), params.get("motion_display_scale", 0.5))
+    stages = monitor.stages
+    kernel.timings = stages
+    clock = time.perf_counter
+    last_checkpoint = clock()
+    frames_read = 0
+    
+    try:
+        while True:
+            t0 = clock()
+            ret, frame = source.read()
+            stages["decode"] += clock() - t0
+            if not ret:
+                break
+            # Numer klatki nagrania - przy decode_fps kolejne klatki nie mają kolejnych numerów
+            frame_idx = source.frame_index
+            frames_read += 1
+            time_sec = frame_idx / fps
+            motion_score = kernel.process(frame, spatial_accum)
+            screenshots.offer(frame_idx, frame)
+            series_writer.append(frame_idx, time_sec, motion_score)
+        
+            # Po process() bieżąca klatka po filtrze jest w kernel.prev_gray (zamiana buforów)
+            if noise_floor is None or noise_floor.update(motion_score, kernel.prev_gray, detector):
+                new_peak = detector.update(frame_idx, motion_score)
+            else:
+                new_peak = False
+            if zone_analysis is not None:
+                zone_analysis.update(frame_idx, kernel.diff, noise_floor is not None and noise_floor.changed)
+            screenshots.observe_peak(frame_idx, frame, detector)
+            if new_peak and preview is not None:
+                # Podgląd w osobnym wątku - pętla nie czeka na wyświetlenie
+                preview.show(frame)
+            monitor.frames_done(frame_idx)
+            if checkpoint_path and frames_read % 256 == 0 and clock() - last_checkpoint >= checkpoint_seconds:
+                with monitor.stage("checkpoint"):
+                    _save_loop_checkpoint(checkpoint_path, key, frame_idx, out, kernel, detector, spatial_accum,
+                                          series_writer, screenshots, noise_floor)
+                last_checkpoint = clock()
+        motion_peaks = detector.finish()
+        screenshots.finish(detector)
+    finally:
+        source.release()
+        series_writer.close()
+        if zone_analysis is not None:
+            zone_analysis.close()
+        if preview is not None:
+            preview.close()
+    series = load_motion_series(out["series_npy"])
+    with monitor.stage("score_cache"):
+        cache_scores(video_file, params, series, spatial_accum, fps, frame_count, frame_size, video_duration, out)
+    zone_results = None
+    if zone_analysis is not None:
+        with monitor.stage("zones"):
+            zone_results = zone_analysis.finish(out, params)
+    
+    result = finish_analysis(video_file, params, out, motion_peaks, series,
+                             spatial_accum, fps, frame_size, video_duration, screenshots_done=True,
+                             monitor=monitor, video_source=source.temp_file)
+    if zone_results is not None:
+        result["zones"] = zone_results["zones"]
+    if noise_floor is not None:
+        result["noise_floor"] = noise_floor.summary()
+    remove_checkpoint(checkpoint_path)
+    return result
@@ -0,0 +1,170 @@
+# zones.py
+"""
+Wiele stref wykrywania ruchu w jednym przebiegu.
+
+Strefy podaje się w params["zones"] (np. w pliku JSON przekazanym przez -c),
+współrzędne w procentach szerokości/wysokości klatki:
+
+    "zones": [
+        {"name": "gorny_podest", "band": [5, 25]},
+        {"name": "bieg_1", "rect": [10, 25, 60, 55]},
+        {"name": "bieg_2", "polygon": [[40, 50], [90, 50], [95, 85], [35, 85]]},
+        {"name": "dolny_podest", "band": [85, 100]}
+    ]
+
+Wszystkie strefy korzystają z tej samej różnicy klatek (FrameKernel.diff),
+więc dekodowanie i filtr migotania liczone są raz. Prostokąty i pasy
+sumowane są bezpośrednio z wycinka różnicy albo - gdy strefy mocno się
+nakładają (łączna powierzchnia ponad dwie klatki) - z obrazu całkowego
+(cztery odczyty na strefę).
+Wielokąty liczone są na masce przyciętej do ich prostokąta otaczającego.
+Każda strefa ma własną maszynę stanów szczytów, próg adaptacyjny (NoiseFloor),
+serię wyników zapisywaną strumieniowo na dysk, raport i wykres. Klatki tłumione
+po zmianie oświetlenia całego kadru są pomijane we wszystkich strefach.
+"""
+
+import os
+import re
+
+import cv2
+import numpy as np
+
+from motion_series import MotionSeriesWriter, decimate_max, load_motion_series
+from noise_floor import NoiseFloor, noise_floor_enabled
+
+
+def _zone_name(spec, index):
+    name = spec.get("name") or f"strefa_{index}"
+    return re.sub(r"[^\w-]+", "_", name)
+
+
+def parse_zones(zone_specs, frame_size):
+    """Zamienia opisy stref (procenty) na prostokąty w pikselach i maski wielokątów."""
+    width, height = frame_size
+    zones = []
+    for index, spec in enumerate(zone_specs, 1):
+        name = _zone_name(spec, index)
+        mask = None
+        if "band" in spec:
+            top, bottom = spec["band"]
+            x0, y0, x1, y1 = 0, int(top / 100 * height), width, int(bottom / 100 * height)
+        elif "rect" in spec:
+            left, top, right, bottom = spec["rect"]
+            x0, y0 = int(left / 100 * width), int(top / 100 * height)
+            x1, y1 = int(right / 100 * width), int(bottom / 100 * height)
+        elif "polygon" in spec:
+            points = np.array([[x / 100 * width, y / 100 * height] for x, y in spec["polygon"]], dtype=np.float32)
+            points = np.round(points).astype(np.int32)
+            x0, y0 = np.maximum(points.min(axis=0), 0)
+            x1, y1 = np.minimum(points.max(axis=0) + 1, [width, height])
+            mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+            cv2.fillPoly(mask, [points - [x0, y0]], 255)
+        else:
+            raise ValueError(f"Strefa {name}: wymagane jest pole band, rect lub polygon")
+        x0, x1 = max(0, min(x0, width)), max(0, min(x1, width))
+        y0, y1 = max(0, min(y0, height)), max(0, min(y1, height))
+        if x1 <= x0 or y1 <= y0 or (mask is not None and not mask.any()):
+            raise ValueError(f"Strefa {name} jest pusta")
+        zones.append({"index": index - 1, "name": name, "rect": (int(x0), int(y0), int(x1), int(y1)),
+                      "mask": mask})
+    names = [zone["name"] for zone in zones]
+    if len(set(names)) != len(names):
+        raise ValueError("Nazwy stref muszą być unikalne")
+    return zones
+
+
+class ZoneScorer:
+    """Średnia różnica klatek w każdej strefie, liczona z jednej mapy różnic."""
+
+    def __init__(self, zone_specs, frame_size):
+        self.zones = parse_zones(zone_specs, frame_size)
+        self.names = [zone["name"] for zone in self.zones]
+        self._rects = [zone for zone in self.zones if zone["mask"] is None]
+        self._polygons = [zone for zone in self.zones if zone["mask"] is not None]
+        rect_area = sum((z["rect"][2] - z["rect"][0]) * (z["rect"][3] - z["rect"][1]) for z in self._rects)
+        width, height = frame_size
+        # Obraz całkowy kosztuje mniej więcej tyle, co dwa przejścia po klatce -
+        # opłaca się dopiero przy wielu nakładających się strefach
+        self.use_integral = rect_area > 2 * width * height
+        # Suma int32 wystarcza do 2^31 / 255 pikseli
+        self._integral_depth = cv2.CV_32S if width * height < (1 << 31) // 255 else cv2.CV_64F
+        self._integral = None
+        self.scores = np.zeros(len(self.zones), dtype=np.float64)
+
+    def score(self, diff):
+        scores = self.scores
+        if self._rects:
+            if self.use_integral:
+                self._integral = cv2.integral(diff, self._integral, sdepth=self._integral_depth)
+                integral = self._integral
+                for zone in self._rects:
+                    x0, y0, x1, y1 = zone["rect"]
+                    total = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+                    scores[zone["index"]] = total / ((x1 - x0) * (y1 - y0))
+            else:
+                for zone in self._rects:
+                    x0, y0, x1, y1 = zone["rect"]
+                    scores[zone["index"]] = cv2.mean(diff[y0:y1, x0:x1])[0]
+        for zone in self._polygons:
+            x0, y0, x1, y1 = zone["rect"]
+            scores[zone["index"]] = cv2.mean(diff[y0:y1, x0:x1], mask=zone["mask"])[0]
+        return scores
+
+
+class ZoneAnalysis:
+    """
+    Wyniki stref klatka po klatce: osobny PeakDetector, NoiseFloor i seria na dysku
+    (MotionSeriesWriter, pliki analiza_ruchu_*_<strefa>) dla każdej strefy.
+    Zmianę oświetlenia ocenia bramka całego kadru - strefy dostają jej wynik.
+    """
+
+    def __init__(self, zone_specs, frame_size, params, fps, video_duration, out, frame_step=1.0):
+        from video_processing import PeakDetector
+        self.scorer = ZoneScorer(zone_specs, frame_size)
+        self.names = self.scorer.names
+        self.fps = fps
+        self.detectors = [PeakDetector(params["motion_threshold"], params["seconds_before"],
+                                       params["seconds_after"], fps, video_duration) for _ in self.names]
+        # Poziom szumu każdej strefy jest inny (np. oświetlony podest i ciemny bieg schodów)
+        self.noise_floors = None
+        if noise_floor_enabled(params):
+            self.noise_floors = [NoiseFloor(params, fps / frame_step) for _ in self.names]
+        self.paths = {}
+        self.writers = []
+        for name in self.names:
+            prefix = os.path.join(out["out_dir"], f"analiza_ruchu_{out['base_name']}_{out['timestamp']}_{name}")
+            self.paths[name] = {"output_csv": f"{prefix}.csv", "series_npy": f"{prefix}.npy"}
+            self.writers.append(MotionSeriesWriter(f"{prefix}.csv", f"{prefix}.npy"))
+
+    def update(self, frame_idx, diff, illumination_changed=False):
+        """illumination_changed - wynik NoiseFloor całego kadru dla tej klatki (NoiseFloor.changed)."""
+        scores = self.scorer.score(diff).tolist()
+        time_sec = frame_idx / self.fps
+        for i, score in enumerate(scores):
+            self.writers[i].append(frame_idx, time_sec, score)
+            if self.noise_floors is None or self.noise_floors[i].update(score, detector=self.detectors[i],
+                                                                        changed=illumination_changed):
+                self.detectors[i].update(frame_idx, score)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def finish(self, out, params):
+        """Zapisuje raport i wykres każdej strefy; zwraca {nazwa: wyniki strefy}."""
+        from video_processing import merge_motion_peaks, plot_motion_series, write_peaks_report
+        self.close()
+        out_dir, base_name, timestamp = out["out_dir"], out["base_name"], out["timestamp"]
+        results = {}
+        for i, name in enumerate(self.names):
+            merged = merge_motion_peaks(self.detectors[i].finish(), frame_tolerance=5,
+                                        gap_threshold=params["merge_gap_threshold"])
+            report = os.path.join(out_dir, f"szczytowe_momenty_{base_name}_{timestamp}_{name}.txt")
+            write_peaks_report(merged, report)
+            series = load_motion_series(self.paths[name]["series_npy"])
+            plot = os.path.join(out_dir, f"wykres_ruchu_{base_name}_{timestamp}_{name}.png")
+            plot_motion_series(*decimate_max(series), params["motion_threshold"], plot)
+            results[name] = dict(self.paths[name], peaks=merged, peaks_txt=report, motion_plot=plot)
+            if self.noise_floors is not None:
+                results[name]["noise_floor"] = self.noise_floors[i].summary()
+        return {"zones": results}